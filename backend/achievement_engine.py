@@ -0,0 +1,128 @@
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Which user counter each achievement category is measured against
+CATEGORY_COUNTERS = {
+    "referrals": "total_referrals",
+    "earnings": "total_earnings",
+}
+
+
+class AchievementEngine:
+    """Threshold index over the achievement catalog
+
+    Achievements are kept sorted by target_value within each category. For
+    every user we remember how far into each sorted list their counter has
+    already been checked, so a new counter value only needs a bisect to find
+    the thresholds crossed since last time. Rewards are paid in earnings, so
+    an unlock re-checks the earnings category until no new tier is crossed.
+
+    That per-user progress lives in an LRU of ``max_users`` entries. A user
+    evicted from it (or checked under an older catalog version) starts over
+    from the achievements storage already has, which costs one full bisect
+    per category but never unlocks anything twice.
+    """
+
+    def __init__(self, catalog: Iterable[dict] = (), max_users: int = 100000):
+        self.catalog: Dict[str, dict] = {}
+        self._by_category: Dict[str, List[dict]] = {}
+        self._targets: Dict[str, List[float]] = {}
+        self.max_users = max_users
+        # user id -> (catalog_version, unlocked ids, checked index per category)
+        self._progress: "OrderedDict[str, Tuple[int, Set[str], Dict[str, int]]]" = OrderedDict()
+        self.evicted = 0
+        self.catalog_version = 0
+        self.load_catalog(catalog)
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_users=int(os.getenv("ACHIEVEMENT_CACHE_USERS", "100000")))
+
+    def load_catalog(self, achievements: Iterable[dict]):
+        """Replace the catalog; per-user progress is rebuilt on next evaluation
+
+        Bumping ``catalog_version`` is what invalidates the progress, lazily,
+        the next time each user is evaluated.
+        """
+        self.catalog = {achievement["id"]: achievement for achievement in achievements}
+        self._by_category = {}
+        for achievement in self.catalog.values():
+            if achievement["category"] in CATEGORY_COUNTERS:
+                self._by_category.setdefault(achievement["category"], []).append(achievement)
+        for achievements_list in self._by_category.values():
+            achievements_list.sort(key=lambda a: a["target_value"])
+        self._targets = {
+            category: [a["target_value"] for a in achievements_list]
+            for category, achievements_list in self._by_category.items()
+        }
+        self.catalog_version += 1
+
+    def __len__(self) -> int:
+        return len(self._progress)
+
+    def forget(self, user_id: str):
+        self._progress.pop(user_id, None)
+
+    def clear(self):
+        self._progress.clear()
+
+    def _user_progress(self, user: dict) -> Tuple[Set[str], Dict[str, int]]:
+        progress = self._progress.get(user["id"])
+        if progress is not None and progress[0] == self.catalog_version:
+            self._progress.move_to_end(user["id"])
+            return progress[1], progress[2]
+        # Unknown, evicted or stale: seed from what storage has, check every tier again
+        unlocked, checked = set(user.get("achievements", [])), {}
+        if progress is not None:
+            unlocked |= progress[1]
+        self._progress[user["id"]] = (self.catalog_version, unlocked, checked)
+        self._progress.move_to_end(user["id"])
+        while len(self._progress) > self.max_users:
+            self._progress.popitem(last=False)
+            self.evicted += 1
+        return unlocked, checked
+
+    def unlocked(self, user: dict) -> Set[str]:
+        return self._user_progress(user)[0]
+
+    def _newly_crossed(self, checked: Dict[str, int], unlocked: Set[str], category: str, value) -> List[dict]:
+        start = checked.get(category, 0)
+        end = bisect_right(self._targets[category], value)
+        if end <= start:
+            return []
+        checked[category] = end
+        return [a for a in self._by_category[category][start:end] if a["id"] not in unlocked]
+
+    def evaluate(self, user: dict) -> List[dict]:
+        """Achievements the user qualifies for but has not unlocked yet
+
+        Marks them unlocked in the engine; the caller persists them and pays
+        the rewards. Chained unlocks (a reward crossing the next earnings tier)
+        are included in catalog order.
+        """
+        unlocked, checked = self._user_progress(user)
+        counters = {category: user.get(field, 0) for category, field in CATEGORY_COUNTERS.items()}
+
+        newly_unlocked = []
+        pending = list(self._by_category)
+        while pending:
+            category = pending.pop(0)
+            for achievement in self._newly_crossed(checked, unlocked, category, counters[category]):
+                unlocked.add(achievement["id"])
+                newly_unlocked.append(achievement)
+                if achievement["reward_amount"]:
+                    counters["earnings"] += achievement["reward_amount"]
+                    if "earnings" in self._by_category and "earnings" not in pending:
+                        pending.append("earnings")
+        return newly_unlocked
+
+    def stats(self) -> dict:
+        return {
+            "catalog_version": self.catalog_version,
+            "achievements": len(self.catalog),
+            "cached_users": len(self._progress),
+            "max_users": self.max_users,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,218 @@
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class TokenBucketMap:
+    """Token buckets per key (client IP, link code) in a bounded LRU
+
+    A bucket holds up to ``burst`` tokens and refills at ``rate`` per second;
+    each request takes one. A bucket idle long enough to be full again is
+    indistinguishable from a new one, so those are dropped from the cold end
+    as requests come in, and ``max_keys`` caps the map when an attacker
+    sprays fresh keys (the evicted key just starts over with a full bucket).
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._refill_time = burst / rate
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, now: float) -> float:
+        """0 if a token was taken, otherwise seconds until the next one"""
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            buckets.move_to_end(key)
+
+        # Expire refilled buckets from the LRU end, then enforce the bound
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if now - oldest[1] < self._refill_time:
+                break
+            buckets.popitem(last=False)
+        while len(buckets) > self.max_keys:
+            buckets.popitem(last=False)
+            self.evicted += 1
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+
+class RouteClass:
+    """Limits for one group of public routes"""
+
+    def __init__(
+        self,
+        name: str,
+        ip_rate: float = 0.0,
+        ip_burst: float = 0.0,
+        key_rate: float = 0.0,
+        key_burst: float = 0.0,
+        max_concurrency: int = 0,
+        max_keys: int = 100000,
+    ):
+        self.name = name
+        self.per_ip = TokenBucketMap(ip_rate, ip_burst, max_keys) if ip_rate > 0 else None
+        self.per_key = TokenBucketMap(key_rate, key_burst, max_keys) if key_rate > 0 else None
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+
+        # Counters
+        self.admitted = 0
+        self.rejected_ip = 0
+        self.rejected_key = 0
+        self.rejected_concurrency = 0
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rejected_ip": self.rejected_ip,
+            "rejected_key": self.rejected_key,
+            "rejected_concurrency": self.rejected_concurrency,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "tracked_ips": len(self.per_ip) if self.per_ip else 0,
+            "tracked_keys": len(self.per_key) if self.per_key else 0,
+        }
+
+
+class AdmissionController:
+    """Rate limits and concurrency caps checked before any route work runs
+
+    Requests are matched to a route class by method and path: the
+    unauthenticated ``/api/login``, ``/api/register`` and
+    ``/api/track-click/{link_code}``. Each class can have a token bucket per
+    client IP, one per path key (the link code for clicks) and a cap on
+    requests in flight. Over a rate limit the client gets 429 with
+    ``Retry-After``; over the concurrency cap the worker answers 503 right
+    away instead of queueing behind bcrypt or the click pipeline.
+    """
+
+    def __init__(self, classes: Dict[str, RouteClass], enabled: bool = True):
+        self.classes = classes
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls):
+        max_keys = int(os.getenv("ADMISSION_MAX_KEYS", "100000"))
+
+        def route_class(name: str, ip_rate: str, ip_burst: str, concurrency: str,
+                        key_rate: str = "0", key_burst: str = "0") -> RouteClass:
+            prefix = f"ADMISSION_{name.upper()}"
+            return RouteClass(
+                name,
+                ip_rate=float(os.getenv(f"{prefix}_IP_RATE", ip_rate)),
+                ip_burst=float(os.getenv(f"{prefix}_IP_BURST", ip_burst)),
+                key_rate=float(os.getenv(f"{prefix}_LINK_RATE", key_rate)),
+                key_burst=float(os.getenv(f"{prefix}_LINK_BURST", key_burst)),
+                max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+                max_keys=max_keys,
+            )
+
+        return cls(
+            {
+                "click": route_class("click", "2", "20", "256", key_rate="100", key_burst="500"),
+                "login": route_class("login", "0.2", "10", "32"),
+                "register": route_class("register", "0.1", "5", "32"),
+            },
+            enabled=os.getenv("ADMISSION_ENABLED", "true").lower() == "true",
+        )
+
+    def classify(self, method: str, path: str) -> Optional[Tuple[RouteClass, str, str]]:
+        """(route class, path key, route template) for limited routes"""
+        if method != "POST":
+            return None
+        if path.startswith("/api/track-click/"):
+            route = self.classes.get("click")
+            return (route, path[len("/api/track-click/"):], "/api/track-click/{link_code}") if route else None
+        if path == "/api/login" or path == "/api/register":
+            route = self.classes.get(path[5:])
+            return (route, "", path) if route else None
+        return None
+
+    def admit(self, route: RouteClass, ip: str, key: str) -> Optional[Tuple[int, float]]:
+        """None to let the request in, else (status, retry_after)"""
+        if route.max_concurrency and route.in_flight >= route.max_concurrency:
+            route.rejected_concurrency += 1
+            return 503, 1.0
+        now = time.monotonic()
+        if route.per_ip is not None:
+            wait = route.per_ip.take(ip, now)
+            if wait:
+                route.rejected_ip += 1
+                return 429, wait
+        if route.per_key is not None and key:
+            wait = route.per_key.take(key, now)
+            if wait:
+                route.rejected_key += 1
+                return 429, wait
+        route.admitted += 1
+        return None
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, **{name: route.stats() for name, route in self.classes.items()}}
+
+
+class AdmissionMiddleware:
+    """Plain ASGI middleware applying an ``AdmissionController`` before routing"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if scope["type"] != "http" or not controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        match = controller.classify(scope["method"], scope["path"])
+        if match is None:
+            await self.app(scope, receive, send)
+            return
+
+        route, key, template = match
+        client = scope.get("client")
+        rejection = controller.admit(route, client[0] if client else "", key)
+        if rejection is not None:
+            status, retry_after = rejection
+            # Route template for the request metrics, the router never sees this request
+            scope["route_path"] = template
+            await _reject(send, status, retry_after)
+            return
+
+        route.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route.in_flight -= 1
+
+
+async def _reject(send, status: int, retry_after: float):
+    detail = "Too many requests, please slow down" if status == 429 else "Server is busy, please retry shortly"
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
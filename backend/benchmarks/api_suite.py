@@ -0,0 +1,377 @@
+"""Throughput and latency of the API hot paths, in-process (ASGI) or over a local socket
+
+Seeds synthetic users, referral links and clicks straight into storage, then
+drives each scenario with a fixed number of concurrent callers and reports
+req/s and p50/p95/p99. Results can be written as JSON and compared against
+a stored baseline (--fail-on-regression exits 1 past --threshold).
+
+    cd backend
+    python benchmarks/api_suite.py --users 100000 --clicks 1000000 --output bench.json
+    python benchmarks/api_suite.py --users 100000 --clicks 1000000 --baseline bench.json --fail-on-regression
+    python benchmarks/api_suite.py --transport socket --scenarios login,track-click
+
+Passwords are hashed with BCRYPT_ROUNDS=4 unless --bcrypt-rounds says
+otherwise, so register/login measure the app rather than bcrypt.
+Seeded clicks go to link counters and analytics rollups; the raw click
+table only receives the clicks made during the run.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCH_DIR, "..", ".."))
+sys.path.insert(0, BENCH_DIR)
+# Shared modules (storage, rollups, ...) that both apps import
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+from loadgen import asgi_request, http_request, summarize  # noqa: E402
+
+PASSWORD = "bench-password"
+APPS = {
+    "backend": os.path.join(ROOT, "backend", "main.py"),
+    "fastapi": os.path.join(ROOT, "fastapi_backend", "main.py"),
+}
+# Scenario -> apps that serve it
+SCENARIOS = {
+    "register": ("backend", "fastapi"),
+    "login": ("backend", "fastapi"),
+    "track-click": ("fastapi",),
+    "leaderboard": ("backend", "fastapi"),
+    "analytics": ("fastapi",),
+    "achievements": ("backend",),
+    "admin-stats": ("backend", "fastapi"),
+}
+# Tokens and emails handed to the load generators (enough to spread the load)
+SAMPLE_SIZE = 1000
+
+
+def load_app(name: str):
+    spec = importlib.util.spec_from_file_location(f"bench_{name}_main", APPS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Synthetic data
+async def seed(module, users: int, links: int, clicks: int, batch_size: int = 10000) -> dict:
+    """Bulk-load users, links and clicks through the app's storage; returns request inputs"""
+    rng = random.Random(42)
+    password_hash = await module.password_hasher.hash(PASSWORD)
+    now = datetime.utcnow()
+    user_ids = []
+
+    for start in range(0, users, batch_size):
+        batch = []
+        for i in range(start, min(users, start + batch_size)):
+            user_id = str(uuid.uuid4())
+            user_ids.append(user_id)
+            batch.append({
+                "id": user_id,
+                "first_name": f"User{i}",
+                "last_name": "Bench",
+                "email": f"user{i}@bench.dev",
+                "password_hash": password_hash,
+                "referral_code": f"B{i:07d}",
+                "total_referrals": rng.randint(0, 50),
+                "total_earnings": float(rng.randint(0, 2500)),
+                "achievements": [],
+                "created_at": (now - timedelta(days=rng.randint(0, 365))).isoformat(),
+            })
+        await module.storage.insert_users(batch)
+
+    link_records = []
+    for i in range(links):
+        owner = i % users
+        referral = await module.storage.insert_referral({
+            "id": str(uuid.uuid4()),
+            "user_id": user_ids[owner],
+            "user_name": f"Friend{i}",
+            "link_code": f"B{owner:07d}-{i}",
+            "full_url": f"http://localhost:8080/register?ref=B{owner:07d}-{i}",
+            "click_count": 0,
+            "registration_count": 0,
+            "created_at": now.isoformat(),
+        })
+        link_records.append(referral)
+
+    # Clicks: spread over the last 14 days in a handful of hourly buckets per link
+    rollups = getattr(module, "rollups", None)
+    if clicks and link_records:
+        per_link, extra = divmod(clicks, len(link_records))
+        for i, referral in enumerate(link_records):
+            count = per_link + (1 if i < extra else 0)
+            if not count:
+                continue
+            await module.storage.increment_referral(referral["id"], click_count=count)
+            if rollups is not None:
+                buckets = min(count, 24)
+                share, rest = divmod(count, buckets)
+                for b in range(buckets):
+                    at = now - timedelta(hours=rng.randint(0, 14 * 24 - 1))
+                    rollups.record_click(referral["id"], referral["user_id"], at, count=share + (1 if b < rest else 0))
+
+    sample = range(min(users, SAMPLE_SIZE))
+    # Link owners first, so analytics has links to rank
+    owners = list(dict.fromkeys(referral["user_id"] for referral in link_records[:SAMPLE_SIZE]))
+    expires = timedelta(days=1)
+    return {
+        "emails": [f"user{i}@bench.dev" for i in sample],
+        "tokens": [module.create_access_token({"sub": user_ids[i]}, expires) for i in sample],
+        "owner_tokens": [module.create_access_token({"sub": user_id}, expires) for user_id in owners],
+        "link_codes": [referral["link_code"] for referral in link_records[:SAMPLE_SIZE]],
+    }
+
+
+def build_request(scenario: str, inputs: dict, caller: str, i: int):
+    """(method, path, body, headers) for request ``i`` of a caller"""
+    if scenario == "register":
+        body = {"firstName": "New", "lastName": "User", "email": f"new-{caller}-{i}@bench.dev", "password": PASSWORD}
+        return "POST", "/api/register", json.dumps(body).encode(), ()
+    if scenario == "login":
+        body = {"email": inputs["emails"][i % len(inputs["emails"])], "password": PASSWORD}
+        return "POST", "/api/login", json.dumps(body).encode(), ()
+    if scenario == "track-click":
+        # A distinct visitor per request, so every click is a first visit
+        return ("POST", f"/api/track-click/{inputs['link_codes'][i % len(inputs['link_codes'])]}", b"",
+                (("User-Agent", f"bench-{caller}-{i}"),))
+    if scenario == "leaderboard":
+        return "GET", f"/api/leaderboard?offset={(i % 10) * 10}&limit=10", b"", ()
+    if scenario == "admin-stats":
+        return "GET", "/api/admin/stats", b"", (("X-Admin-Token", os.environ["ADMIN_TOKEN"]),)
+    tokens = inputs["owner_tokens"] if scenario == "analytics" else inputs["tokens"]
+    path = "/api/analytics?days=7" if scenario == "analytics" else "/api/achievements"
+    return "GET", path, b"", (("Authorization", f"Bearer {tokens[i % len(tokens)]}"),)
+
+
+# In-process transport
+async def run_inprocess(app, scenario: str, inputs: dict, concurrency: int, duration: float, run_id: str) -> dict:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def caller(n: int):
+        nonlocal errors
+        i = 0
+        while time.perf_counter() < deadline:
+            method, path, body, headers = build_request(scenario, inputs, f"{run_id}-{n}", i)
+            started = time.perf_counter()
+            status = await asgi_request(app, method, path, body, headers)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller(n) for n in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+# Socket transport: uvicorn in this process, load from client processes
+async def _socket_client(port: int, scenario: str, inputs: dict, caller_prefix: str, connections: int, duration: float):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def connection(n: int):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        i = 0
+        while time.perf_counter() < deadline:
+            method, path, body, headers = build_request(scenario, inputs, f"{caller_prefix}-{n}", i)
+            started = time.perf_counter()
+            status = await http_request(reader, writer, method, path, body, headers)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            i += 1
+        writer.close()
+
+    await asyncio.gather(*(connection(n) for n in range(connections)))
+    return latencies, errors
+
+
+def _socket_client_process(args):
+    return asyncio.run(_socket_client(*args))
+
+
+def run_socket_clients(port: int, scenario: str, inputs: dict, clients: int, concurrency: int,
+                       duration: float, run_id: str) -> dict:
+    connections = max(1, concurrency // clients)
+    started = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(clients) as pool:
+        results = pool.map(_socket_client_process, [
+            (port, scenario, inputs, f"{run_id}-c{c}", connections, duration) for c in range(clients)
+        ])
+    # Pool start-up is not part of the run
+    elapsed = min(duration, time.perf_counter() - started)
+    return summarize([lat for result, _ in results for lat in result], sum(e for _, e in results), elapsed)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Driver
+async def bench_app(name: str, args, scenarios) -> dict:
+    import uvicorn
+
+    module = load_app(name)
+    app = module.app
+    results = {"seed_seconds": 0.0, "scenarios": {}}
+    server = server_task = None
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        inputs = await seed(module, args.users, args.links, args.clicks if name == "fastapi" else 0)
+        results["seed_seconds"] = round(time.perf_counter() - started, 2)
+        print(f"[{name}] seeded {args.users} users, {args.links} links"
+              f"{f', {args.clicks} clicks' if name == 'fastapi' else ''} in {results['seed_seconds']}s")
+
+        if args.transport == "socket":
+            port = free_port()
+            # Lifespan already ran above; the server only serves requests
+            server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning", access_log=False, lifespan="off"))
+            server_task = asyncio.create_task(server.serve())
+            while not server.started:
+                await asyncio.sleep(0.05)
+
+        try:
+            for scenario in scenarios:
+                run_id = uuid.uuid4().hex[:8]
+                if args.transport == "socket":
+                    if args.warmup:
+                        await asyncio.to_thread(run_socket_clients, port, scenario, inputs, args.clients,
+                                                args.concurrency, args.warmup, run_id + "w")
+                    result = await asyncio.to_thread(run_socket_clients, port, scenario, inputs, args.clients,
+                                                     args.concurrency, args.duration, run_id)
+                else:
+                    if args.warmup:
+                        await run_inprocess(app, scenario, inputs, args.concurrency, args.warmup, run_id + "w")
+                    result = await run_inprocess(app, scenario, inputs, args.concurrency, args.duration, run_id)
+                results["scenarios"][scenario] = result
+                print(f"[{name}] {scenario:<13}{result['rps']:>10.1f} req/s   p50 {result['p50_ms']:8.2f} ms"
+                      f"   p95 {result['p95_ms']:8.2f} ms   p99 {result['p99_ms']:8.2f} ms   errors {result['errors']}")
+        finally:
+            if server is not None:
+                server.should_exit = True
+                await server_task
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """Print the change against a baseline report; True if something regressed"""
+    regressed = False
+    print(f"\nvs baseline {baseline['meta'].get('git_commit')} ({baseline['meta'].get('created_at')})")
+    print(f"{'app':<9}{'scenario':<14}{'req/s':>10}{'Δ':>9}{'p99 ms':>10}{'Δ':>9}")
+    for app_name, app_results in report["results"].items():
+        for scenario, result in app_results["scenarios"].items():
+            before = baseline["results"].get(app_name, {}).get("scenarios", {}).get(scenario)
+            if before is None:
+                print(f"{app_name:<9}{scenario:<14}{result['rps']:>10.1f}{'new':>9}{result['p99_ms']:>10.2f}")
+                continue
+            rps_change = (result["rps"] - before["rps"]) / before["rps"] if before["rps"] else 0.0
+            p99_change = (result["p99_ms"] - before["p99_ms"]) / before["p99_ms"] if before["p99_ms"] else 0.0
+            flag = ""
+            if rps_change < -threshold or p99_change > threshold or result["errors"] > before["errors"]:
+                flag = "  ⚠️ regression"
+                regressed = True
+            print(f"{app_name:<9}{scenario:<14}{result['rps']:>10.1f}{rps_change:>+9.1%}"
+                  f"{result['p99_ms']:>10.2f}{p99_change:>+9.1%}{flag}")
+    for key in ("users", "links", "clicks", "transport", "concurrency"):
+        if baseline["meta"].get(key) != report["meta"].get(key):
+            print(f"⚠️ baseline {key}={baseline['meta'].get(key)} differs from this run ({report['meta'].get(key)})")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="all", choices=["all", *APPS])
+    parser.add_argument("--transport", default="inprocess", choices=["inprocess", "socket"])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--links", type=int, help="referral links (default: users / 10)")
+    parser.add_argument("--clicks", type=int, help="seeded clicks (default: users * 10)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds of unmeasured load first")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="client processes (socket transport)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging (0.10 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if a scenario regressed")
+    args = parser.parse_args()
+    args.links = args.links if args.links is not None else max(1, args.users // 10)
+    args.clicks = args.clicks if args.clicks is not None else args.users * 10
+
+    data_dir = tempfile.mkdtemp(prefix="api-bench-")
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("PASSWORD_HASH_QUEUE_TIMEOUT", "60")
+    # All load comes from one address; rate limits would turn the run into a 429 benchmark
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    os.environ.setdefault("CLICKS_SQLITE_PATH", os.path.join(data_dir, "clicks.db"))
+    os.environ.setdefault("SQLITE_PATH", os.path.join(data_dir, "referrals.db"))
+    os.environ.setdefault("ADMIN_TOKEN", "bench-admin-token")
+
+    apps = list(APPS) if args.app == "all" else [args.app]
+    wanted = args.scenarios.split(",")
+    unknown = set(wanted) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "storage_backend": os.getenv("STORAGE_BACKEND", "memory"),
+            "transport": args.transport,
+            "users": args.users,
+            "links": args.links,
+            "clicks": args.clicks,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "results": {},
+    }
+    for name in apps:
+        scenarios = [scenario for scenario in wanted if name in SCENARIOS[scenario]]
+        if scenarios:
+            report["results"][name] = asyncio.run(bench_app(name, args, scenarios))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold) and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Cohort retention/churn query time over a synthetic user base
+
+    cd backend && python benchmarks/cohort_retention.py [users] [active_days_per_user]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cohorts import CohortAnalyzer  # noqa: E402
+
+
+def build(user_count: int, active_days: int) -> CohortAnalyzer:
+    analyzer = CohortAnalyzer()
+    today = datetime.utcnow().toordinal()
+    ids = [f"user-{i}" for i in range(user_count)]
+    for i, user_id in enumerate(ids):
+        signup = today - random.randrange(365)
+        # Half the users came in through someone else's code
+        referrer = ids[random.randrange(i)] if i and random.random() < 0.5 else None
+        analyzer.add_user(user_id, date.fromordinal(signup), referrer)
+        for day in sorted(random.randint(signup, today) for _ in range(random.randrange(active_days * 2 + 1))):
+            analyzer.record_activity(user_id, date.fromordinal(day))
+    return analyzer
+
+
+async def run(analyzer: CohortAnalyzer):
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=364)
+    for metric in ("activity", "referrals"):
+        for period in ("week", "month"):
+            started = time.perf_counter()
+            result = await analyzer.retention(start, end, period, metric, periods=12)
+            elapsed = (time.perf_counter() - started) * 1000
+            cached_started = time.perf_counter()
+            await analyzer.retention(start, end, period, metric, periods=12)
+            cached = (time.perf_counter() - cached_started) * 1000
+            print(f"{metric:9} {period:5} {len(result['cohorts']):3} cohorts: {elapsed:7.1f} ms "
+                  f"(cached {cached:.2f} ms), churn {result['summary']['churn_rate']}%")
+
+
+def main(user_count: int, active_days: int):
+    random.seed(1)
+    started = time.perf_counter()
+    analyzer = build(user_count, active_days)
+    stats = analyzer.stats()
+    print(f"{stats['users']} users, {stats['events']} events, {stats['memory_bytes'] / 1e6:.1f} MB of columns "
+          f"(built in {time.perf_counter() - started:.1f}s)")
+    asyncio.run(run(analyzer))
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2,
+    )
@@ -0,0 +1,96 @@
+"""Small load-generation helpers shared by the benchmark scripts"""
+import asyncio
+from typing import Dict, List, Sequence, Tuple
+
+
+async def http_request(reader, writer, method: str, path: str, body: bytes = b"",
+                       headers: Sequence[Tuple[str, str]] = ()) -> int:
+    """One request on a keep-alive HTTP/1.1 connection; returns the status code"""
+    extra = "".join(f"{name}: {value}\r\n" for name, value in headers)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n{extra}"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Server closed the connection")
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        if name.lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def asgi_request(app, method: str, path: str, body: bytes = b"",
+                       headers: Sequence[Tuple[str, str]] = ()) -> int:
+    """Call an ASGI app directly, without a server or socket; returns the status code"""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *((name.lower().encode(), value.encode()) for name, value in headers),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    done = asyncio.Event()
+    body_sent = False
+    status = 0
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Only disconnect listeners get here; the client "leaves" once the response is out
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    """Throughput and latency percentiles (ms) for one run"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(p: float) -> float:
+        if not count:
+            return 0.0
+        return round(latencies[min(count - 1, int(count * p))] * 1000, 3)
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
@@ -0,0 +1,106 @@
+"""Bytes per user/click as plain dicts vs slotted records, plus response encoding time
+
+    cd backend && python benchmarks/memory_records.py [count]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from records import Click, User, dump_json  # noqa: E402
+
+
+class LegacyClickEvent(NamedTuple):
+    """The click tuple the pipeline used before records"""
+    link_code: str
+    ip_address: Optional[str]
+    user_agent: Optional[str]
+    clicked_at: datetime
+    completed_registration: bool = False
+    completed_email: Optional[str] = None
+
+
+def user_fields(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "first_name": f"First{i}",
+        "last_name": f"Last{i}",
+        "email": f"user{i}@example.com",
+        "password_hash": "$2b$12$" + "x" * 53,
+        "referral_code": f"C{i:05d}",
+        "total_referrals": i % 50,
+        "total_earnings": float(i % 500),
+        "achievements": [],
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+def click_fields(i: int) -> dict:
+    return {
+        "link_code": f"C{i % 1000:05d}-20240101000000",
+        "ip_address": f"10.0.{i % 256}.{i % 200}",
+        "user_agent": "Mozilla/5.0",
+        "clicked_at": datetime.utcnow(),
+        "completed_registration": False,
+        "completed_email": None,
+    }
+
+
+def bytes_per_item(make, fields, count: int) -> float:
+    """Retained bytes per object, not counting the field values themselves"""
+    values = [fields(i) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [make(v) for v in values]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return (after - before) / count
+
+
+def encode_ms(encode, count: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(count: int):
+    print(f"{count} objects each\n")
+    print(f"{'object':<28}{'bytes/item':>12}")
+    rows = [
+        ("user as dict", bytes_per_item(dict, user_fields, count)),
+        ("user as User record", bytes_per_item(lambda v: User(**v), user_fields, count)),
+        ("click as dict", bytes_per_item(dict, click_fields, count)),
+        ("click as NamedTuple", bytes_per_item(lambda v: LegacyClickEvent(**v), click_fields, count)),
+        ("click as Click record", bytes_per_item(lambda v: Click(**v), click_fields, count)),
+    ]
+    for name, size in rows:
+        print(f"{name:<28}{size:>12.1f}")
+
+    users_dicts = [user_fields(i) for i in range(count)]
+    users_records = [User(**fields) for fields in users_dicts]
+
+    def old_path():
+        # What the handlers did: copy without password_hash, then json.dumps
+        payload = [{k: v for k, v in u.items() if k != "password_hash"} for u in users_dicts]
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def new_path():
+        return dump_json(users_records)
+
+    assert old_path() == new_path()
+    print(f"\n{'serialize users':<28}{'ms':>12}")
+    print(f"{'dict copy + json.dumps':<28}{encode_ms(old_path, count):>12.2f}")
+    print(f"{'dump_json(records)':<28}{encode_ms(new_path, count):>12.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,178 @@
+"""Throughput of register, login and track-click as uvicorn workers are added
+
+Starts fastapi_backend under ``uvicorn --workers N`` on a shared SQLite file
+(STORAGE_BACKEND=sqlite) for each N, drives it from several client
+processes over keep-alive connections, and prints requests/s per scenario
+with the speedup over one worker.
+
+    cd backend && python benchmarks/multi_worker.py [--workers 1,2,4] [--duration 10]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import http_request, summarize  # noqa: E402
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+PASSWORD = "bench-password"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def call(port: int, method: str, path: str, body=None, headers=None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}", data=data, method=method,
+        headers={"Content-Type": "application/json", **(headers or {})},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def start_server(port: int, workers: int, data_dir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND="sqlite",
+        SQLITE_PATH=os.path.join(data_dir, "referrals.db"),
+        # Cheap hashes so register/login measure the app, not bcrypt
+        BCRYPT_ROUNDS="4",
+        PASSWORD_SCHEME="bcrypt",
+        # Every client connects from 127.0.0.1
+        ADMISSION_ENABLED="false",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=os.path.join(ROOT, "fastapi_backend"), env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            call(port, "GET", "/health")
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("Server did not come up")
+
+
+def _make_request(scenario: str, setup: dict, client_id: int, i: int):
+    if scenario == "register":
+        body = {"firstName": "Bench", "lastName": str(i), "email": f"b{client_id}-{i}-{uuid.uuid4().hex[:6]}@bench.dev",
+                "password": PASSWORD}
+        return "POST", "/api/register", json.dumps(body).encode()
+    if scenario == "login":
+        body = {"email": setup["emails"][i % len(setup["emails"])], "password": PASSWORD}
+        return "POST", "/api/login", json.dumps(body).encode()
+    return "POST", f"/api/track-click/{setup['link_codes'][i % len(setup['link_codes'])]}", b""
+
+
+async def _client(port: int, scenario: str, setup: dict, client_id: int, connections: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def connection(conn_id: int):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        i = conn_id
+        while time.perf_counter() < deadline:
+            method, path, body = _make_request(scenario, setup, client_id, i)
+            started = time.perf_counter()
+            status = await http_request(reader, writer, method, path, body)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            i += connections
+        writer.close()
+
+    await asyncio.gather(*(connection(c) for c in range(connections)))
+    return latencies, errors
+
+
+def _client_process(args):
+    return asyncio.run(_client(*args))
+
+
+def run_scenario(port: int, scenario: str, setup: dict, clients: int, connections: int, duration: float) -> dict:
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(
+            _client_process,
+            [(port, scenario, setup, client_id, connections, duration) for client_id in range(clients)],
+        )
+    latencies = [latency for result, _ in results for latency in result]
+    return summarize(latencies, sum(errors for _, errors in results), duration)
+
+
+def seed(port: int, users: int = 50) -> dict:
+    """Users to log in as, each with one link to click (link codes are per user and second)"""
+    emails, link_codes = [], []
+    for i in range(users):
+        email = f"seed{i}@bench.dev"
+        token = call(port, "POST", "/api/register", {"firstName": "Seed", "lastName": str(i), "email": email,
+                                                     "password": PASSWORD})["token"]
+        referral = call(port, "POST", "/api/referrals", {"userName": f"link{i}"}, {"Authorization": f"Bearer {token}"})
+        emails.append(email)
+        link_codes.append(referral["referral"]["link_code"])
+    return {"emails": emails, "link_codes": link_codes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8) if n <= os.cpu_count()) or "1")
+    parser.add_argument("--scenarios", default="register,login,track-click")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="client processes")
+    parser.add_argument("--connections", type=int, default=32, help="connections per client process")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    scenarios = args.scenarios.split(",")
+    print(f"{os.cpu_count()} CPUs, {args.clients} client processes x {args.connections} connections, "
+          f"{args.duration:.0f}s per run\n")
+
+    results = {}
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            port = free_port()
+            server = start_server(port, workers, data_dir)
+            try:
+                setup = seed(port)
+                for scenario in scenarios:
+                    result = run_scenario(port, scenario, setup, args.clients, args.connections, args.duration)
+                    results.setdefault(scenario, {})[workers] = result
+                    print(f"workers={workers:<3}{scenario:<13}{result['rps']:>9.0f} req/s"
+                          f"   p50 {result['p50_ms']:6.1f} ms   p99 {result['p99_ms']:6.1f} ms"
+                          f"   errors {result['errors']}")
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(f"\n{'scenario':<13}" + "".join(f"{f'{n}w req/s':>12}" for n in worker_counts) + f"{'speedup':>10}")
+    for scenario, by_workers in results.items():
+        base = by_workers[worker_counts[0]]["rps"] or 1
+        row = "".join(f"{by_workers[n]['rps']:>12.0f}" for n in worker_counts)
+        print(f"{scenario:<13}{row}{by_workers[worker_counts[-1]]['rps'] / base:>9.2f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Restart time of the in-memory store from a snapshot plus a journal tail
+
+    cd backend && python benchmarks/recovery.py [users] [journal_entries]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from persistence import Persistence  # noqa: E402
+from records import ReferralLink, User  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+
+def make_user(i: int) -> User:
+    return User(
+        id=str(uuid.uuid4()),
+        first_name=f"First{i}",
+        last_name=f"Last{i}",
+        email=f"user{i}@example.com",
+        password_hash="$2b$12$" + "x" * 53,
+        referral_code=f"C{i:07d}",
+        total_referrals=random.randint(0, 50),
+        total_earnings=float(random.randint(0, 5000)),
+        achievements=["first_referral"] if i % 3 == 0 else [],
+        created_at=datetime.utcnow().isoformat(),
+    )
+
+
+def make_referral(user: User, i: int) -> ReferralLink:
+    return ReferralLink(
+        id=str(uuid.uuid4()),
+        user_id=user.id,
+        user_name=f"{user.first_name} {user.last_name}",
+        link_code=f"{user.referral_code}-{i}",
+        full_url=f"http://localhost:3000/register?ref={user.referral_code}-{i}",
+        click_count=random.randint(0, 100),
+        created_at=datetime.utcnow().isoformat(),
+    )
+
+
+async def build(data_dir: str, user_count: int, journal_entries: int):
+    storage = MemoryStorage(persistence=Persistence(data_dir, fsync=False, snapshot_interval=3600))
+    await storage.connect()
+    users = [make_user(i) for i in range(user_count)]
+    await storage.insert_users(users[:1])
+    # Load the bulk without journaling it, the snapshot below covers it
+    storage._apply_insert_users(users[1:], {})
+    for i, user in enumerate(users[: user_count // 10]):
+        storage._apply_insert_referral(make_referral(user, i))
+
+    started = time.perf_counter()
+    result = await storage.snapshot()
+    print(f"snapshot: {result['bytes'] / 1e6:.1f} MB in {(time.perf_counter() - started):.2f}s "
+          f"(event loop paused {result['pause_ms']:.0f} ms)")
+
+    # Journal tail: registrations and counter bumps after the snapshot
+    pending = []
+    for i in range(journal_entries):
+        if i % 2:
+            pending.append(storage.insert_user(make_user(user_count + i)))
+        else:
+            pending.append(storage.increment_user(users[i].id, total_referrals=1, total_earnings=10.0))
+    await asyncio.gather(*pending)
+    expected = await storage.system_totals()
+    # Simulate a crash: stop the journal without the shutdown snapshot
+    await storage.persistence.journal.close()
+    return expected
+
+
+def main(user_count: int, journal_entries: int):
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as data_dir:
+        expected = asyncio.run(build(data_dir, user_count, journal_entries))
+
+        storage = MemoryStorage(persistence=Persistence(data_dir))
+        started = time.perf_counter()
+        storage.persistence.recover(storage)
+        elapsed = time.perf_counter() - started
+
+        recovered = storage._recount_totals()
+        assert recovered["total_users"] == expected["total_users"], (recovered, expected)
+        assert recovered["total_referrals"] == expected["total_referrals"], (recovered, expected)
+        print(f"recovery: {len(storage.users)} users, {len(storage.referrals)} links, "
+              f"{storage.persistence.replayed_entries} journal entries in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10_000,
+    )
@@ -0,0 +1,234 @@
+"""Cold-start cost of each API process: import time and time to first response
+
+Every run starts a fresh interpreter. The import probe times loading the app
+module; the server probe times ``python -m uvicorn main:app`` from spawn
+until /health answers, then the first registration and the first
+authenticated request (the lazily loaded subsystems show up there).
+Medians over --runs are reported and can be compared with a stored baseline
+(--fail-on-regression exits 1 past --threshold).
+
+    cd backend
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --baseline startup.json --fail-on-regression
+    python benchmarks/startup.py --warmup-mode blocking --openai-key
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+APPS = {
+    "backend": os.path.join(ROOT, "backend"),
+    "fastapi": os.path.join(ROOT, "fastapi_backend"),
+}
+# First authenticated request per app, and the key its register response puts the token under
+AUTH_PATHS = {"backend": "/api/achievements", "fastapi": "/api/referrals"}
+TOKEN_KEYS = {"backend": "access_token", "fastapi": "token"}
+METRICS = ("import_ms", "ttfr_ms", "first_register_ms", "first_auth_ms")
+
+IMPORT_PROBE = """
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("main", "main.py")
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(json.dumps({"import_ms": (time.perf_counter() - started) * 1000, "modules": len(sys.modules)}))
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def call(port: int, method: str, path: str, body=None, headers=None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}", data=data, method=method,
+        headers={"Content-Type": "application/json", **(headers or {})},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def probe_import(name: str, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=APPS[name], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def probe_server(name: str, env: dict) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        cwd=APPS[name], env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + 60
+        while True:
+            try:
+                call(port, "GET", "/health")
+                break
+            except (OSError, urllib.error.URLError):
+                if time.perf_counter() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"{name} did not come up")
+                time.sleep(0.005)
+        ttfr = time.perf_counter() - started
+
+        request_started = time.perf_counter()
+        registered = call(port, "POST", "/api/register", {
+            "firstName": "Cold", "lastName": "Start", "email": f"cold-{uuid.uuid4().hex[:12]}@example.com",
+            "password": "startup-password",
+        })
+        first_register = time.perf_counter() - request_started
+
+        request_started = time.perf_counter()
+        call(port, "GET", AUTH_PATHS[name], headers={"Authorization": f"Bearer {registered[TOKEN_KEYS[name]]}"})
+        first_auth = time.perf_counter() - request_started
+        try:
+            warmup = call(port, "GET", "/api/admin/warmup", headers={"X-Admin-Token": env["ADMIN_TOKEN"]})
+        except urllib.error.HTTPError:
+            # Trees from before the warm-up hook
+            warmup = {}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {
+        "ttfr_ms": ttfr * 1000,
+        "first_register_ms": first_register * 1000,
+        "first_auth_ms": first_auth * 1000,
+        "warmup": warmup,
+    }
+
+
+def bench_app(name: str, args, env: dict) -> dict:
+    samples = {metric: [] for metric in METRICS}
+    modules = 0
+    warmup = {}
+    for _ in range(args.runs):
+        imported = probe_import(name, env)
+        samples["import_ms"].append(imported["import_ms"])
+        modules = imported["modules"]
+        served = probe_server(name, env)
+        warmup = served.pop("warmup")
+        for metric, value in served.items():
+            samples[metric].append(value)
+    result = {metric: round(statistics.median(values), 2) for metric, values in samples.items()}
+    result["min"] = {metric: round(min(values), 2) for metric, values in samples.items()}
+    result["modules"] = modules
+    result["warmup"] = warmup
+    print(f"[{name}] import {result['import_ms']:8.1f} ms   first response {result['ttfr_ms']:8.1f} ms   "
+          f"first register {result['first_register_ms']:7.1f} ms   first auth {result['first_auth_ms']:7.1f} ms   "
+          f"({modules} modules, warm-up {warmup.get('state')} {warmup.get('total_ms')} ms)")
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """Print the change against a baseline report; True if something regressed"""
+    regressed = False
+    print(f"\nvs baseline {baseline['meta'].get('git_commit')} ({baseline['meta'].get('created_at')})")
+    print(f"{'app':<9}{'metric':<19}{'ms':>10}{'Δ':>9}")
+    for app_name, result in report["results"].items():
+        before = baseline["results"].get(app_name)
+        for metric in METRICS:
+            if before is None or not before.get(metric):
+                print(f"{app_name:<9}{metric:<19}{result[metric]:>10.1f}{'new':>9}")
+                continue
+            change = (result[metric] - before[metric]) / before[metric]
+            flag = ""
+            if change > threshold:
+                flag = "  ⚠️ regression"
+                regressed = True
+            print(f"{app_name:<9}{metric:<19}{result[metric]:>10.1f}{change:>+9.1%}{flag}")
+    for key in ("warmup_mode", "openai_key", "storage_backend"):
+        if baseline["meta"].get(key) != report["meta"].get(key):
+            print(f"⚠️ baseline {key}={baseline['meta'].get(key)} differs from this run ({report['meta'].get(key)})")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="all", choices=["all", *APPS])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per app (medians are reported)")
+    parser.add_argument("--warmup-mode", default=os.getenv("WARMUP_MODE", "background"),
+                        choices=["background", "blocking", "off"])
+    parser.add_argument("--openai-key", action="store_true",
+                        help="set a dummy OPENAI_API_KEY so the chat subsystem is configured as in production")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging (0.15 = 15%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if a metric regressed")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="startup-bench-")
+    env = dict(
+        os.environ,
+        WARMUP_MODE=args.warmup_mode,
+        BCRYPT_ROUNDS=str(args.bcrypt_rounds),
+        ADMISSION_ENABLED="false",
+        SQLITE_PATH=os.path.join(data_dir, "referrals.db"),
+        CLICKS_SQLITE_PATH=os.path.join(data_dir, "clicks.db"),
+        ADMIN_TOKEN=os.getenv("ADMIN_TOKEN") or "startup-benchmark",
+        # Unbuffered, so a crashed server still shows why
+        PYTHONUNBUFFERED="1",
+    )
+    if args.openai_key:
+        env["OPENAI_API_KEY"] = "sk-startup-benchmark"
+    else:
+        env.pop("OPENAI_API_KEY", None)
+
+    report = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "storage_backend": os.getenv("STORAGE_BACKEND", "memory"),
+            "warmup_mode": args.warmup_mode,
+            "openai_key": args.openai_key,
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "runs": args.runs,
+        },
+        "results": {},
+    }
+    for name in (list(APPS) if args.app == "all" else [args.app]):
+        report["results"][name] = bench_app(name, args, env)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold) and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,525 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, EmailStr, ValidationError
+
+from referral_codes import ReferralCodeAllocator
+from user_store import DuplicateKeyError, normalize_email
+
+IMPORT_FORMATS = ("jsonl", "csv")
+
+# Accept the camelCase names used by /api/register as well as column names
+FIELD_ALIASES = {
+    "firstName": "first_name",
+    "lastName": "last_name",
+    "referralCode": "referral_code",
+    "referredBy": "referred_by",
+    "passwordHash": "password_hash",
+    "totalReferrals": "total_referrals",
+    "totalEarnings": "total_earnings",
+    "createdAt": "created_at",
+}
+
+
+class ImportRow(BaseModel):
+    first_name: str
+    last_name: str
+    email: EmailStr
+    password: Optional[str] = None
+    password_hash: Optional[str] = None
+    referral_code: Optional[str] = None
+    referred_by: Optional[str] = None
+    total_referrals: int = 0
+    total_earnings: float = 0.0
+    created_at: Optional[datetime] = None
+
+
+def _clean_record(record: dict) -> dict:
+    """Apply aliases and drop empty CSV cells so optional fields fall back to defaults"""
+    cleaned = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        key = FIELD_ALIASES.get(key.strip(), key.strip())
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                continue
+        if value is not None:
+            cleaned[key] = value
+    return cleaned
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()
+    )
+
+
+def _read_block(reader, fmt: str, size: int) -> List[Tuple[int, Optional[dict], Optional[str]]]:
+    """Next ``size`` records as (line, record, error); runs in a worker thread"""
+    block = []
+    if fmt == "csv":
+        for record in islice(reader, size):
+            block.append((reader.line_num, record, None))
+        return block
+    while len(block) < size:
+        entry = next(reader, None)
+        if entry is None:
+            break
+        line_no, line = entry
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            block.append((line_no, None, f"Invalid JSON: {e}"))
+            continue
+        if not isinstance(record, dict):
+            block.append((line_no, None, "Expected a JSON object"))
+            continue
+        block.append((line_no, record, None))
+    return block
+
+
+class DeferredRows:
+    """Validated rows waiting for a referrer, spooled to a temp file as JSON lines
+
+    Keeps memory flat when much of a file points at referrers further down;
+    each retry pass reads one spool back in batches and writes the rows that
+    still wait to a fresh one.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="import-deferred-", suffix=".jsonl")
+        self._file = os.fdopen(fd, "w+", encoding="utf-8")
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, line: int, row: ImportRow):
+        fields = dict(row)
+        if fields["created_at"] is not None:
+            fields["created_at"] = fields["created_at"].isoformat()
+        self._file.write(json.dumps([line, fields]) + "\n")
+        self.count += 1
+
+    def _read(self, size: int) -> List[Tuple[int, ImportRow]]:
+        return [(line, ImportRow(**fields)) for line, fields in map(json.loads, islice(self._file, size))]
+
+    async def batches(self, size: int) -> AsyncIterator[List[Tuple[int, ImportRow]]]:
+        """Every spooled row, in the order they were deferred"""
+        self._file.flush()
+        self._file.seek(0)
+        while True:
+            batch = await asyncio.to_thread(self._read, size)
+            if not batch:
+                break
+            yield batch
+
+    def close(self):
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class ImportJob:
+    """Progress and per-row error report of one bulk import"""
+
+    def __init__(self, fmt: str, path: str, max_errors: int):
+        self.id = str(uuid.uuid4())
+        self.format = fmt
+        self.path = path
+        self.max_errors = max_errors
+        self.status = "receiving"
+        self.message = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+
+        # Progress
+        self.bytes_total = 0
+        self.bytes_read = 0
+        self.rows_read = 0
+        self.imported = 0
+        self.rejected = 0
+        self.referrals_linked = 0
+        self.batches_committed = 0
+        self.passwords_hashed = 0
+
+        # Only the first max_errors rows are kept, the rest are just counted
+        self.errors: List[dict] = []
+        self.errors_dropped = 0
+
+        # Validated rows waiting for a referrer further down the file (on disk)
+        self.deferred: Optional[DeferredRows] = None
+        self.rows_deferred = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def reject(self, line: int, error: str, email: Optional[str] = None):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "email": email, "error": error})
+        else:
+            self.errors_dropped += 1
+
+    def to_dict(self) -> dict:
+        elapsed = None
+        if self.started_at:
+            elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds()
+        return {
+            "id": self.id,
+            "format": self.format,
+            "status": self.status,
+            "message": self.message,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "bytes_total": self.bytes_total,
+            "bytes_read": self.bytes_read,
+            "progress": round(self.bytes_read / self.bytes_total, 4) if self.bytes_total else 0.0,
+            "rows_read": self.rows_read,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "referrals_linked": self.referrals_linked,
+            "rows_deferred": self.rows_deferred,
+            "passwords_hashed": self.passwords_hashed,
+            "batches_committed": self.batches_committed,
+            "rows_per_second": round(self.rows_read / elapsed, 1) if elapsed else 0.0,
+            "errors_reported": len(self.errors),
+            "errors_dropped": self.errors_dropped,
+        }
+
+
+class BulkImporter:
+    """Streams JSONL/CSV uploads of users into storage in fixed-size batches
+
+    The upload is spooled to a temp file as it arrives, so the request never
+    holds the whole body. A background task then reads ``batch_size`` rows at
+    a time, validates them, checks emails and referral codes against the
+    storage indexes with one lookup per batch, hashes plain passwords on the
+    shared ``PasswordHasher`` (``password_hash`` columns are taken as-is, which
+    is how migrated accounts keep their passwords) and commits the batch with
+    ``storage.insert_users``. Memory use is one batch plus the error report,
+    whatever the file size.
+
+    ``referred_by`` is the referral code of the referrer. It may point at an
+    existing user or at any row of the same file, and counts one referral for
+    that referrer. Rows whose referrer is not known yet (it comes in a later
+    batch) are spooled to a second temp file and retried from there once the
+    whole file is in; a row is only committed after its referrer. Balances are not touched
+    otherwise: migrated totals come from ``total_referrals``/``total_earnings``.
+    """
+
+    def __init__(
+        self,
+        storage,
+        hasher,
+        batch_size: int = 500,
+        max_errors: int = 1000,
+        max_jobs: int = 20,
+        code_allocator: Optional[ReferralCodeAllocator] = None,
+        on_batch: Optional[Callable[[List[dict], Set[str]], Awaitable[None]]] = None,
+    ):
+        self.storage = storage
+        self.hasher = hasher
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.max_jobs = max_jobs
+        self.code_allocator = code_allocator or ReferralCodeAllocator(storage)
+        self.on_batch = on_batch
+        self.jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # One import at a time; later uploads wait as "queued"
+        self._running = asyncio.Semaphore(1)
+
+    @classmethod
+    def from_env(cls, storage, hasher, **kwargs):
+        return cls(
+            storage,
+            hasher,
+            batch_size=int(os.getenv("IMPORT_BATCH_SIZE", "500")),
+            max_errors=int(os.getenv("IMPORT_MAX_ERRORS", "1000")),
+            **kwargs,
+        )
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[dict]:
+        return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    async def submit(self, chunks: AsyncIterator[bytes], fmt: str) -> ImportJob:
+        """Spool an upload to disk and schedule its import"""
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f"Unsupported import format: {fmt}")
+        fd, path = tempfile.mkstemp(prefix="import-", suffix=f".{fmt}")
+        job = ImportJob(fmt, path, self.max_errors)
+        try:
+            with os.fdopen(fd, "wb") as spool:
+                async for chunk in chunks:
+                    spool.write(chunk)
+                    job.bytes_total += len(chunk)
+        except BaseException:
+            os.unlink(path)
+            raise
+
+        job.status = "queued"
+        self.jobs[job.id] = job
+        self._evict_finished()
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+        return job
+
+    def _evict_finished(self):
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[job_id].finished:
+                del self.jobs[job_id]
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: ImportJob):
+        try:
+            async with self._running:
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                await self._import_file(job)
+                job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.message = str(e)
+            print(f"❌ Import {job.id} failed: {e}")
+        finally:
+            job.finished_at = datetime.utcnow()
+            self._tasks.pop(job.id, None)
+            try:
+                os.unlink(job.path)
+            except OSError:
+                pass
+
+    async def _import_file(self, job: ImportJob):
+        job.deferred = DeferredRows()
+        try:
+            with open(job.path, "rb") as raw:
+                text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="" if job.format == "csv" else None)
+                reader = csv.DictReader(text) if job.format == "csv" else enumerate(text, 1)
+                while True:
+                    block = await asyncio.to_thread(_read_block, reader, job.format, self.batch_size)
+                    if not block:
+                        break
+                    job.rows_read += len(block)
+                    await self._import_batch(job, block)
+                    job.bytes_read = min(raw.tell(), job.bytes_total)
+            job.bytes_read = job.bytes_total
+
+            # Rows whose referrer came later in the file; every pass commits the
+            # ones whose referrer is in by now, the last one rejects the rest
+            while len(job.deferred):
+                pending, job.deferred = job.deferred, DeferredRows()
+                try:
+                    async for batch in pending.batches(self.batch_size):
+                        await self._link_and_commit(job, batch, defer=True)
+                    if len(job.deferred) == len(pending):
+                        async for batch in pending.batches(self.batch_size):
+                            await self._link_and_commit(job, batch, defer=False)
+                        break
+                finally:
+                    pending.close()
+        finally:
+            job.deferred.close()
+        print(f"✅ Import {job.id}: {job.imported} imported, {job.rejected} rejected")
+
+    async def _import_batch(self, job: ImportJob, block):
+        # 1. Validate rows
+        rows: List[Tuple[int, ImportRow]] = []
+        for line, record, error in block:
+            if error:
+                job.reject(line, error)
+                continue
+            try:
+                row = ImportRow(**_clean_record(record))
+            except ValidationError as e:
+                job.reject(line, _validation_message(e), record.get("email"))
+                continue
+            if bool(row.password) == bool(row.password_hash):
+                job.reject(line, "Exactly one of password or password_hash is required", row.email)
+                continue
+            if row.password_hash and not self.hasher.context.identify(row.password_hash, required=False):
+                job.reject(line, "Unrecognized password_hash format", row.email)
+                continue
+            rows.append((line, row))
+
+        # 2. Unique keys, checked against the batch and the storage indexes in one go
+        taken_emails = await self.storage.existing_emails(row.email for _, row in rows)
+        own_codes = [row.referral_code for _, row in rows if row.referral_code]
+        taken_codes = await self.storage.existing_referral_codes(own_codes) if own_codes else set()
+        accepted: List[Tuple[int, ImportRow]] = []
+        for line, row in rows:
+            email_key = normalize_email(row.email)
+            if email_key in taken_emails:
+                job.reject(line, "Email already registered", row.email)
+                continue
+            if row.referral_code and row.referral_code in taken_codes:
+                job.reject(line, f"Referral code already in use: {row.referral_code}", row.email)
+                continue
+            taken_emails.add(email_key)
+            if row.referral_code:
+                taken_codes.add(row.referral_code)
+            accepted.append((line, row))
+
+        # 3. Fill in missing referral codes from the allocator (unique by construction)
+        missing = [row for _, row in accepted if not row.referral_code]
+        if missing:
+            for row, code in zip(missing, await self.code_allocator.allocate_many(len(missing))):
+                row.referral_code = code
+
+        await self._link_and_commit(job, accepted, defer=True)
+
+    async def _link_and_commit(self, job: ImportJob, accepted: List[Tuple[int, ImportRow]], defer: bool):
+        """Resolve referrers, hash passwords and commit rows that passed validation
+
+        A referrer is any row of ``accepted`` (wherever it is in the batch) or
+        a user in storage. Rows whose referrer is neither, or is a row that
+        cannot go in this batch, are deferred (``defer``) or rejected; a cycle
+        or a self-referral never resolves, so it ends up rejected.
+        """
+        # 4. Resolve referrers: rows of this batch first, then storage
+        user_ids = {row.referral_code: str(uuid.uuid4()) for _, row in accepted}
+        wanted = {row.referred_by for _, row in accepted if row.referred_by and row.referred_by not in user_ids}
+        referrers = await self.storage.get_users_by_referral_codes(wanted) if wanted else {}
+        # Rows that can go in now, referrers ahead of their referrals (the
+        # row-by-row fallback in _commit relies on that order)
+        ready: Dict[str, Tuple[int, ImportRow]] = {}
+        waiting = []
+        for line, row in accepted:
+            if not row.referred_by or row.referred_by in referrers:
+                ready[row.referral_code] = (line, row)
+            else:
+                waiting.append((line, row))
+        progress = True
+        while progress:
+            progress = False
+            for line, row in waiting:
+                if row.referral_code not in ready and row.referred_by in ready:
+                    ready[row.referral_code] = (line, row)
+                    progress = True
+        for line, row in waiting:
+            if row.referral_code in ready:
+                continue
+            if defer:
+                job.deferred.append(line, row)
+                job.rows_deferred += 1
+            else:
+                job.reject(line, f"Unknown referral code in referred_by: {row.referred_by}", row.email)
+
+        # 5. Build records, hashing plain passwords in parallel
+        users: List[dict] = []
+        lines: List[int] = []
+        passwords: List[Optional[str]] = []
+        referrer_of: Dict[str, str] = {}
+        for line, row in ready.values():
+            user_id = user_ids[row.referral_code]
+            referrer_id = None
+            if row.referred_by:
+                if row.referred_by in user_ids:
+                    referrer_id = user_ids[row.referred_by]
+                else:
+                    referrer_id = referrers[row.referred_by]["id"]
+            users.append({
+                "id": user_id,
+                "first_name": row.first_name,
+                "last_name": row.last_name,
+                "email": row.email,
+                "password_hash": row.password_hash,
+                "referral_code": row.referral_code,
+                "total_referrals": row.total_referrals,
+                "total_earnings": row.total_earnings,
+                "achievements": [],
+                "created_at": (row.created_at or datetime.utcnow()).isoformat(),
+                "referrer_id": referrer_id,
+            })
+            lines.append(line)
+            passwords.append(row.password)
+            if referrer_id:
+                referrer_of[user_id] = referrer_id
+
+        await self._hash_passwords(job, users, passwords)
+
+        # 6. Commit the batch, falling back to row by row if a key was taken meanwhile
+        await self._commit(job, users, lines, referrer_of)
+
+    async def _hash_passwords(self, job: ImportJob, users: List[dict], passwords: List[Optional[str]]):
+        # Keep at most max_concurrency of our hashes queued so live logins still get a turn
+        limit = asyncio.Semaphore(self.hasher.max_concurrency)
+
+        async def hash_one(user: dict, password: str):
+            async with limit:
+                user["password_hash"] = await self.hasher.hash(password)
+                job.passwords_hashed += 1
+
+        await asyncio.gather(*(
+            hash_one(user, password) for user, password in zip(users, passwords) if password
+        ))
+
+    @staticmethod
+    def _referral_increments(users: List[dict], referrer_of: Dict[str, str]) -> Dict[str, dict]:
+        increments: Dict[str, dict] = {}
+        for user in users:
+            referrer_id = referrer_of.get(user["id"])
+            if referrer_id:
+                deltas = increments.setdefault(referrer_id, {"total_referrals": 0})
+                deltas["total_referrals"] += 1
+        return increments
+
+    async def _commit(self, job: ImportJob, users: List[dict], lines: List[int], referrer_of: Dict[str, str]):
+        if not users:
+            return
+        try:
+            await self.storage.insert_users(users, self._referral_increments(users, referrer_of))
+            committed = users
+        except DuplicateKeyError:
+            # A live registration took one of the keys after our checks
+            committed = []
+            batch_ids = {user["id"] for user in users}
+            committed_ids = set()
+            for user, line in zip(users, lines):
+                referrer_id = referrer_of.get(user["id"])
+                if referrer_id in batch_ids and referrer_id not in committed_ids:
+                    job.reject(line, "Referrer row in the same batch was rejected", user["email"])
+                    continue
+                try:
+                    await self.storage.insert_users([user], self._referral_increments([user], referrer_of))
+                except DuplicateKeyError as e:
+                    job.reject(line, f"Duplicate {e.field}: {e.value}", user["email"])
+                    continue
+                committed.append(user)
+                committed_ids.add(user["id"])
+
+        job.imported += len(committed)
+        job.referrals_linked += sum(1 for user in committed if user["id"] in referrer_of)
+        job.batches_committed += 1
+        if self.on_batch and committed:
+            referrer_ids = {referrer_of[user["id"]] for user in committed if user["id"] in referrer_of}
+            await self.on_batch(committed, referrer_ids)
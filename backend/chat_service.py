@@ -0,0 +1,256 @@
+import asyncio
+import os
+import threading
+import time
+from typing import AsyncIterator, List, Optional
+
+
+class ChatBusyError(Exception):
+    """Raised when a chat request waited too long for a free slot"""
+
+
+class CircuitOpenError(Exception):
+    """Raised while the circuit breaker is rejecting upstream calls"""
+
+
+class CircuitBreaker:
+    """Stops calling the upstream after repeated failures
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds. It then lets a single trial
+    call through (half-open): success closes it again, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("AI assistant is temporarily unavailable, please retry shortly")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                raise CircuitOpenError("AI assistant is temporarily unavailable, please retry shortly")
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """Hand back a half-open trial slot that was never used"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._trial_in_flight = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+
+
+class ChatService:
+    """Async OpenAI chat completions with a concurrency budget
+
+    A semaphore caps in-flight completions (streams hold their slot until the
+    last token); callers that cannot get a slot within ``queue_timeout`` get
+    ``ChatBusyError``. Timeouts, connection errors and 5xx answers are retried
+    up to ``max_retries`` times with exponential backoff (before the first
+    token, so a stream is never replayed); a call that still fails feeds a
+    circuit breaker so an outage fails fast instead of tying up every slot
+    until the client timeout.
+    ``base_url`` can point at a local fake server (see fake_openai_server.py).
+    The OpenAI SDK is imported and its client built on the first chat (or by
+    ``warm_up``), not at startup.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: Optional[str] = None,
+        model: str = "gpt-4",
+        max_concurrency: int = 8,
+        queue_timeout: float = 2.0,
+        request_timeout: float = 30.0,
+        max_retries: int = 1,
+        retry_backoff: float = 0.2,
+        breaker: Optional[CircuitBreaker] = None,
+        metrics=None,
+        http_client=None,
+    ):
+        self.model = model
+        self.metrics = metrics
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._api_key = api_key
+        self._base_url = base_url
+        self._request_timeout = request_timeout
+        self._http_client = http_client
+        self._client = None
+        self._client_lock = threading.Lock()
+
+        # Counters
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected_busy = 0
+        self.rejected_open = 0
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        return cls(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            model=os.getenv("OPENAI_MODEL", "gpt-4"),
+            max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY", "8")),
+            queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", "2.0")),
+            request_timeout=float(os.getenv("CHAT_REQUEST_TIMEOUT", "30.0")),
+            max_retries=int(os.getenv("CHAT_MAX_RETRIES", "1")),
+            retry_backoff=float(os.getenv("CHAT_RETRY_BACKOFF", "0.2")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("CHAT_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("CHAT_BREAKER_RESET", "30.0")),
+            ),
+            metrics=metrics,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._api_key)
+
+    @property
+    def client(self):
+        """AsyncOpenAI client, created on first use; None without an API key"""
+        if self._client is None and self._api_key:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import AsyncOpenAI
+                    # Retries are ours, so the breaker and counters see every attempt
+                    self._client = AsyncOpenAI(
+                        api_key=self._api_key, base_url=self._base_url, timeout=self._request_timeout,
+                        max_retries=0, http_client=self._http_client,
+                    )
+        return self._client
+
+    def warm_up(self):
+        """Import the SDK and build the client ahead of the first chat"""
+        return self.client
+
+    async def _acquire(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.rejected_open += 1
+            raise
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.release_trial()
+            self.rejected_busy += 1
+            raise ChatBusyError("AI assistant is busy, please retry shortly")
+        self.in_flight += 1
+
+    def _release(self, outcome: str, started: float):
+        if self.metrics is not None:
+            # Upstream time only (streams until the last token), queueing excluded
+            self.metrics.observe("openai", time.perf_counter() - started)
+        self.in_flight -= 1
+        self._semaphore.release()
+        if outcome == "ok":
+            self.completed += 1
+            self.breaker.record_success()
+        elif outcome == "failed":
+            self.failed += 1
+            self.breaker.record_failure()
+        else:
+            # The client went away, that says nothing about upstream health
+            self.breaker.release_trial()
+
+    async def _create(self, **params):
+        """chat.completions.create, retrying transient upstream errors"""
+        from openai import APIConnectionError, InternalServerError  # APITimeoutError is a connection error
+        attempt = 0
+        while True:
+            try:
+                return await self.client.chat.completions.create(model=self.model, **params)
+            except (APIConnectionError, InternalServerError):
+                if attempt >= self.max_retries:
+                    raise
+            self.retries += 1
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+
+    async def complete(self, messages: List[dict], max_tokens: int = 200, temperature: float = 0.7) -> str:
+        await self._acquire()
+        started = time.perf_counter()
+        outcome = "failed"
+        try:
+            response = await self._create(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+            outcome = "ok"
+            return response.choices[0].message.content
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._release(outcome, started)
+
+    async def stream(self, messages: List[dict], max_tokens: int = 200, temperature: float = 0.7) -> AsyncIterator[str]:
+        """Yield content deltas as the upstream produces them"""
+        await self._acquire()
+        started = time.perf_counter()
+        outcome = "failed"
+        try:
+            response = await self._create(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+            )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            outcome = "ok"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            self._release(outcome, started)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "loaded": self._client is not None,
+            "model": self.model,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rejected_busy": self.rejected_busy,
+            "rejected_open": self.rejected_open,
+            "breaker_state": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+        }
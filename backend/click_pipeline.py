@@ -0,0 +1,418 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from records import Click
+
+# Column order shared by every sink, matches referral_clicks in init.sql
+CLICK_COLUMNS = list(Click.FIELDS)
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+
+# (link_code, completed_registration, hour, count, duplicates) and
+# (id, link_code, completed_registration, clicked_at, ip_address, user_agent, duplicate)
+HourlyCount = Tuple[str, bool, datetime, int, int]
+StoredClick = Tuple[int, str, bool, Optional[datetime], Optional[str], Optional[str], bool]
+# (checkpoint click id, {link id: HyperLogLog registers}), see RollupSync.save_sketches
+Sketches = Tuple[int, Dict[str, bytes]]
+
+# A worker that is behind never overwrites a sketch saved further along
+SQL_SAVE_SKETCH = (
+    "INSERT INTO click_sketches (link_id, registers, up_to_id) VALUES ({})"
+    " ON CONFLICT (link_id) DO UPDATE SET registers = excluded.registers, up_to_id = excluded.up_to_id"
+    " WHERE click_sketches.up_to_id <= excluded.up_to_id"
+)
+
+
+def _parse_clicked_at(value) -> Optional[datetime]:
+    # SQLite hands back whatever was stored: isoformat() from the app or CURRENT_TIMESTAMP
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+# Sinks
+class SQLiteClickSink:
+    """Writes click batches to a local SQLite file (stand-in for Postgres)"""
+
+    def __init__(self, path: str = "clicks.db"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Writes and rollup reads share the connection (":memory:" has no other)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS referral_clicks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                link_code VARCHAR(64) NOT NULL,
+                ip_address VARCHAR(45),
+                user_agent TEXT,
+                clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_registration BOOLEAN DEFAULT FALSE,
+                completed_email VARCHAR(255),
+                duplicate BOOLEAN DEFAULT FALSE
+            )
+            """
+        )
+        # Files written before the duplicate filter kept its verdict
+        if "duplicate" not in {row[1] for row in self._conn.execute("PRAGMA table_info(referral_clicks)")}:
+            self._conn.execute("ALTER TABLE referral_clicks ADD COLUMN duplicate BOOLEAN DEFAULT FALSE")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_referral_clicks_link_code ON referral_clicks(link_code)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_referral_clicks_clicked_at ON referral_clicks(clicked_at)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS click_sketches (
+                link_id VARCHAR(255) PRIMARY KEY,
+                registers BLOB NOT NULL,
+                up_to_id INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _write(self, batch: List[Click]):
+        placeholders = ", ".join("?" for _ in CLICK_COLUMNS)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO referral_clicks ({', '.join(CLICK_COLUMNS)}) VALUES ({placeholders})",
+                [
+                    (click.link_code, click.ip_address, click.user_agent, click.clicked_at.isoformat(),
+                     click.completed_registration, click.completed_email, click.duplicate)
+                    for click in batch
+                ],
+            )
+
+    async def write_batch(self, batch: List[Click]):
+        # sqlite3 is blocking, keep it off the event loop
+        await asyncio.to_thread(self._write, batch)
+
+    def _query(self, sql: str, args: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    async def last_click_id(self) -> int:
+        rows = await asyncio.to_thread(self._query, "SELECT COALESCE(MAX(id), 0) FROM referral_clicks")
+        return rows[0][0]
+
+    async def hourly_counts(self, up_to_id: int) -> List[HourlyCount]:
+        """Clicks and duplicates per (link, registration flag, hour) for every row with id <= up_to_id"""
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT link_code, completed_registration, substr(clicked_at, 1, 13), count(*),"
+            " COALESCE(sum(duplicate), 0) FROM referral_clicks"
+            " WHERE id <= ? AND clicked_at IS NOT NULL GROUP BY 1, 2, 3",
+            (up_to_id,),
+        )
+        return [(code, bool(completed), datetime.fromisoformat(hour + ":00"), count, duplicates)
+                for code, completed, hour, count, duplicates in rows]
+
+    async def clicks_after(self, after_id: int, limit: int) -> List[StoredClick]:
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT id, link_code, completed_registration, clicked_at, ip_address, user_agent, duplicate"
+            " FROM referral_clicks WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        )
+        return [(click_id, code, bool(completed), _parse_clicked_at(at), ip, agent, bool(duplicate))
+                for click_id, code, completed, at, ip, agent, duplicate in rows]
+
+    async def clicks_by_id(self, ids: Iterable[int]) -> List[StoredClick]:
+        ids = list(ids)
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT id, link_code, completed_registration, clicked_at, ip_address, user_agent, duplicate"
+            f" FROM referral_clicks WHERE id IN ({', '.join('?' for _ in ids)})",
+            tuple(ids),
+        )
+        return [(click_id, code, bool(completed), _parse_clicked_at(at), ip, agent, bool(duplicate))
+                for click_id, code, completed, at, ip, agent, duplicate in rows]
+
+    async def first_click_since(self, at: datetime) -> Optional[int]:
+        """Lowest id of a click taken at or after ``at`` (None if there is none)"""
+        rows = await asyncio.to_thread(
+            self._query, "SELECT MIN(id) FROM referral_clicks WHERE clicked_at >= ?", (at.isoformat(),)
+        )
+        return rows[0][0]
+
+    async def load_sketches(self) -> Sketches:
+        rows = await asyncio.to_thread(self._query, "SELECT link_id, registers, up_to_id FROM click_sketches")
+        return max((row[2] for row in rows), default=0), {link_id: bytes(registers) for link_id, registers, _ in rows}
+
+    def _save_sketches(self, up_to_id: int, sketches: Dict[str, bytes]):
+        with self._lock, self._conn:
+            self._conn.executemany(SQL_SAVE_SKETCH.format("?, ?, ?"),
+                                   [(link_id, registers, up_to_id) for link_id, registers in sketches.items()])
+
+    async def save_sketches(self, up_to_id: int, sketches: Dict[str, bytes]):
+        await asyncio.to_thread(self._save_sketches, up_to_id, sketches)
+
+    def _clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM referral_clicks")
+            self._conn.execute("DELETE FROM click_sketches")
+
+    async def clear(self):
+        await asyncio.to_thread(self._clear)
+
+    async def close(self):
+        self._conn.close()
+
+
+class PostgresClickSink:
+    """Bulk-loads click batches with COPY over the storage connection pool"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def write_batch(self, batch: List[Click]):
+        async with self.storage.acquire() as conn:
+            await conn.copy_records_to_table(
+                "referral_clicks", records=[click.astuple() for click in batch], columns=CLICK_COLUMNS
+            )
+
+    async def last_click_id(self) -> int:
+        async with self.storage.acquire() as conn:
+            return await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM referral_clicks")
+
+    async def hourly_counts(self, up_to_id: int) -> List[HourlyCount]:
+        """Clicks and duplicates per (link, registration flag, hour) for every row with id <= up_to_id"""
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT link_code, completed_registration, date_trunc('hour', clicked_at), count(*),"
+                " count(*) FILTER (WHERE duplicate)"
+                " FROM referral_clicks WHERE id <= $1 AND clicked_at IS NOT NULL GROUP BY 1, 2, 3",
+                up_to_id,
+            )
+        return [(row[0], bool(row[1]), row[2], row[3], row[4]) for row in rows]
+
+    async def clicks_after(self, after_id: int, limit: int) -> List[StoredClick]:
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT id, link_code, completed_registration, clicked_at, ip_address, user_agent, duplicate"
+                " FROM referral_clicks WHERE id > $1 ORDER BY id LIMIT $2",
+                after_id, limit,
+            )
+        return [(row[0], row[1], bool(row[2]), row[3], row[4], row[5], bool(row[6])) for row in rows]
+
+    async def clicks_by_id(self, ids: Iterable[int]) -> List[StoredClick]:
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT id, link_code, completed_registration, clicked_at, ip_address, user_agent, duplicate"
+                " FROM referral_clicks WHERE id = ANY($1::int[])",
+                list(ids),
+            )
+        return [(row[0], row[1], bool(row[2]), row[3], row[4], row[5], bool(row[6])) for row in rows]
+
+    async def first_click_since(self, at: datetime) -> Optional[int]:
+        async with self.storage.acquire() as conn:
+            return await conn.fetchval("SELECT MIN(id) FROM referral_clicks WHERE clicked_at >= $1", at)
+
+    async def load_sketches(self) -> Sketches:
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch("SELECT link_id, registers, up_to_id FROM click_sketches")
+        return max((row[2] for row in rows), default=0), {row[0]: bytes(row[1]) for row in rows}
+
+    async def save_sketches(self, up_to_id: int, sketches: Dict[str, bytes]):
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    SQL_SAVE_SKETCH.format("$1, $2, $3"), [(link_id, registers, up_to_id) for link_id, registers in sketches.items()]
+                )
+
+    async def clear(self):
+        async with self.storage.acquire() as conn:
+            await conn.execute("TRUNCATE referral_clicks, click_sketches")
+
+    async def close(self):
+        # The pool belongs to the storage backend
+        pass
+
+
+class ClickIngestor:
+    """Bounded click queue drained by a background worker in batches
+
+    Request handlers call ``put`` and return right away; the worker flushes a
+    batch once ``batch_size`` clicks are waiting or ``flush_interval`` seconds
+    have passed since the first click of the batch. When the queue is full the
+    overflow policy decides what happens:
+
+    - ``drop_newest``: reject the incoming click
+    - ``drop_oldest``: evict the oldest queued click to make room
+    - ``block``: wait up to ``block_timeout`` seconds for room, then drop
+    """
+
+    def __init__(
+        self,
+        sink,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow_policy: str = "drop_newest",
+        block_timeout: float = 0.05,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @classmethod
+    def from_env(cls, sink):
+        return cls(
+            sink,
+            max_queue=int(os.getenv("CLICK_QUEUE_SIZE", "10000")),
+            batch_size=int(os.getenv("CLICK_BATCH_SIZE", "500")),
+            flush_interval=float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0")),
+            overflow_policy=os.getenv("CLICK_OVERFLOW_POLICY", "drop_newest"),
+        )
+
+    # Producer side
+    def _enqueue(self, click: Click):
+        self._queue.put_nowait(click)
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    async def put(self, click: Click) -> bool:
+        """Queue a click, returns False if it was dropped"""
+        if self._closing:
+            self.dropped += 1
+            return False
+
+        if self._queue.qsize() < self.max_queue:
+            self._enqueue(click)
+            return True
+
+        if self.overflow_policy == "drop_oldest":
+            self._queue.get_nowait()
+            self.dropped += 1
+            self._enqueue(click)
+            return True
+
+        if self.overflow_policy == "block":
+            deadline = time.monotonic() + self.block_timeout
+            while self._queue.qsize() >= self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._space.clear()
+                try:
+                    await asyncio.wait_for(self._space.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if self._queue.qsize() < self.max_queue:
+                self._enqueue(click)
+                return True
+
+        self.dropped += 1
+        return False
+
+    # Consumer side
+    async def _collect(self) -> List[Click]:
+        batch = []
+        try:
+            first = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+        except asyncio.TimeoutError:
+            return batch
+        batch.append(first)
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self._queue.empty():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closing:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self._queue.get_nowait())
+        self._space.set()
+        return batch
+
+    async def _flush(self, batch: List[Click]):
+        started = time.perf_counter()
+        try:
+            await self.sink.write_batch(batch)
+            self.flushed += len(batch)
+        except Exception as e:
+            # Drop the batch rather than grow memory while the store is down
+            self.failed += len(batch)
+            print(f"⚠️ Click flush failed ({len(batch)} clicks): {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.batches += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+
+    def start(self):
+        if self._worker is None:
+            self._closing = False
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting clicks and flush everything still queued"""
+        self._closing = True
+        if self._worker is not None:
+            await self._worker
+            self._worker = None
+        await self.sink.close()
+
+    async def clear(self):
+        """Drop queued clicks and every stored one (demo reset)"""
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._space.set()
+        await self.sink.clear()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_capacity": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 3) if self.batches else 0.0,
+        }
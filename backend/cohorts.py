@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+from array import array
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+# Event kinds
+REFERRAL = 0
+ACTIVITY = 1
+
+PERIODS = ("week", "month")
+
+def _ordinal(value) -> int:
+    """Day number (date.toordinal) of an ISO string, date or datetime"""
+    if value is None:
+        return datetime.utcnow().toordinal()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10]).toordinal()
+    return value.toordinal()
+
+
+class CohortAnalyzer:
+    """Signup cohorts with retention and churn, computed over columnar arrays
+
+    Users and events are appended to typed ``array`` columns: the signup day
+    of each user, and (user, day, kind) for each event. Events are either
+    referrals (someone signed up with the user's code or link, rebuilt from
+    ``users.referrer_id``) or activity (at most one per user and day, from
+    logins and authenticated requests). Activity seen here is queued for
+    storage (``take_unsaved``) and activity stored by other workers is tailed
+    by id (``sync_activity``), so every worker ends up with the same events
+    and they survive restarts. A query copies the columns and builds the
+    retention matrix with NumPy (``cohort_matrix``, imported on the first
+    query or by ``warm_up``) in a worker thread.
+    Results are cached per window and reused until the data changes or, while
+    it keeps changing, for ``cache_ttl`` seconds.
+    """
+
+    def __init__(self, cache_ttl: float = 60.0, cache_size: int = 32):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._rows: Dict[str, int] = {}
+        self._signup = array("i")
+        self._last_active = array("i")
+        self._event_user = array("i")
+        self._event_day = array("i")
+        self._event_kind = array("b")
+        self._version = 0
+        self._activity_id = 0
+        self._unsaved: List[Tuple[str, int]] = []
+        self._cache: "OrderedDict[tuple, Tuple[int, float, dict]]" = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+
+        # Counters
+        self.queries = 0
+        self.cache_hits = 0
+        self.last_compute_ms = 0.0
+        self.rebuilds = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            cache_ttl=float(os.getenv("COHORT_CACHE_TTL", "60")),
+            cache_size=int(os.getenv("COHORT_CACHE_SIZE", "32")),
+        )
+
+    # Ingestion
+    def _row(self, user_id: str, day: int) -> int:
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._rows[user_id] = len(self._signup)
+            self._signup.append(day)
+            self._last_active.append(0)
+        return row
+
+    def add_user(self, user_id: str, created_at=None, referrer_id: Optional[str] = None):
+        """A signup, which is also a referral event for the referrer"""
+        if user_id in self._rows:
+            return
+        day = _ordinal(created_at)
+        self._row(user_id, day)
+        referrer = self._rows.get(referrer_id) if referrer_id else None
+        if referrer is not None:
+            self._event_user.append(referrer)
+            self._event_day.append(day)
+            self._event_kind.append(REFERRAL)
+        self._version += 1
+
+    def record_activity(self, user_id: str, at: Optional[datetime] = None):
+        """Mark the user active today (repeat calls on the same day are free)"""
+        day = _ordinal(at)
+        if self._add_activity(user_id, day):
+            self._unsaved.append((user_id, day))
+
+    def _add_activity(self, user_id: str, day: int) -> bool:
+        row = self._rows.get(user_id)
+        if row is None or self._last_active[row] >= day:
+            return False
+        self._last_active[row] = day
+        self._event_user.append(row)
+        self._event_day.append(day)
+        self._event_kind.append(ACTIVITY)
+        self._version += 1
+        return True
+
+    def take_unsaved(self) -> List[Tuple[str, int]]:
+        """(user_id, day) activity recorded here since the last call, for storage.record_activity"""
+        unsaved, self._unsaved = self._unsaved, []
+        return unsaved
+
+    async def sync_activity(self, storage, batch_size: int = 10000):
+        """Apply activity stored since the last sync (this worker's own rows are already in)"""
+        while True:
+            rows = await storage.activity_after(self._activity_id, batch_size)
+            for activity_id, user_id, day in rows:
+                self._add_activity(user_id, day)
+                self._activity_id = activity_id
+            if len(rows) < batch_size:
+                break
+
+    def clear(self):
+        self._rows = {}
+        for column in (self._signup, self._last_active, self._event_user, self._event_day, self._event_kind):
+            del column[:]
+        self._activity_id = 0
+        self._unsaved = []
+        self._cache.clear()
+        self._version += 1
+
+    async def rebuild_from(self, storage, batch_size: int = 10000):
+        """Reload signups, referral events and stored activity (unsaved activity is dropped)"""
+        self.clear()
+        referrals = []
+        async for batch in storage.iter_users(batch_size):
+            for user in batch:
+                day = _ordinal(user["created_at"])
+                self._row(user["id"], day)
+                if user.get("referrer_id"):
+                    referrals.append((user["referrer_id"], day))
+        # Referrers can come after their referrals in storage order
+        for referrer_id, day in referrals:
+            referrer = self._rows.get(referrer_id)
+            if referrer is not None:
+                self._event_user.append(referrer)
+                self._event_day.append(day)
+                self._event_kind.append(REFERRAL)
+        await self.sync_activity(storage, batch_size)
+        self._version += 1
+        self.rebuilds += 1
+
+    # Queries
+    async def retention(self, start: date, end: date, period: str = "week", metric: str = "activity",
+                        periods: int = 12, churn_days: int = 30) -> dict:
+        """Cohort x period retention matrix and churn for users who signed up between start and end"""
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        if metric not in ("activity", "referrals"):
+            raise ValueError("metric must be activity or referrals")
+        if start > end:
+            raise ValueError("start must not be after end")
+        self.queries += 1
+        today = datetime.utcnow().toordinal()
+        key = (metric, period, start.toordinal(), end.toordinal(), periods, churn_days, today)
+
+        cached = self._cache.get(key)
+        now = time.monotonic()
+        if cached is not None:
+            version, computed_at, result = cached
+            if version == self._version or now - computed_at < self.cache_ttl:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return {**result, "cached": True}
+
+        # Concurrent misses for the same window share one computation
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.cache_hits += 1
+            return {**await asyncio.shield(pending), "cached": True}
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            version = self._version
+            # Copies, so appends can go on while the worker thread computes
+            columns = (self._signup[:], self._event_user[:], self._event_day[:], self._event_kind[:])
+            started = time.perf_counter()
+            from cohort_matrix import retention_matrix
+            result = await asyncio.to_thread(
+                retention_matrix, *columns, key[2], key[3], period, metric, periods, churn_days, today
+            )
+            result["compute_ms"] = self.last_compute_ms = round((time.perf_counter() - started) * 1000, 3)
+            self._cache[key] = (version, time.monotonic(), result)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so an unshared failure is not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+        return {**result, "cached": False}
+
+    def warm_up(self):
+        """Import NumPy and the matrix code ahead of the first query"""
+        import cohort_matrix  # noqa: F401
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._signup),
+            "events": len(self._event_kind),
+            "memory_bytes": sum(
+                column.itemsize * len(column)
+                for column in (self._signup, self._last_active, self._event_user, self._event_day, self._event_kind)
+            ),
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "cached_windows": len(self._cache),
+            "last_compute_ms": self.last_compute_ms,
+            "unsaved_activity": len(self._unsaved),
+            "rebuilds": self.rebuilds,
+        }
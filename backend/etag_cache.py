@@ -0,0 +1,107 @@
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional, Tuple, Type
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check with weak comparison (RFC 9110 13.1.2)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+class ETagCache:
+    """Conditional GETs and serialized bodies keyed by resource version
+
+    Every resource served through ``respond`` has a cheap version that goes
+    up on each mutation that can change it (kept by storage: one for the
+    leaderboard and one for the admin stats, plus each user row's own
+    version for profile and achievements). The ETag is built from that
+    version, so a matching ``If-None-Match`` gets a 304 before the body is
+    built, and a body is serialized once per version and then served from an
+    LRU of ``max_entries`` keys. The version is read before the body is
+    built, so a body is never older than its ETag. Tags include the storage's
+    ``version_epoch``, so process-local versions that restart at zero cannot
+    match a tag handed out before the restart.
+    """
+
+    def __init__(self, version_epoch: str = "", max_entries: int = 4096):
+        self.version_epoch = version_epoch
+        self.max_entries = max_entries
+        self._bodies: "OrderedDict[Hashable, Tuple[str, bytes, str]]" = OrderedDict()
+        self._bytes = 0
+
+        # Counters
+        self.not_modified = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls, storage):
+        return cls(
+            version_epoch=storage.version_epoch,
+            max_entries=int(os.getenv("ETAG_CACHE_SIZE", "4096")),
+        )
+
+    def tag(self, resource: str, *version) -> str:
+        """Strong ETag for a resource at a version (any number of parts)"""
+        parts = [resource, self.version_epoch, *map(str, version)]
+        return '"' + "-".join(part for part in parts if part) + '"'
+
+    async def respond(
+        self,
+        request: Request,
+        key: Hashable,
+        etag: str,
+        build: Callable[[], Awaitable[object]],
+        response_class: Type[Response] = JSONResponse,
+        private: bool = False,
+    ) -> Response:
+        """304 if the client has ``etag``, else the body for it (built by ``build`` on a miss)"""
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache" if private else "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        cached = self._bodies.get(key)
+        if cached is not None and cached[0] == etag:
+            self._bodies.move_to_end(key)
+            self.hits += 1
+            return Response(cached[1], media_type=cached[2], headers=headers)
+
+        self.misses += 1
+        response = response_class(await build(), headers=headers)
+        if cached is not None:
+            self._bytes -= len(cached[1])
+        self._bodies[key] = (etag, response.body, response.media_type)
+        self._bodies.move_to_end(key)
+        self._bytes += len(response.body)
+        while len(self._bodies) > self.max_entries:
+            _, (_, body, _) = self._bodies.popitem(last=False)
+            self._bytes -= len(body)
+            self.evicted += 1
+        return response
+
+    def clear(self):
+        self._bodies.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        served = self.not_modified + self.hits + self.misses
+        return {
+            "entries": len(self._bodies),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "not_modified": self.not_modified,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "reuse_rate": round((self.not_modified + self.hits) / served, 4) if served else 0.0,
+        }
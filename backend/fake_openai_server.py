@@ -0,0 +1,82 @@
+"""Local stand-in for the OpenAI chat completions API
+
+Point the backend at it to exercise /api/chat without a real key:
+
+    python fake_openai_server.py
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://localhost:8099/v1 python main.py
+
+FAKE_OPENAI_TOKEN_DELAY (seconds per streamed token), FAKE_OPENAI_LATENCY
+(seconds before the first token) and FAKE_OPENAI_FAIL_RATE (0..1) shape its
+behaviour for concurrency and circuit-breaker experiments.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+import uvicorn
+
+app = FastAPI(title="Fake OpenAI")
+
+TOKEN_DELAY = float(os.getenv("FAKE_OPENAI_TOKEN_DELAY", "0.02"))
+LATENCY = float(os.getenv("FAKE_OPENAI_LATENCY", "0.2"))
+FAIL_RATE = float(os.getenv("FAKE_OPENAI_FAIL_RATE", "0"))
+
+CANNED_REPLY = (
+    "Share your referral code with friends who run a small business. "
+    "Each signup earns you $50 and gives them $25 to start."
+)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY)
+    if random.random() < FAIL_RATE:
+        raise HTTPException(status_code=500, detail="Injected upstream failure")
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "gpt-4")
+    words = CANNED_REPLY.split(" ")
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": CANNED_REPLY},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+        }
+
+    async def events():
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": None,
+                }],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(TOKEN_DELAY)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("FAKE_OPENAI_PORT", "8099")))
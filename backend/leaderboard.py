@@ -0,0 +1,64 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+
+def leaderboard_key(user: dict) -> Tuple[int, float, str]:
+    """Sort key: most referrals first, then most earnings, then id"""
+    return (-user.get("total_referrals", 0), -user.get("total_earnings", 0.0), user["id"])
+
+
+class Leaderboard:
+    """Order-statistics index over users for ranking and top-K pagination
+
+    Keys live in a SortedList, so upserts and rank lookups are O(log N) and a
+    page of K rows is an O(log N + K) slice. ``_keys`` remembers the key each
+    user was inserted under, which is what we need to remove it again after its
+    counters changed.
+    """
+
+    def __init__(self):
+        self._sorted = SortedList()
+        self._keys: Dict[str, Tuple[int, float, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def upsert(self, user: dict):
+        key = leaderboard_key(user)
+        old_key = self._keys.get(user["id"])
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._sorted.remove(old_key)
+        self._sorted.add(key)
+        self._keys[user["id"]] = key
+
+    def remove(self, user_id: str):
+        old_key = self._keys.pop(user_id, None)
+        if old_key is not None:
+            self._sorted.remove(old_key)
+
+    def page(self, offset: int = 0, limit: int = 10) -> List[str]:
+        """User ids ranked offset+1 .. offset+limit"""
+        return [key[2] for key in self._sorted.islice(offset, offset + limit)]
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """1-based rank of a user, None if unknown"""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return self._sorted.index(key) + 1
+
+    def ids(self) -> Iterator[str]:
+        """All user ids, best first"""
+        return (key[2] for key in self._sorted)
+
+    def load(self, users: Iterable[dict]):
+        """Replace the index in bulk; cheapest when ``users`` already come in rank order"""
+        self._keys = {user.id: (-user.total_referrals, -user.total_earnings, user.id) for user in users}
+        self._sorted = SortedList(self._keys.values())
+
+    def clear(self):
+        self._sorted.clear()
+        self._keys.clear()
@@ -1,26 +1,45 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime, timedelta
+from typing import Optional, List, Literal
+from datetime import datetime, timedelta, date
+import hmac
 import os
-from openai import OpenAI
-from passlib.context import CryptContext
 import dotenv
-from jose import JWTError, jwt
 import uuid
-import uvicorn
-import hashlib
+import json
+import random
+
+from storage import create_storage
+from password_hasher import PasswordHasher, HasherBusyError
+from token_cache import TokenCache
+from chat_service import ChatService, ChatBusyError, CircuitOpenError
+from achievement_engine import AchievementEngine
+from bulk_import import BulkImporter, IMPORT_FORMATS
+from referral_codes import ReferralCodeAllocator
+from records import Achievement as AchievementRecord, AchievementStatus, dump_json
+from metrics import Metrics, MetricsMiddleware
+from admission import AdmissionController, AdmissionMiddleware
+from profiler import SamplingProfiler, ProfilerBusyError
+from referral_graph import ReferralGraph
+from cohorts import CohortAnalyzer
+from warmup import WarmUp
+from worker_sync import WorkerSync
+from etag_cache import ETagCache
 
 # Load environment variables
 dotenv.load_dotenv()
 
-# Initialize OpenAI client
-openai_client = None
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if openai_api_key:
-    openai_client = OpenAI(api_key=openai_api_key)
+# Request, hot-path and event-loop latency histograms behind /metrics
+metrics = Metrics.from_env()
+
+# On-demand stack sampling of this worker (/api/admin/profile)
+profiler = SamplingProfiler.from_env()
+
+# Initialize OpenAI chat (async client, concurrency budget and circuit breaker)
+chat_service = ChatService.from_env(metrics)
 
 # FastAPI app initialization
 app = FastAPI(
@@ -31,6 +50,11 @@ app = FastAPI(
     redoc_url="/redoc"  # Alternative docs at /redoc
 )
 
+# Per-IP/per-link rate limits and concurrency caps on the public routes;
+# added first so it runs innermost and rejections still get CORS headers
+admission = AdmissionController.from_env()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -40,20 +64,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps CORS too; unhandled errors are counted as 500
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 # Security configuration
 SECRET_KEY = "cloudwalk-super-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=12)
+# /api/admin/* needs X-Admin-Token equal to ADMIN_TOKEN; unset, the admin API is closed
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+# bcrypt on a bounded worker pool; legacy sha256 hashes are upgraded on login
+password_hasher = PasswordHasher.from_env(metrics)
 security = HTTPBearer()
 
-# In-memory database (mock data)
-users_db = {}
-referrals_db = {}
-clicks_db = []
+# Verified JWTs, so repeat requests skip signature checks
+token_cache = TokenCache(
+    max_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    max_ttl=float(os.getenv("TOKEN_CACHE_TTL", "300"))
+)
+
+# Persistence backend (in-memory by default, STORAGE_BACKEND=postgres for init.sql)
+storage = create_storage()
+
+# Referral codes: keyed permutation of a storage-backed counter
+referral_codes = ReferralCodeAllocator.from_env(storage)
+
+# Who referred whom, with downline size/earnings per user (rebuilt at startup)
+referral_graph = ReferralGraph.from_env()
+
+# Signup cohorts, retention and churn over columnar arrays (/api/admin/cohorts)
+cohorts = CohortAnalyzer.from_env()
+
+# Logouts, referral graph and cohort activity of the other workers (polled from storage)
+worker_sync = WorkerSync.from_env(storage, token_cache, referral_graph, cohorts)
+
+# ETags from storage-kept versions: polls get a 304 or a body serialized once per version
+etags = ETagCache.from_env(storage)
 achievements_db = {}
 
+# Achievement thresholds sorted per category, so unlock checks are a bisect
+achievement_engine = AchievementEngine.from_env()
+
+class RecordJSONResponse(JSONResponse):
+    """Serializes slotted records straight to JSON bytes (public fields only)"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
 # Pydantic models
 class UserRegister(BaseModel):
     firstName: str
@@ -72,6 +135,7 @@ class Token(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    stream: bool = False  # Server-sent events, one "delta" per token
 
 class Achievement(BaseModel):
     id: str
@@ -82,14 +146,28 @@ class Achievement(BaseModel):
     reward_amount: float
     category: str  # 'referrals', 'earnings', 'social'
 
-# Password utilities (simplified for demo)
-def verify_password(plain_password, hashed_password):
-    return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+# Password utilities
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
-def get_password_hash(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+async def verify_password(user: dict, plain_password: str) -> bool:
+    """Check a password and transparently upgrade outdated stored hashes"""
+    valid, new_hash = await password_hasher.verify_and_update(plain_password, user["password_hash"])
+    if valid and new_hash:
+        await storage.update_user(user["id"], password_hash=new_hash)
+    return valid
 
 # JWT utilities
+# python-jose is imported on the first token operation (or by the warm-up), not at import
+_jwt = None
+
+def jose_jwt():
+    global _jwt
+    if _jwt is None:
+        from jose import jwt
+        _jwt = jwt
+    return _jwt
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -97,22 +175,37 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jose_jwt().encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_token(token: str):
+    """Verify a JWT and return (user_id, exp)"""
+    jwt = jose_jwt()
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.timer("jwt_verify"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    except JWTError:
+    except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return user_id, payload["exp"]
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    if token_cache.is_revoked(token):
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    
+    user_id = token_cache.get(token)
+    if user_id is None:
+        user_id, exp = decode_token(token)
+        token_cache.put(token, user_id, exp)
     
-    user = users_db.get(user_id)
+    with metrics.timer("store_lookup"):
+        user = await storage.get_user(user_id)
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
+    cohorts.record_activity(user_id)
     return user
 
 # Initialize achievements
@@ -175,66 +268,118 @@ def initialize_achievements():
     ]
     
     for achievement in achievements:
-        achievements_db[achievement["id"]] = achievement
+        achievements_db[achievement["id"]] = AchievementRecord(**achievement)
+    achievement_engine.load_catalog(achievements_db.values())
 
-# Initialize achievements on startup
-initialize_achievements()
+def achievement_catalog() -> dict:
+    """The achievement catalog, loaded on first use (or by the warm-up)"""
+    if not achievements_db:
+        initialize_achievements()
+    return achievements_db
 
 # Utility functions
-def generate_referral_code():
-    """Generate a 6-character referral code"""
-    import random
-    import string
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+async def generate_referral_code():
+    """Next referral code from the allocator (unique without a lookup loop)"""
+    return await referral_codes.allocate()
 
-def check_achievements(user_id: str):
+async def check_achievements(user_id: str):
     """Check and unlock achievements for a user"""
-    user = users_db.get(user_id)
+    user = await storage.get_user(user_id)
     if not user:
         return []
     
-    newly_unlocked = []
-    user_achievements = user.get("achievements", [])
+    achievement_catalog()
+    newly_unlocked = achievement_engine.evaluate(user)
+    for achievement in newly_unlocked:
+        if await storage.add_achievement(user_id, achievement["id"]):
+            user = await storage.increment_user(user_id, total_earnings=achievement["reward_amount"])
+            referral_graph.set_earnings(user_id, user["total_earnings"])
     
-    for achievement_id, achievement in achievements_db.items():
-        # Skip if already unlocked
-        if achievement_id in user_achievements:
-            continue
-            
-        # Check achievement criteria
-        if achievement["category"] == "referrals":
-            if user.get("total_referrals", 0) >= achievement["target_value"]:
-                user_achievements.append(achievement_id)
-                user["total_earnings"] += achievement["reward_amount"]
-                newly_unlocked.append(achievement)
-                
-        elif achievement["category"] == "earnings":
-            if user.get("total_earnings", 0) >= achievement["target_value"]:
-                user_achievements.append(achievement_id)
-                user["total_earnings"] += achievement["reward_amount"]
-                newly_unlocked.append(achievement)
-    
-    user["achievements"] = user_achievements
     return newly_unlocked
 
+async def check_imported_achievements(users: List[dict], referrer_ids: set):
+    """Unlock achievements for an imported batch and the referrers it credited"""
+    # Batches keep file order, so a referrer in the batch is attached before its referrals
+    for user in users:
+        referral_graph.add(user["id"], user.get("referrer_id"), user["total_earnings"])
+        cohorts.add_user(user["id"], user["created_at"], user.get("referrer_id"))
+    for user_id in referrer_ids | {user["id"] for user in users}:
+        await check_achievements(user_id)
+
+# Bulk user import (JSONL/CSV), committed in batches by a background task
+bulk_importer = BulkImporter.from_env(
+    storage, password_hasher, code_allocator=referral_codes, on_batch=check_imported_achievements
+)
+
+# Loads the lazily initialized subsystems after startup (WARMUP_MODE=background|blocking|off)
+warmup = WarmUp.from_env()
+warmup.add("jwt", jose_jwt)
+warmup.add("password_hasher", password_hasher.warm_up)
+warmup.add("achievements", achievement_catalog, in_thread=False)
+warmup.add("cohorts", cohorts.warm_up)
+warmup.add("chat", chat_service.warm_up)
+
+# Lifecycle
+@app.on_event("startup")
+async def connect_storage():
+    await storage.connect()
+    await worker_sync.load()
+    worker_sync.start()
+    metrics.start()
+    await warmup.start()
+
+@app.on_event("shutdown")
+async def close_storage():
+    await warmup.stop()
+    await metrics.stop()
+    await worker_sync.stop()
+    await bulk_importer.close()
+    await chat_service.close()
+    await storage.close()
+    password_hasher.close()
+
+@app.exception_handler(HasherBusyError)
+@app.exception_handler(ChatBusyError)
+@app.exception_handler(CircuitOpenError)
+async def overloaded_handler(request, exc: Exception):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # Health check
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+# Prometheus scrape target
+metrics.add_stats("storage", storage.health)
+metrics.add_stats("password_hasher", password_hasher.stats)
+metrics.add_stats("token_cache", token_cache.stats)
+metrics.add_stats("admission", admission.stats)
+metrics.add_stats("profiler", profiler.stats)
+metrics.add_stats("chat", chat_service.stats)
+metrics.add_stats("worker_sync", worker_sync.stats)
+metrics.add_stats("referral_graph", referral_graph.stats)
+metrics.add_stats("achievements", achievement_engine.stats)
+metrics.add_stats("cohorts", cohorts.stats)
+metrics.add_stats("warmup", warmup.stats)
+metrics.add_stats("etag_cache", etags.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Authentication endpoints
 @app.post("/api/register", response_model=dict)
 async def register_user(user: UserRegister):
     # Check if user already exists
-    if any(u["email"] == user.email for u in users_db.values()):
+    if await storage.email_exists(user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Generate user ID and referral code
     user_id = str(uuid.uuid4())
-    referral_code = generate_referral_code()
+    referral_code = await generate_referral_code()
     
     # Hash password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     
     # Create user
     new_user = {
@@ -242,33 +387,30 @@ async def register_user(user: UserRegister):
         "first_name": user.firstName,
         "last_name": user.lastName,
         "email": user.email,
-        "password": hashed_password,
+        "password_hash": hashed_password,
         "referral_code": referral_code,
         "total_referrals": 0,
         "total_earnings": 0.0,
         "achievements": [],
-        "created_at": datetime.utcnow().isoformat()
+        "created_at": datetime.utcnow().isoformat(),
+        "referrer_id": None
     }
     
     # Handle referral code if provided
     referral_bonus = None
     if user.referralCode:
         # Find the referrer
-        referrer = None
-        for u in users_db.values():
-            if u.get("referral_code") == user.referralCode:
-                referrer = u
-                break
-                
+        referrer = await storage.get_user_by_referral_code(user.referralCode)
         if referrer:
             # Give bonus to new user ($25)
             new_user["total_earnings"] = 25.0
+            new_user["referrer_id"] = referrer["id"]
             # Give bonus to referrer ($50)
-            referrer["total_earnings"] += 50.0
-            referrer["total_referrals"] += 1
+            referrer = await storage.increment_user(referrer["id"], total_earnings=50.0, total_referrals=1)
+            referral_graph.set_earnings(referrer["id"], referrer["total_earnings"])
             
             # Check achievements for referrer
-            check_achievements(referrer["id"])
+            await check_achievements(referrer["id"])
             
             referral_bonus = {
                 "new_user_bonus": 25.0,
@@ -279,10 +421,12 @@ async def register_user(user: UserRegister):
             print(f"✅ Referral bonus: New user gets $25, Referrer {referrer['email']} gets $50")
     
     # Save user
-    users_db[user_id] = new_user
+    await storage.insert_user(new_user)
+    referral_graph.add(user_id, new_user["referrer_id"], new_user["total_earnings"])
+    cohorts.add_user(user_id, new_user["created_at"], new_user["referrer_id"])
     
     # Check achievements for new user
-    check_achievements(user_id)
+    await check_achievements(user_id)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -314,14 +458,11 @@ async def register_user(user: UserRegister):
 @app.post("/api/login", response_model=dict)
 async def login_user(user: UserLogin):
     # Find user by email
-    found_user = None
-    for u in users_db.values():
-        if u["email"] == user.email:
-            found_user = u
-            break
-    
-    if not found_user or not verify_password(user.password, found_user["password"]):
+    with metrics.timer("store_lookup"):
+        found_user = await storage.get_user_by_email(user.email)
+    if not found_user or not await verify_password(found_user, user.password):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
+    cohorts.record_activity(found_user["id"])
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -344,15 +485,24 @@ async def login_user(user: UserLogin):
         }
     }
 
+@app.post("/api/logout")
+async def logout_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    _, exp = decode_token(credentials.credentials)
+    token_cache.invalidate(credentials.credentials, exp)
+    # Other workers/instances only learn about the logout through storage
+    await storage.revoke_token(credentials.credentials, exp)
+    return {"message": "Logged out"}
+
 # Demo data endpoint
 @app.post("/api/demo-data")
 async def create_demo_data():
     """Create demo users and data for testing"""
-    import random
     
     # Clear existing data
-    users_db.clear()
-    referrals_db.clear()
+    await storage.clear()
+    achievement_engine.clear()
+    referral_graph.clear()
+    cohorts.clear()
     
     # Create demo users
     demo_users = [
@@ -384,15 +534,15 @@ async def create_demo_data():
     
     for demo_data in demo_users:
         user_id = str(uuid.uuid4())
-        referral_code = generate_referral_code()
-        hashed_password = get_password_hash(demo_data["password"])
+        referral_code = await generate_referral_code()
+        hashed_password = await get_password_hash(demo_data["password"])
         
         user = {
             "id": user_id,
             "first_name": demo_data["firstName"],
             "last_name": demo_data["lastName"],
             "email": demo_data["email"],
-            "password": hashed_password,
+            "password_hash": hashed_password,
             "referral_code": referral_code,
             "total_referrals": demo_data["total_referrals"],
             "total_earnings": demo_data["total_earnings"],
@@ -401,8 +551,10 @@ async def create_demo_data():
         }
         
         # Check achievements
-        check_achievements(user_id)
-        users_db[user_id] = user
+        await check_achievements(user_id)
+        await storage.insert_user(user)
+        referral_graph.add(user_id, None, user["total_earnings"])
+        cohorts.add_user(user_id, user["created_at"])
     
     return {
         "message": "Demo data created successfully",
@@ -416,29 +568,207 @@ async def create_demo_data():
 
 # Advanced Features
 
-@app.get("/api/admin/stats")
-async def get_admin_stats():
+@app.get("/api/admin/stats", dependencies=[Depends(require_admin)])
+async def get_admin_stats(request: Request):
     """Admin endpoint for system statistics"""
-    total_clicks = sum(ref.get('click_count', 0) for ref in referrals_db.values())
-    total_registrations = sum(ref.get('registration_count', 0) for ref in referrals_db.values())
+    versions = await storage.resource_versions()
+    return await etags.respond(request, ("stats",), etags.tag("stats", versions["stats"]), admin_stats)
+
+async def admin_stats() -> dict:
+    totals = await storage.system_totals()
+    total_clicks = totals["total_clicks"]
+    total_registrations = totals["total_registrations"]
     
     return {
-        "total_users": len(users_db),
-        "total_referrals": sum(user.get("total_referrals", 0) for user in users_db.values()),
+        "total_users": totals["total_users"],
+        "total_referrals": totals["total_referrals"],
         "total_clicks": total_clicks,
         "total_registrations": total_registrations,
         "conversion_rate": (total_registrations / total_clicks * 100) if total_clicks > 0 else 0,
-        "total_earnings_paid": sum(user.get("total_earnings", 0) for user in users_db.values())
+        "total_earnings_paid": round(totals["total_earnings"], 2)
+    }
+
+@app.post("/api/admin/stats/reconcile", dependencies=[Depends(require_admin)])
+async def reconcile_admin_stats():
+    """Recount system totals from stored data and fix any drift"""
+    return await storage.reconcile_totals()
+
+@app.get("/api/admin/referral-codes", dependencies=[Depends(require_admin)])
+async def get_referral_code_stats():
+    """Referral code allocator usage and per-code allocation cost"""
+    return referral_codes.stats()
+
+@app.get("/api/admin/storage", dependencies=[Depends(require_admin)])
+async def get_storage_health():
+    """Storage backend and connection pool health"""
+    return storage.health()
+
+@app.post("/api/admin/storage/snapshot", dependencies=[Depends(require_admin)])
+async def take_storage_snapshot():
+    """Write a snapshot of the in-memory store now and trim the journal"""
+    if getattr(storage, "persistence", None) is None:
+        raise HTTPException(status_code=400, detail="Persistence is not enabled (set MEMORY_DATA_DIR)")
+    return await storage.snapshot()
+
+@app.get("/api/admin/admission", dependencies=[Depends(require_admin)])
+async def get_admission_stats():
+    """Admitted and shed requests per route class (rate limits and concurrency caps)"""
+    return admission.stats()
+
+@app.get("/api/admin/password-hasher", dependencies=[Depends(require_admin)])
+async def get_password_hasher_stats():
+    """Password hashing pool usage and queue wait times"""
+    return password_hasher.stats()
+
+@app.get("/api/admin/token-cache", dependencies=[Depends(require_admin)])
+async def get_token_cache_stats():
+    """Verified-token cache hit/miss counters"""
+    return token_cache.stats()
+
+@app.post("/api/admin/token-cache/clear", dependencies=[Depends(require_admin)])
+async def clear_token_cache():
+    """Drop cached verifications, e.g. after rotating SECRET_KEY"""
+    token_cache.clear()
+    return token_cache.stats()
+
+@app.post("/api/admin/import", status_code=202, dependencies=[Depends(require_admin)])
+async def start_bulk_import(request: Request, format: str = Query("jsonl")):
+    """Stream a JSONL/CSV body of users into storage; poll the returned job for progress"""
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    job = await bulk_importer.submit(request.stream(), format)
+    return job.to_dict()
+
+@app.get("/api/admin/import", dependencies=[Depends(require_admin)])
+async def list_bulk_imports():
+    """Recent import jobs, newest first"""
+    return {"jobs": bulk_importer.list_jobs()}
+
+@app.get("/api/admin/import/{job_id}", dependencies=[Depends(require_admin)])
+async def get_bulk_import(job_id: str):
+    """Progress of an import job"""
+    job = bulk_importer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
+
+@app.get("/api/admin/import/{job_id}/errors", dependencies=[Depends(require_admin)])
+async def get_bulk_import_errors(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """Rejected rows of an import job with the reason for each"""
+    job = bulk_importer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return {
+        "errors": job.errors[offset:offset + limit],
+        "total": job.rejected,
+        "dropped": job.errors_dropped,
+        "offset": offset,
+        "limit": limit
     }
 
+@app.post("/api/admin/achievements/recompute", dependencies=[Depends(require_admin)])
+async def recompute_achievements():
+    """Re-evaluate every user against the current achievement catalog"""
+    initialize_achievements()
+    users_checked = 0
+    unlocked = 0
+    rewards_paid = 0.0
+    async for batch in storage.iter_users():
+        for user in batch:
+            users_checked += 1
+            achievement_engine.forget(user["id"])
+            for achievement in await check_achievements(user["id"]):
+                unlocked += 1
+                rewards_paid += achievement["reward_amount"]
+    return {
+        "catalog_version": achievement_engine.catalog_version,
+        "achievements": len(achievements_db),
+        "users_checked": users_checked,
+        "achievements_unlocked": unlocked,
+        "rewards_paid": round(rewards_paid, 2)
+    }
+
+@app.get("/api/admin/referral-graph", dependencies=[Depends(require_admin)])
+async def get_referral_graph_stats():
+    """Size and shape of the in-process referral graph"""
+    return referral_graph.stats()
+
+@app.post("/api/admin/referral-graph/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_referral_graph():
+    """Recompute the referral graph and every downline aggregate from storage"""
+    await referral_graph.rebuild_from(storage)
+    return referral_graph.stats()
+
+@app.get("/api/admin/cohorts", dependencies=[Depends(require_admin)])
+async def get_cohort_retention(
+    days: int = Query(84, ge=1, le=3660),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    period: Literal["week", "month"] = "week",
+    metric: Literal["activity", "referrals"] = "activity",
+    periods: int = Query(12, ge=1, le=52),
+    churn_days: int = Query(30, ge=1, le=365)
+):
+    """Signup cohorts with the share active (or referring) each week/month after signup, and churn"""
+    # Default window is the last `days` days of signups, including today
+    end_day = end or datetime.utcnow().date()
+    start_day = start or end_day - timedelta(days=days - 1)
+    try:
+        return await cohorts.retention(start_day, end_day, period, metric, periods, churn_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/etag-cache", dependencies=[Depends(require_admin)])
+async def get_etag_cache_stats():
+    """304s and cached bodies served for the versioned GETs"""
+    return etags.stats()
+
+@app.get("/api/admin/warmup", dependencies=[Depends(require_admin)])
+async def get_warmup_stats():
+    """Which lazy subsystems the warm-up has loaded and how long each took"""
+    return warmup.stats()
+
+@app.get("/api/admin/chat", dependencies=[Depends(require_admin)])
+async def get_chat_stats():
+    """Chat concurrency budget and circuit breaker state"""
+    return chat_service.stats()
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_worker(
+    seconds: float = Query(10.0, gt=0),
+    interval: Optional[float] = Query(None, ge=0.001, le=1.0),
+    threads: Literal["loop", "all"] = Query("loop"),
+    top: int = Query(30, ge=1, le=500),
+    format: Literal["json", "collapsed"] = Query("json")
+):
+    """Sample this worker's stacks for a few seconds (format=collapsed feeds flamegraph.pl/speedscope)"""
+    try:
+        profile = await profiler.profile(seconds, interval, all_threads=threads == "all", top=top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return PlainTextResponse(profile["collapsed"] + "\n")
+    return profile
+
+@app.get("/api/admin/traces", dependencies=[Depends(require_admin)])
+async def get_request_traces():
+    """Hot-path spans of recent requests sent with the trace header (X-Trace: 1)"""
+    return {"traces": metrics.recent_traces()}
+
 @app.get("/api/leaderboard")
-async def get_leaderboard():
+async def get_leaderboard(request: Request, offset: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100)):
     """Get top performers leaderboard"""
-    users_list = list(users_db.values())
-    users_list.sort(key=lambda x: x.get('total_referrals', 0), reverse=True)
-    
+    versions = await storage.resource_versions()
+    return await etags.respond(
+        request, ("leaderboard", offset, limit), etags.tag("leaderboard", versions["leaderboard"]),
+        lambda: leaderboard_page(offset, limit)
+    )
+
+async def leaderboard_page(offset: int, limit: int) -> dict:
     leaderboard = []
-    for rank, user in enumerate(users_list[:10], 1):
+    for rank, user in enumerate(await storage.leaderboard(limit, offset), offset + 1):
         leaderboard.append({
             "rank": rank,
             "user_id": user["id"],
@@ -447,100 +777,168 @@ async def get_leaderboard():
             "total_earnings": user.get("total_earnings", 0)
         })
     
-    return {"leaderboard": leaderboard}
+    return {
+        "leaderboard": leaderboard,
+        "offset": offset,
+        "limit": limit,
+        "total": await storage.count_users()
+    }
+
+@app.get("/api/leaderboard/me")
+async def get_my_rank(current_user: dict = Depends(get_current_user)):
+    """Get the current user's leaderboard position"""
+    return {
+        "rank": await storage.user_rank(current_user["id"]),
+        "total_users": await storage.count_users(),
+        "user_id": current_user["id"],
+        "total_referrals": current_user.get("total_referrals", 0),
+        "total_earnings": current_user.get("total_earnings", 0)
+    }
+
+@app.get("/api/network")
+async def get_my_network(limit: int = Query(20, ge=1, le=100), current_user: dict = Depends(get_current_user)):
+    """Downline of the current user: size, depth, earnings, head count per level and direct referrals"""
+    network = referral_graph.network(current_user["id"])
+    if network is None:
+        raise HTTPException(status_code=404, detail="User not in referral graph")
+    direct = []
+    for user_id, network_size in referral_graph.direct_referrals(current_user["id"], limit):
+        user = await storage.get_user(user_id)
+        if user:
+            direct.append({
+                "id": user_id,
+                "first_name": user["first_name"],
+                "last_name": user["last_name"],
+                "total_referrals": user["total_referrals"],
+                "network_size": network_size
+            })
+    network["referrals"] = direct
+    return network
 
 @app.get("/api/achievements")
-async def get_user_achievements(current_user: dict = Depends(get_current_user)):
+async def get_user_achievements(request: Request, current_user: dict = Depends(get_current_user)):
     """Get user achievements with progress"""
-    user_achievements = current_user.get("achievements", [])
+    # The user id is in the tag so a client switching accounts never gets a 304 for the other one
+    catalog = achievement_catalog()
+    etag = etags.tag("achievements", current_user["id"], current_user["version"], achievement_engine.catalog_version)
+    return await etags.respond(
+        request, ("achievements", current_user["id"]), etag, lambda: achievements_progress(current_user, catalog),
+        response_class=RecordJSONResponse, private=True
+    )
+
+async def achievements_progress(current_user: dict, catalog: dict) -> dict:
+    user_achievements = set(current_user.get("achievements", []))
+    counters = {
+        "referrals": current_user.get("total_referrals", 0),
+        "earnings": current_user.get("total_earnings", 0)
+    }
     achievements_list = []
     
-    for achievement_id, achievement in achievements_db.items():
-        is_unlocked = achievement_id in user_achievements
-        
+    for achievement_id, achievement in catalog.items():
         # Calculate progress
-        if achievement["category"] == "referrals":
-            progress = min(current_user.get("total_referrals", 0) / achievement["target_value"], 1.0)
-        elif achievement["category"] == "earnings":
-            progress = min(current_user.get("total_earnings", 0) / achievement["target_value"], 1.0)
-        else:
-            progress = 0.0
-        
-        achievements_list.append({
-            **achievement,
-            "is_unlocked": is_unlocked,
-            "progress": progress
-        })
+        current_value = counters.get(achievement.category)
+        progress = min(current_value / achievement.target_value, 1.0) if current_value is not None else 0.0
+        achievements_list.append(AchievementStatus(
+            achievement=achievement,
+            is_unlocked=achievement_id in user_achievements,
+            progress=progress
+        ))
     
     # Sort: unlocked first, then by category
-    achievements_list.sort(key=lambda x: (not x["is_unlocked"], x["category"]))
+    achievements_list.sort(key=lambda x: (not x.is_unlocked, x.achievement.category))
     
     return {"achievements": achievements_list}
 
+def chat_user_stats(user: dict) -> dict:
+    return {
+        "total_earnings": user.get("total_earnings", 0),
+        "total_referrals": user.get("total_referrals", 0),
+        "referral_code": user.get("referral_code", "")
+    }
+
+def build_chat_messages(user: dict, message: str) -> list:
+    # Create system context with user data
+    system_context = f"""
+    You are a helpful AI assistant for CloudWalk's referral program. 
+    Current user: {user['first_name']} {user['last_name']}
+    User earnings: ${user.get('total_earnings', 0)}
+    User referrals: {user.get('total_referrals', 0)}
+    User referral code: {user.get('referral_code', '')}
+    
+    Help users with:
+    - Understanding the referral program ($25 for new users, $50 for referrers)
+    - Tips to increase referrals
+    - Account and earnings information
+    - General CloudWalk questions
+    
+    Be helpful, friendly, and encouraging. Always respond in a concise and actionable way.
+    """
+    return [
+        {"role": "system", "content": system_context},
+        {"role": "user", "content": message}
+    ]
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
 @app.post("/api/chat")
 async def chat_with_ai(chat_request: ChatRequest, current_user: dict = Depends(get_current_user)):
     """ChatGPT AI Agent for customer support and analytics"""
     
     # Check if OpenAI client is configured
-    if not openai_client:
+    if not chat_service.enabled:
         return {
             "response": "❌ OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file to enable the ChatGPT agent.",
-            "user_stats": {
-                "total_earnings": current_user.get("total_earnings", 0),
-                "total_referrals": current_user.get("total_referrals", 0),
-                "referral_code": current_user.get("referral_code", "")
-            }
+            "user_stats": chat_user_stats(current_user)
         }
     
-    try:
-        # Create system context with user data
-        system_context = f"""
-        You are a helpful AI assistant for CloudWalk's referral program. 
-        Current user: {current_user['first_name']} {current_user['last_name']}
-        User earnings: ${current_user.get('total_earnings', 0)}
-        User referrals: {current_user.get('total_referrals', 0)}
-        User referral code: {current_user.get('referral_code', '')}
-        
-        Help users with:
-        - Understanding the referral program ($25 for new users, $50 for referrers)
-        - Tips to increase referrals
-        - Account and earnings information
-        - General CloudWalk questions
-        
-        Be helpful, friendly, and encouraging. Always respond in a concise and actionable way.
-        """
+    messages = build_chat_messages(current_user, chat_request.message)
+    
+    if chat_request.stream:
+        deltas = chat_service.stream(messages)
+        try:
+            # Pull the first token before answering so busy/outage errors
+            # still come back as a proper status code
+            first_delta = await deltas.__anext__()
+        except StopAsyncIteration:
+            first_delta = ""
+        except (ChatBusyError, CircuitOpenError):
+            raise
+        except Exception as e:
+            return {
+                "response": f"❌ OpenAI API Error: {str(e)}. Please check your API key and try again.",
+                "user_stats": chat_user_stats(current_user)
+            }
         
-        # Call OpenAI API with new client
-        response = openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_context},
-                {"role": "user", "content": chat_request.message}
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
+        async def events():
+            if first_delta:
+                yield sse_event({"delta": first_delta})
+            try:
+                async for delta in deltas:
+                    yield sse_event({"delta": delta})
+            except Exception as e:
+                yield sse_event({"detail": f"OpenAI API Error: {str(e)}"}, event="error")
+                return
+            yield sse_event({"user_stats": chat_user_stats(current_user)}, event="done")
         
-        ai_response = response.choices[0].message.content
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    
+    try:
+        ai_response = await chat_service.complete(messages)
         
         return {
             "response": ai_response,
-            "user_stats": {
-                "total_earnings": current_user.get("total_earnings", 0),
-                "total_referrals": current_user.get("total_referrals", 0),
-                "referral_code": current_user.get("referral_code", "")
-            }
+            "user_stats": chat_user_stats(current_user)
         }
-        
+    
+    except (ChatBusyError, CircuitOpenError):
+        raise
     except Exception as e:
         # Return error details for debugging
         return {
             "response": f"❌ OpenAI API Error: {str(e)}. Please check your API key and try again.",
-            "user_stats": {
-                "total_earnings": current_user.get("total_earnings", 0),
-                "total_referrals": current_user.get("total_referrals", 0),
-                "referral_code": current_user.get("referral_code", "")
-            }
+            "user_stats": chat_user_stats(current_user)
         }
 
 if __name__ == "__main__":
@@ -548,10 +946,15 @@ if __name__ == "__main__":
     print("📊 Automatic API Documentation: http://localhost:3002/docs")
     print("📖 Alternative Docs: http://localhost:3002/redoc")
     print("🎯 Health Check: http://localhost:3002/health")
-    if openai_client:
+    if chat_service.enabled:
         print("🤖 ChatGPT Agent: ENABLED ✅")
     else:
         print("🤖 ChatGPT Agent: DISABLED ❌ (Add OPENAI_API_KEY to .env)")
     print("")
     
-    uvicorn.run("main:app", host="0.0.0.0", port=3002, reload=True)
\ No newline at end of file
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and storage.name == "memory":
+        raise SystemExit("❌ WEB_CONCURRENCY > 1 needs shared state: set STORAGE_BACKEND=sqlite or postgres")
+    # Auto-reload only with a single dev worker
+    import uvicorn
+    uvicorn.run("main:app", host="0.0.0.0", port=3002, reload=workers == 1, workers=workers)
\ No newline at end of file
@@ -0,0 +1,339 @@
+import asyncio
+import os
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds (the +Inf bucket is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Internal timings exposed as referral_hot_path_duration_seconds{operation=...}
+HOT_PATHS = ("password_hash", "password_verify", "jwt_verify", "store_lookup", "openai")
+
+# Route label for requests no route matched, so 404 scans can't grow the label set
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``observe`` is a bisect and three increments"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, count) pairs as Prometheus expects them, ending with +Inf"""
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets.append((_format_number(bound), total))
+        buckets.append(("+Inf", total + self.counts[-1]))
+        return buckets
+
+
+class RequestTrace:
+    """Hot-path spans of one request that asked for tracing"""
+
+    __slots__ = ("id", "method", "path", "started", "spans", "status", "duration")
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+        self.status = 0
+        self.duration = 0.0
+
+    def add(self, name: str, started: float, seconds: float):
+        self.spans.append((name, started - self.started, seconds))
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` header value, durations in ms as browsers expect"""
+        entries = [f"{name};dur={seconds * 1000:.3f}" for name, _, seconds in self.spans]
+        entries.append(f"app;dur={(time.perf_counter() - self.started) * 1000:.3f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3),
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                for name, offset, seconds in self.spans
+            ],
+        }
+
+
+# Trace of the request being handled, only set when it sent the trace header
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+class _Timer:
+    """``with metrics.timer(name):`` records the block's wall time"""
+
+    __slots__ = ("name", "histogram", "started")
+
+    def __init__(self, name: str, histogram: Histogram):
+        self.name = name
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.name, self.started, elapsed)
+        return False
+
+
+class Metrics:
+    """Request, hot-path and event-loop latency histograms in Prometheus text format
+
+    ``MetricsMiddleware`` counts requests per (method, route template, status)
+    and keeps one latency histogram per (method, route). Hot paths (password
+    hashing, JWT verification, store lookups, OpenAI calls) are recorded with
+    ``timer``/``observe``. A background task measures event-loop lag as how
+    late a ``sleep(interval)`` wakes up. Components with a ``stats()`` dict
+    can be registered with ``add_stats`` and are exported as gauges.
+
+    Requests carrying ``trace_header`` also collect their hot-path spans: they
+    come back in a ``Server-Timing`` response header and the last
+    ``trace_history`` traces are kept for ``recent_traces``.
+    """
+
+    def __init__(self, prefix: str = "referral", loop_lag_interval: float = 0.5,
+                 trace_header: Optional[str] = "x-trace", trace_history: int = 100):
+        self.prefix = prefix
+        self.loop_lag_interval = loop_lag_interval
+        self.trace_header = trace_header.lower().encode() if trace_header else None
+        self.traces: "deque[RequestTrace]" = deque(maxlen=trace_history)
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.hot_paths: Dict[str, Histogram] = {name: Histogram() for name in HOT_PATHS}
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.max_loop_lag = 0.0
+        self.in_flight = 0
+        self._route_names: Dict[Callable, str] = {}
+        self._stats: Dict[str, Callable[[], dict]] = {}
+        self._lag_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            prefix=os.getenv("METRICS_PREFIX", "referral"),
+            loop_lag_interval=float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5")),
+            trace_header=os.getenv("TRACE_HEADER", "x-trace"),
+            trace_history=int(os.getenv("TRACE_HISTORY", "100")),
+        )
+
+    # Recording
+    def timer(self, name: str) -> _Timer:
+        return _Timer(name, self.hot_paths[name])
+
+    def observe(self, name: str, seconds: float):
+        self.hot_paths[name].observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, time.perf_counter() - seconds, seconds)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram()
+        histogram.observe(seconds)
+
+    def route_name(self, scope) -> str:
+        """Route template (``/api/track-click/{link_code}``) of a handled request"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            # Set by middleware that answered before routing (admission control)
+            return scope.get("route_path", UNMATCHED_ROUTE)
+        name = self._route_names.get(endpoint)
+        if name is None:
+            # Built on first sight of an endpoint, so routes added late are picked up too
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is not None:
+                    self._route_names[route.endpoint] = route.path
+            name = self._route_names.setdefault(endpoint, UNMATCHED_ROUTE)
+        return name
+
+    def start_trace(self, scope) -> Optional[RequestTrace]:
+        """A trace for this request if it sent the trace header"""
+        if self.trace_header is None:
+            return None
+        for name, value in scope["headers"]:
+            if name == self.trace_header and value not in (b"", b"0", b"false"):
+                return RequestTrace(scope["method"], scope["path"])
+        return None
+
+    def recent_traces(self) -> List[dict]:
+        return [trace.to_dict() for trace in reversed(self.traces)]
+
+    def add_stats(self, component: str, stats: Callable[[], dict]):
+        """Export the numeric values of a component's ``stats()`` as gauges"""
+        self._stats[component] = stats
+
+    # Event-loop lag
+    def start(self):
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._monitor_loop_lag())
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    async def _monitor_loop_lag(self):
+        while True:
+            expected = time.perf_counter() + self.loop_lag_interval
+            await asyncio.sleep(self.loop_lag_interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.loop_lag.observe(lag)
+            self.max_loop_lag = max(self.max_loop_lag, lag)
+
+    # Exposition
+    def render(self) -> str:
+        prefix = self.prefix
+        lines = [
+            f"# HELP {prefix}_http_requests_total HTTP requests by method, route and status",
+            f"# TYPE {prefix}_http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f'{prefix}_http_requests_total{{method="{method}",route="{_escape(route)}",'
+                         f'status="{status}"}} {count}')
+
+        lines += [
+            f"# HELP {prefix}_http_request_duration_seconds Time to the last response byte",
+            f"# TYPE {prefix}_http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            _render_histogram(lines, f"{prefix}_http_request_duration_seconds",
+                              f'method="{method}",route="{_escape(route)}"', histogram)
+
+        lines += [
+            f"# HELP {prefix}_http_requests_in_flight Requests currently being handled",
+            f"# TYPE {prefix}_http_requests_in_flight gauge",
+            f"{prefix}_http_requests_in_flight {self.in_flight}",
+            f"# HELP {prefix}_hot_path_duration_seconds Internal operation timings",
+            f"# TYPE {prefix}_hot_path_duration_seconds histogram",
+        ]
+        for name, histogram in self.hot_paths.items():
+            _render_histogram(lines, f"{prefix}_hot_path_duration_seconds", f'operation="{name}"', histogram)
+
+        lines += [
+            f"# HELP {prefix}_event_loop_lag_seconds How late the event loop woke a timer",
+            f"# TYPE {prefix}_event_loop_lag_seconds histogram",
+        ]
+        _render_histogram(lines, f"{prefix}_event_loop_lag_seconds", "", self.loop_lag)
+        lines += [
+            f"# HELP {prefix}_event_loop_lag_max_seconds Worst event-loop lag since start",
+            f"# TYPE {prefix}_event_loop_lag_max_seconds gauge",
+            f"{prefix}_event_loop_lag_max_seconds {_format_number(self.max_loop_lag)}",
+        ]
+
+        for component, stats in self._stats.items():
+            for key, value in _flatten(stats()):
+                name = f"{prefix}_{component}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware timing every HTTP request until its last body chunk"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        started = time.perf_counter()
+        status = 500
+        trace = metrics.start_trace(scope)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    message["headers"] = [
+                        *message.get("headers", ()),
+                        (b"server-timing", trace.server_timing().encode()),
+                        (b"x-trace-id", trace.id.encode()),
+                    ]
+            await send(message)
+
+        metrics.in_flight += 1
+        token = _current_trace.set(trace) if trace is not None else None
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            elapsed = time.perf_counter() - started
+            metrics.observe_request(scope["method"], metrics.route_name(scope), status, elapsed)
+            if trace is not None:
+                _current_trace.reset(token)
+                trace.status = status
+                trace.duration = elapsed
+                metrics.traces.append(trace)
+
+
+def _render_histogram(lines: List[str], name: str, labels: str, histogram: Histogram):
+    separator = "," if labels else ""
+    for le, count in histogram.cumulative():
+        lines.append(f'{name}_bucket{{{labels}{separator}le="{le}"}} {count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {_format_number(histogram.sum)}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+def _flatten(stats: dict, prefix: str = ""):
+    """(name, number) pairs of a stats dict, nested dicts joined with ``_``"""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, bool):
+            yield f"{prefix}{key}", int(value)
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", value
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+
+class HasherBusyError(Exception):
+    """Raised when a hash request waited too long for a free worker"""
+
+
+class PasswordHasher:
+    """Runs password hashing on a bounded thread pool instead of the event loop
+
+    bcrypt/argon2 release the GIL while they work, so a small thread pool gives
+    real parallelism without blocking other requests. A semaphore caps how many
+    hashes run at once; callers waiting longer than ``queue_timeout`` get a
+    ``HasherBusyError`` so a login storm sheds load instead of piling up.
+
+    Legacy unsalted sha256 hex digests (``hex_sha256``) still verify, and
+    ``verify_and_update`` hands back a fresh hash for them (or for hashes made
+    with an older cost) so callers can upgrade the stored value on login.
+
+    passlib and the bcrypt backend are loaded on first use; ``warm_up`` does
+    it ahead of time so the first login does not pay for it.
+    """
+
+    def __init__(
+        self,
+        scheme: str = "bcrypt",
+        bcrypt_rounds: int = 12,
+        max_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        queue_timeout: float = 5.0,
+        metrics=None,
+    ):
+        self.scheme = scheme
+        self.metrics = metrics
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_concurrency = max_concurrency or self.max_workers
+        self.queue_timeout = queue_timeout
+        self.bcrypt_rounds = bcrypt_rounds
+        self._context = None
+        self._context_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pwhash")
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Counters
+        self.completed = 0
+        self.rejected = 0
+        self.waiting = 0
+        self.rehashed = 0
+        self.max_wait_ms = 0.0
+        self._total_wait_ms = 0.0
+        self._total_work_ms = 0.0
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        return cls(
+            scheme=os.getenv("PASSWORD_SCHEME", "bcrypt"),
+            bcrypt_rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+            max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None,
+            max_concurrency=int(os.getenv("PASSWORD_HASH_CONCURRENCY", "0")) or None,
+            queue_timeout=float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5.0")),
+            metrics=metrics,
+        )
+
+    @property
+    def context(self):
+        """passlib CryptContext, built on first use"""
+        if self._context is None:
+            with self._context_lock:
+                if self._context is None:
+                    from passlib.context import CryptContext
+                    self._context = CryptContext(
+                        schemes=[self.scheme, "bcrypt", "hex_sha256"] if self.scheme != "bcrypt"
+                        else ["bcrypt", "hex_sha256"],
+                        default=self.scheme,
+                        deprecated="auto",
+                        bcrypt__rounds=self.bcrypt_rounds,
+                    )
+        return self._context
+
+    def warm_up(self):
+        """Build the context and load the hash backends (passlib self-tests them on load)"""
+        for scheme in self.context.schemes():
+            handler = self.context.handler(scheme)
+            if hasattr(handler, "get_backend"):
+                handler.get_backend()
+
+    async def _run(self, operation: str, func, *args):
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HasherBusyError("Password hashing is overloaded, please retry")
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        wait_ms = (started - queued) * 1000
+        self._total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._semaphore.release()
+            self.completed += 1
+            self._total_work_ms += (time.perf_counter() - started) * 1000
+            if self.metrics is not None:
+                # Queue wait included, that's what the request paid
+                self.metrics.observe(operation, time.perf_counter() - queued)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("password_hash", self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run("password_verify", self.context.verify, password, hashed)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Returns (valid, new_hash); new_hash is set when the stored hash is outdated"""
+        valid, new_hash = await self._run("password_verify", self.context.verify_and_update, password, hashed)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {
+            "scheme": self.scheme,
+            "loaded": self._context is not None,
+            "workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_wait_ms": round(self._total_wait_ms / self.completed, 3) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 3),
+            "avg_hash_ms": round(self._total_work_ms / self.completed, 3) if self.completed else 0.0,
+        }
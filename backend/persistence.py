@@ -0,0 +1,424 @@
+import asyncio
+import gc
+import mmap
+import os
+import pickle
+import re
+import struct
+import time
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+# Journal frames: payload length, crc32 of the payload, pickled (op, args)
+FRAME_HEADER = struct.Struct("<II")
+SEGMENT_PATTERN = re.compile(r"^journal-(\d{8})\.log$")
+
+# Snapshot: magic, version, journal generation to replay from, code counter,
+# then offset/length/crc32 of the users and referrals sections
+SNAPSHOT_MAGIC = b"CWSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sIQQQQIQQI")
+SNAPSHOT_VERSION = 1
+
+
+def segment_name(generation: int) -> str:
+    return f"journal-{generation:08d}.log"
+
+
+def read_segment(path: str) -> Iterator[Tuple[str, tuple]]:
+    """Entries of a journal segment, stopping at the first torn or corrupt frame"""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        length, crc = FRAME_HEADER.unpack_from(data, offset)
+        start = offset + FRAME_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            # A crash mid-write leaves a partial last frame; nothing after it was acknowledged
+            return
+        yield pickle.loads(payload)
+        offset = start + length
+
+
+def write_snapshot(path: str, generation: int, code_counter: int, users_section, referrals_section) -> int:
+    """Write a snapshot atomically (temp file + rename); returns its size"""
+    users_blob = pickle.dumps(users_section, protocol=pickle.HIGHEST_PROTOCOL)
+    referrals_blob = pickle.dumps(referrals_section, protocol=pickle.HIGHEST_PROTOCOL)
+    users_offset = SNAPSHOT_HEADER.size
+    referrals_offset = users_offset + len(users_blob)
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, generation, code_counter,
+        users_offset, len(users_blob), zlib.crc32(users_blob),
+        referrals_offset, len(referrals_blob), zlib.crc32(referrals_blob),
+    )
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(users_blob)
+        f.write(referrals_blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+    return referrals_offset + len(referrals_blob)
+
+
+def read_snapshot(path: str) -> tuple:
+    """(generation, code_counter, users_section, referrals_section) from a memory-mapped snapshot"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        users_view = referrals_view = None
+        try:
+            (magic, version, generation, code_counter,
+             users_offset, users_length, users_crc,
+             referrals_offset, referrals_length, referrals_crc) = SNAPSHOT_HEADER.unpack_from(view)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError(f"Not a version {SNAPSHOT_VERSION} snapshot: {path}")
+            users_view = view[users_offset:users_offset + users_length]
+            referrals_view = view[referrals_offset:referrals_offset + referrals_length]
+            if zlib.crc32(users_view) != users_crc or zlib.crc32(referrals_view) != referrals_crc:
+                raise ValueError(f"Snapshot checksum mismatch: {path}")
+            # Unpickle straight from the mapping; no intermediate copy of the file
+            users_section = pickle.loads(users_view)
+            referrals_section = pickle.loads(referrals_view)
+        finally:
+            # Every slice must be released before the mapping can close, errors included
+            for part in (users_view, referrals_view):
+                if part is not None:
+                    part.release()
+            view.release()
+    return generation, code_counter, users_section, referrals_section
+
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """Append-only mutation log with group commit
+
+    ``append`` frames an entry and returns a future; a single flusher task
+    waits ``commit_interval`` seconds to gather whatever else arrives, then
+    writes the whole group with one write + fsync on a worker thread and
+    resolves every future in it. Entries are tagged with the segment
+    (generation) that was current when they were appended, so ``rotate`` is
+    a synchronous switch that a snapshot can line up with exactly.
+    """
+
+    def __init__(self, directory: str, commit_interval: float = 0.005, fsync: bool = True):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        self.generation = 0
+        self._pending: List[Tuple[int, bytes, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._files = {}
+
+        # Counters
+        self.appended = 0
+        self.commits = 0
+        self.bytes_written = 0
+        self.max_group = 0
+        self._total_commit_ms = 0.0
+
+    def segments(self) -> List[Tuple[int, str]]:
+        found = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._run())
+
+    def append(self, entry: tuple) -> asyncio.Future:
+        payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        frame = FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((self.generation, frame, future))
+        self.appended += 1
+        self._wakeup.set()
+        return future
+
+    def rotate(self) -> int:
+        """Send later appends to a new segment; returns the new generation"""
+        self.generation += 1
+        return self.generation
+
+    async def sync(self):
+        """Wait until everything appended so far is on disk"""
+        if self._pending:
+            await asyncio.gather(*(future for _, _, future in self._pending))
+
+    def delete_before(self, generation: int) -> int:
+        removed = 0
+        for segment_generation, path in self.segments():
+            # Everything before `generation` is flushed by now, so even a segment
+            # whose file is still open will not be written again
+            if segment_generation < generation:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Group window: let concurrent writers join this commit
+            await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            group, self._pending = self._pending, []
+            if not group:
+                continue
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write_group, group)
+            except Exception as e:
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.commits += 1
+            self.max_group = max(self.max_group, len(group))
+            self._total_commit_ms += (time.perf_counter() - started) * 1000
+            for _, _, future in group:
+                if not future.done():
+                    future.set_result(None)
+
+    def _write_group(self, group):
+        by_generation = {}
+        for generation, frame, _ in group:
+            by_generation.setdefault(generation, []).append(frame)
+        for generation, frames in sorted(by_generation.items()):
+            f = self._files.get(generation)
+            if f is None:
+                f = self._files[generation] = open(os.path.join(self.directory, segment_name(generation)), "ab")
+            data = b"".join(frames)
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.bytes_written += len(data)
+        # Older segments will not be written again once a newer one is in use
+        for generation in [g for g in self._files if g < self.generation]:
+            self._files.pop(generation).close()
+
+    async def close(self):
+        if self._flusher is not None:
+            # Drain what is queued before stopping the flusher
+            while self._pending:
+                self._wakeup.set()
+                await self.sync()
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "appended": self.appended,
+            "pending": len(self._pending),
+            "commits": self.commits,
+            "avg_group_size": round(self.appended / self.commits, 2) if self.commits else 0.0,
+            "max_group_size": self.max_group,
+            "avg_commit_ms": round(self._total_commit_ms / self.commits, 3) if self.commits else 0.0,
+            "bytes_written": self.bytes_written,
+            "fsync": self.fsync,
+        }
+
+
+class Persistence:
+    """Journal + snapshots that make MemoryStorage survive restarts
+
+    Every successful mutation is journaled (see ``MemoryStorage._log``) and
+    the caller waits for its group commit. A background task writes a
+    snapshot every ``snapshot_interval`` seconds once ``snapshot_min_entries``
+    mutations have accumulated, and on shutdown. Recovery memory-maps the
+    latest snapshot, bulk-loads it, then replays the journal segments that
+    were started after it.
+
+    Snapshots capture the records as tuples on the event loop (one short
+    pause, ~0.5s per million users) right at a journal rotation, so the image
+    matches the journal boundary exactly; pickling and writing happen on a
+    worker thread.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        commit_interval: float = 0.005,
+        fsync: bool = True,
+        snapshot_interval: float = 300.0,
+        snapshot_min_entries: int = 1000,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.journal = Journal(directory, commit_interval=commit_interval, fsync=fsync)
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_min_entries = snapshot_min_entries
+        self._snapshotter: Optional[asyncio.Task] = None
+        self._snapshot_lock = asyncio.Lock()
+        self._appended_at_snapshot = 0
+
+        # Counters
+        self.snapshots = 0
+        self.last_snapshot_ms = 0.0
+        self.last_snapshot_pause_ms = 0.0
+        self.last_snapshot_bytes = 0
+        self.recovered_users = 0
+        self.recovered_referrals = 0
+        self.replayed_entries = 0
+        self.replay_errors = 0
+        self.recovery_ms = 0.0
+
+    @classmethod
+    def from_env(cls) -> Optional["Persistence"]:
+        """None unless MEMORY_DATA_DIR is set (persistence is opt-in)"""
+        directory = os.getenv("MEMORY_DATA_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            commit_interval=float(os.getenv("JOURNAL_COMMIT_INTERVAL", "0.005")),
+            fsync=os.getenv("JOURNAL_FSYNC", "true").lower() != "false",
+            snapshot_interval=float(os.getenv("SNAPSHOT_INTERVAL", "300")),
+            snapshot_min_entries=int(os.getenv("SNAPSHOT_MIN_ENTRIES", "1000")),
+        )
+
+    def recover(self, storage):
+        """Rebuild ``storage`` from the snapshot and journal (blocking, run before serving)"""
+        started = time.perf_counter()
+        replay_from = 0
+        # Millions of new containers would trigger the cyclic GC over and over
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if os.path.exists(self.snapshot_path):
+                replay_from, code_counter, users_section, referrals_section = read_snapshot(self.snapshot_path)
+                storage._load_snapshot(code_counter, users_section, referrals_section)
+                self.recovered_users = len(storage.users)
+                self.recovered_referrals = len(storage.referrals)
+                del users_section, referrals_section
+
+            last_generation = replay_from - 1
+            for generation, path in self.journal.segments():
+                last_generation = max(last_generation, generation)
+                if generation < replay_from:
+                    continue
+                for op, args in read_segment(path):
+                    try:
+                        storage._replay(op, args)
+                        self.replayed_entries += 1
+                    except Exception as e:
+                        self.replay_errors += 1
+                        print(f"⚠️ Journal replay skipped {op} from {os.path.basename(path)}: {e}")
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        # Never append to a segment that may end in a torn frame
+        self.journal.generation = max(last_generation + 1, replay_from)
+        self.recovery_ms = (time.perf_counter() - started) * 1000
+        print(
+            f"✅ Recovered {self.recovered_users} users, {self.recovered_referrals} links "
+            f"and {self.replayed_entries} journal entries in {self.recovery_ms:.0f} ms"
+        )
+
+    def start(self, storage):
+        self.journal.start()
+        self._snapshotter = asyncio.create_task(self._snapshot_loop(storage))
+
+    def log(self, op: str, args: tuple) -> asyncio.Future:
+        return self.journal.append((op, args))
+
+    async def snapshot(self, storage) -> dict:
+        async with self._snapshot_lock:
+            started = time.perf_counter()
+            # Rotation and capture happen without yielding, so the image holds
+            # exactly the entries of the segments before `generation`
+            generation = self.journal.rotate()
+            # A million fresh tuples would otherwise set off full collections mid-capture
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                code_counter, users_section, referrals_section = storage._snapshot_rows()
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+            appended = self.journal.appended
+            counts = {"users": len(storage.users), "referrals": len(storage.referrals)}
+            self.last_snapshot_pause_ms = (time.perf_counter() - started) * 1000
+
+            self.last_snapshot_bytes = await asyncio.to_thread(
+                write_snapshot, self.snapshot_path, generation, code_counter, users_section, referrals_section
+            )
+            # Older segments may be dropped once their frames are flushed
+            await self.journal.sync()
+            removed = self.journal.delete_before(generation)
+            self._appended_at_snapshot = appended
+            self.snapshots += 1
+            self.last_snapshot_ms = (time.perf_counter() - started) * 1000
+            return {
+                "generation": generation,
+                **counts,
+                "bytes": self.last_snapshot_bytes,
+                "pause_ms": round(self.last_snapshot_pause_ms, 1),
+                "total_ms": round(self.last_snapshot_ms, 1),
+                "segments_removed": removed,
+            }
+
+    async def _snapshot_loop(self, storage):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if self.journal.appended - self._appended_at_snapshot < self.snapshot_min_entries:
+                continue
+            try:
+                await self.snapshot(storage)
+            except Exception as e:
+                print(f"⚠️ Snapshot failed: {e}")
+
+    async def close(self, storage):
+        if self._snapshotter is not None:
+            self._snapshotter.cancel()
+            try:
+                await self._snapshotter
+            except asyncio.CancelledError:
+                pass
+            self._snapshotter = None
+        await self.journal.sync()
+        if self.journal.appended != self._appended_at_snapshot:
+            # Clean shutdown: leave a snapshot so the next start has nothing to replay
+            await self.snapshot(storage)
+        await self.journal.close()
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "journal": self.journal.stats(),
+            "snapshots": self.snapshots,
+            "last_snapshot_bytes": self.last_snapshot_bytes,
+            "last_snapshot_ms": round(self.last_snapshot_ms, 1),
+            "last_snapshot_pause_ms": round(self.last_snapshot_pause_ms, 1),
+            "recovery_ms": round(self.recovery_ms, 1),
+            "recovered_users": self.recovered_users,
+            "recovered_referrals": self.recovered_referrals,
+            "replayed_entries": self.replayed_entries,
+            "replay_errors": self.replay_errors,
+        }
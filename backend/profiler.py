@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is still sampling"""
+
+
+class SamplingProfiler:
+    """Statistical profiler for a live process, driven from an admin endpoint
+
+    A background thread wakes every ``interval`` seconds, grabs the current
+    stack of the event-loop thread (or of every thread) with
+    ``sys._current_frames`` and counts identical stacks. Nothing is hooked
+    into the profiled code, so the cost is one stack walk per sample and the
+    worker keeps serving traffic while it runs. Results come back as
+    collapsed stacks (``a;b;c 42``, the input of flamegraph.pl and
+    speedscope) plus a table of the functions seen most often, by self and
+    total samples. One profile runs at a time.
+    """
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60.0):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.running = False
+        self.profiles_taken = 0
+        self._labels: Dict[object, str] = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            interval=float(os.getenv("PROFILER_INTERVAL", "0.005")),
+            max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", "60")),
+        )
+
+    async def profile(self, seconds: float, interval: Optional[float] = None, all_threads: bool = False,
+                      top: int = 30) -> dict:
+        if seconds <= 0 or seconds > self.max_seconds:
+            raise ValueError(f"seconds must be between 0 and {self.max_seconds:g}")
+        if self.running:
+            raise ProfilerBusyError("A profile is already running")
+        self.running = True
+        try:
+            # Called from the loop thread, which is what gets sampled by default
+            target = None if all_threads else threading.get_ident()
+            started_at = datetime.utcnow()
+            stacks, samples, elapsed = await asyncio.to_thread(
+                self._sample, seconds, interval or self.interval, target
+            )
+        finally:
+            self.running = False
+        self.profiles_taken += 1
+        return self._report(stacks, samples, elapsed, started_at, interval or self.interval, top)
+
+    def _sample(self, seconds: float, interval: float, target: Optional[int]):
+        own = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (target is not None and ident != target):
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                stacks[tuple(codes)] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples, time.perf_counter() - started
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            short = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{name} ({short}:{code.co_firstlineno})"
+        return label
+
+    def _report(self, stacks: Counter, samples: int, elapsed: float, started_at: datetime,
+                interval: float, top: int) -> dict:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        collapsed: List[str] = []
+        stack_samples = sum(stacks.values())
+        for codes, count in stacks.most_common():
+            labels = [self._label(code) for code in codes]
+            collapsed.append(f"{';'.join(labels)} {count}")
+            self_counts[labels[-1]] += count
+            # A recursive function only counts once per stack
+            for label in set(labels):
+                total_counts[label] += count
+
+        def percent(count: int) -> float:
+            return round(100.0 * count / stack_samples, 2) if stack_samples else 0.0
+
+        return {
+            "started_at": started_at.isoformat(),
+            "duration": round(elapsed, 3),
+            "interval": interval,
+            "samples": samples,
+            "stack_samples": stack_samples,
+            "top_self": [
+                {"function": label, "samples": count, "percent": percent(count)}
+                for label, count in self_counts.most_common(top)
+            ],
+            "top_total": [
+                {"function": label, "samples": count, "percent": percent(count)}
+                for label, count in total_counts.most_common(top)
+            ],
+            "collapsed": "\n".join(collapsed),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "profiles_taken": self.profiles_taken,
+            "interval": self.interval,
+            "max_seconds": self.max_seconds,
+        }
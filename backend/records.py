@@ -0,0 +1,268 @@
+import math
+from operator import attrgetter
+from datetime import date, datetime
+from decimal import Decimal
+from json.encoder import encode_basestring
+from typing import Any, Dict, List, Tuple
+
+
+class Record:
+    """Base for compact ``__slots__`` records
+
+    Subclasses list their ``FIELDS`` (which become the slots), the ``PUBLIC``
+    subset that may leave the process, and ``DEFAULTS`` (callables are used as
+    factories). Records answer the small part of the dict protocol the stores
+    and handlers rely on (``r["x"]``, ``r.get``, ``r.setdefault``, ``in``), but
+    ``keys``/``items`` only cover public fields, so ``dict(record)`` or any
+    generic encoder can never pick up ``password_hash``.
+
+    ``dump_json`` writes records straight into the output buffer using key
+    prefixes built once per class, without copying them into dicts first.
+    """
+
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+    PUBLIC: Tuple[str, ...] = ()
+    DEFAULTS: Dict[str, Any] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+        cls._json_keys = tuple(
+            (field, ("{" if i == 0 else ",") + encode_basestring(field) + ":")
+            for i, field in enumerate(cls.PUBLIC)
+        )
+        if len(cls.FIELDS) > 1:
+            cls._getter = attrgetter(*cls.FIELDS)
+        # Slot descriptors' setters in FIELDS order, for from_tuple
+        cls._slot_setters = tuple(getattr(cls, field).__set__ for field in cls.FIELDS)
+
+    def __init__(self, **fields):
+        for name in fields:
+            if name not in self._field_set:
+                raise TypeError(f"{type(self).__name__} has no field {name!r}")
+        for name in self.FIELDS:
+            if name in fields:
+                value = fields[name]
+            else:
+                value = self.DEFAULTS.get(name)
+                if callable(value):
+                    value = value()
+            setattr(self, name, value)
+
+    @classmethod
+    def from_tuple(cls, values):
+        """Record from field values in FIELDS order (inverse of ``astuple``)
+
+        Bulk loads (snapshots) build millions of records, so this skips
+        ``__init__`` and its checks and sets the slots directly.
+        """
+        record = object.__new__(cls)
+        for setter, value in zip(cls._slot_setters, values, strict=True):
+            setter(record, value)
+        return record
+
+    @classmethod
+    def from_mapping(cls, data):
+        """Record from a dict (or the record itself if it already is one)"""
+        if isinstance(data, cls):
+            return data
+        return cls(**data)
+
+    # Dict-style access used by the stores and handlers
+    def __getitem__(self, key: str):
+        if key not in self._field_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self._field_set:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._field_set
+
+    def get(self, key: str, default=None):
+        if key not in self._field_set:
+            return default
+        return getattr(self, key)
+
+    def setdefault(self, key: str, default=None):
+        """Like dict.setdefault, with an unset (None) field counting as missing"""
+        value = self[key]
+        if value is None:
+            self[key] = value = default
+        return value
+
+    def update(self, fields=(), **kwargs):
+        for key, value in dict(fields, **kwargs).items():
+            self[key] = value
+
+    def keys(self):
+        return self.PUBLIC
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.PUBLIC]
+
+    def to_dict(self, private: bool = False) -> dict:
+        return {field: getattr(self, field) for field in (self.FIELDS if private else self.PUBLIC)}
+
+    def astuple(self) -> tuple:
+        """Field values in FIELDS order (inverse of ``from_tuple``)"""
+        return self._getter(self)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.astuple() == other.astuple()
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.PUBLIC)
+        return f"{type(self).__name__}({fields})"
+
+    def _write_json(self, out: List[str]):
+        if not self._json_keys:
+            out.append("{}")
+            return
+        for field, prefix in self._json_keys:
+            out.append(prefix)
+            _write(getattr(self, field), out)
+        out.append("}")
+
+
+class User(Record):
+    FIELDS = (
+        "id",
+        "first_name",
+        "last_name",
+        "email",
+        "password_hash",
+        "referral_code",
+        "total_referrals",
+        "total_earnings",
+        "achievements",
+        "created_at",
+        "referrer_id",  # id of the user whose code or link brought this one in
+        "version",  # goes up on every change to the row (behind the profile/achievements ETags)
+    )
+    __slots__ = FIELDS
+    # referrer_id stays internal: it would expose who referred whom to anyone who can see the user
+    PUBLIC = tuple(field for field in FIELDS if field not in ("password_hash", "referrer_id", "version"))
+    DEFAULTS = {"total_referrals": 0, "total_earnings": 0.0, "achievements": list, "version": 0}
+
+
+class ReferralLink(Record):
+    FIELDS = (
+        "id",
+        "user_id",
+        "user_name",
+        "link_code",
+        "full_url",
+        "click_count",
+        "registration_count",
+        "created_at",
+    )
+    __slots__ = FIELDS
+    PUBLIC = FIELDS
+    DEFAULTS = {"click_count": 0, "registration_count": 0}
+
+
+class Click(Record):
+    # Same order as referral_clicks, so astuple() feeds executemany/COPY directly
+    FIELDS = (
+        "link_code",
+        "ip_address",
+        "user_agent",
+        "clicked_at",
+        "completed_registration",
+        "completed_email",
+        "duplicate",  # the duplicate filter's verdict when the click was taken
+    )
+    __slots__ = FIELDS
+    PUBLIC = FIELDS
+    DEFAULTS = {"completed_registration": False, "duplicate": False}
+
+
+class Achievement(Record):
+    FIELDS = ("id", "title", "description", "icon", "target_value", "reward_amount", "category")
+    __slots__ = FIELDS
+    PUBLIC = FIELDS
+
+
+class AchievementStatus(Record):
+    """An achievement plus the user's progress, serialized as one flat object"""
+
+    FIELDS = ("achievement", "is_unlocked", "progress")
+    __slots__ = FIELDS
+    PUBLIC = FIELDS
+
+    def _write_json(self, out: List[str]):
+        achievement = self.achievement
+        for field, prefix in achievement._json_keys:
+            out.append(prefix)
+            _write(getattr(achievement, field), out)
+        out.append(',"is_unlocked":')
+        _write(self.is_unlocked, out)
+        out.append(',"progress":')
+        _write(self.progress, out)
+        out.append("}")
+
+
+def _write(value, out: List[str]):
+    kind = type(value)
+    if kind is str:
+        out.append(encode_basestring(value))
+    elif value is None:
+        out.append("null")
+    elif value is True:
+        out.append("true")
+    elif value is False:
+        out.append("false")
+    elif kind is int:
+        out.append(int.__repr__(value))
+    elif kind is float:
+        if not math.isfinite(value):
+            raise ValueError("Out of range float values are not JSON compliant")
+        out.append(float.__repr__(value))
+    elif isinstance(value, Record):
+        value._write_json(out)
+    elif isinstance(value, dict):
+        if not value:
+            out.append("{}")
+            return
+        separator = "{"
+        for key, item in value.items():
+            out.append(separator)
+            out.append(encode_basestring(str(key)))
+            out.append(":")
+            _write(item, out)
+            separator = ","
+        out.append("}")
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            out.append("[]")
+            return
+        separator = "["
+        for item in value:
+            out.append(separator)
+            _write(item, out)
+            separator = ","
+        out.append("]")
+    elif isinstance(value, (datetime, date)):
+        out.append('"' + value.isoformat() + '"')
+    elif isinstance(value, Decimal):
+        _write(float(value), out)
+    elif isinstance(value, int):
+        _write(int(value), out)
+    elif isinstance(value, float):
+        _write(float(value), out)
+    else:
+        raise TypeError(f"Object of type {kind.__name__} is not JSON serializable")
+
+
+def dump_json(content) -> bytes:
+    """Compact UTF-8 JSON for plain values and records (public fields only)"""
+    out: List[str] = []
+    _write(content, out)
+    return "".join(out).encode("utf-8")
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import string
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+DEFAULT_ALPHABET = string.ascii_uppercase + string.digits
+FEISTEL_ROUNDS = 4
+
+
+class CodeSpaceExhaustedError(RuntimeError):
+    """Raised when every code of the configured length has been handed out"""
+
+
+class ReferralCodeAllocator:
+    """Hands out referral codes that are unique by construction
+
+    Each code is a counter value pushed through a keyed permutation of
+    ``[0, len(alphabet) ** length)`` and written in that alphabet, so codes
+    never repeat until the space is used up, look random, and cost the same
+    to produce at any user count. The permutation is a small Feistel network
+    over the next even bit width, cycle-walked back into range.
+
+    Counter values come from the storage (``reserve_code_counters``) in
+    blocks of ``block_size``, so several app instances on one database never
+    share a value. Codes that predate the allocator (or were imported with
+    the user) can still clash, so each batch is checked once against the
+    referral_code index and clashing values are skipped.
+    """
+
+    def __init__(
+        self,
+        storage,
+        key: str = "cloudwalk-referral-codes",
+        length: int = 6,
+        alphabet: str = DEFAULT_ALPHABET,
+        block_size: int = 100,
+    ):
+        if length < 1:
+            raise ValueError("Referral code length must be at least 1")
+        if len(alphabet) < 2 or len(set(alphabet)) != len(alphabet):
+            raise ValueError("Referral code alphabet needs at least 2 distinct characters")
+        self.storage = storage
+        self.length = length
+        self.alphabet = alphabet
+        self.block_size = block_size
+        self.capacity = len(alphabet) ** length
+
+        bits = max(2, (self.capacity - 1).bit_length())
+        self._half_bits = (bits + 1) // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._round_keys = [
+            hashlib.sha256(f"{key}:{i}".encode()).digest() for i in range(FEISTEL_ROUNDS)
+        ]
+        self._reserved: Deque[int] = deque()
+
+        # Counters
+        self.allocated = 0
+        self.blocks_reserved = 0
+        self.skipped_taken = 0
+        self.highest_counter = -1
+        self._total_us = 0.0
+        self.max_us = 0.0
+        # Allocation cost grouped by how many codes had been issued (powers of ten)
+        self._cost_by_issued: Dict[int, list] = {}
+
+    @classmethod
+    def from_env(cls, storage):
+        return cls(
+            storage,
+            key=os.getenv("REFERRAL_CODE_KEY", "cloudwalk-referral-codes"),
+            length=int(os.getenv("REFERRAL_CODE_LENGTH", "6")),
+            alphabet=os.getenv("REFERRAL_CODE_ALPHABET", DEFAULT_ALPHABET),
+            block_size=int(os.getenv("REFERRAL_CODE_BLOCK_SIZE", "100")),
+        )
+
+    # Keyed permutation
+    def _round(self, value: int, round_key: bytes) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, "big"), key=round_key, digest_size=8).digest()
+        return int.from_bytes(digest, "big") & self._half_mask
+
+    def _feistel(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._half_mask
+        for round_key in self._round_keys:
+            left, right = right, left ^ self._round(right, round_key)
+        return (left << self._half_bits) | right
+
+    def permute(self, counter: int) -> int:
+        """Position of ``counter`` in the keyed shuffle of the code space"""
+        if not 0 <= counter < self.capacity:
+            raise CodeSpaceExhaustedError(
+                f"All {self.capacity} referral codes of length {self.length} are used"
+            )
+        value = self._feistel(counter)
+        # Cycle walking: the Feistel domain is at most 4x the code space
+        while value >= self.capacity:
+            value = self._feistel(value)
+        return value
+
+    def encode(self, value: int) -> str:
+        base = len(self.alphabet)
+        chars = []
+        for _ in range(self.length):
+            value, digit = divmod(value, base)
+            chars.append(self.alphabet[digit])
+        return "".join(reversed(chars))
+
+    # Allocation
+    async def _take(self, count: int) -> List[int]:
+        if len(self._reserved) < count:
+            block = await self.storage.reserve_code_counters(max(count - len(self._reserved), self.block_size))
+            self._reserved.extend(block)
+            self.blocks_reserved += 1
+        return [self._reserved.popleft() for _ in range(count)]
+
+    async def allocate(self) -> str:
+        return (await self.allocate_many(1))[0]
+
+    async def allocate_many(self, count: int) -> List[str]:
+        """``count`` fresh codes, checked against existing ones with a single lookup per round"""
+        started = time.perf_counter()
+        codes: List[str] = []
+        while len(codes) < count:
+            counters = await self._take(count - len(codes))
+            self.highest_counter = max(self.highest_counter, counters[-1])
+            candidates = [self.encode(self.permute(counter)) for counter in counters]
+            taken = await self.storage.existing_referral_codes(candidates)
+            self.skipped_taken += len(taken)
+            codes.extend(code for code in candidates if code not in taken)
+
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        per_code_us = elapsed_us / count
+        self.allocated += count
+        self._total_us += elapsed_us
+        self.max_us = max(self.max_us, per_code_us)
+        bucket = self._cost_by_issued.setdefault(len(str(self.highest_counter + 1)), [0, 0.0])
+        bucket[0] += count
+        bucket[1] += elapsed_us
+        return codes
+
+    def stats(self) -> dict:
+        return {
+            "length": self.length,
+            "alphabet_size": len(self.alphabet),
+            "capacity": self.capacity,
+            "issued": self.highest_counter + 1,
+            "utilization": round((self.highest_counter + 1) / self.capacity, 6),
+            "allocated": self.allocated,
+            "reserved_unused": len(self._reserved),
+            "blocks_reserved": self.blocks_reserved,
+            "skipped_taken": self.skipped_taken,
+            "avg_us": round(self._total_us / self.allocated, 2) if self.allocated else 0.0,
+            "max_us": round(self.max_us, 2),
+            "avg_us_by_issued": {
+                f"<={10 ** digits}": round(total_us / allocated, 2)
+                for digits, (allocated, total_us) in sorted(self._cost_by_issued.items())
+            },
+        }
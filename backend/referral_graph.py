@@ -0,0 +1,244 @@
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ("user_id", "parent", "children", "depth", "earnings",
+                 "size", "downline_earnings", "height", "tiers")
+
+    def __init__(self, user_id: str, earnings: float):
+        self.user_id = user_id
+        self.parent: Optional["_Node"] = None
+        self.children: List["_Node"] = []
+        self.depth = 0
+        self.earnings = earnings
+        # Downline aggregates (everyone below this node, not the node itself)
+        self.size = 0
+        self.downline_earnings = 0.0
+        self.height = 0
+        # Head count per level below; allocated with the first descendant (most users have none)
+        self.tiers: Optional[List[int]] = None
+
+
+class ReferralGraph:
+    """Who referred whom, with each user's downline aggregates kept current
+
+    Users are nodes and their referrer is the parent. Every node carries the
+    size of its downline, the downline's summed earnings, how many levels deep
+    it goes and head counts for the first ``tiers`` levels. Attaching a new
+    user or changing someone's earnings walks up the ancestors once, so a
+    "my network" query is a lookup and updates cost O(depth). ``rebuild``
+    recomputes everything bottom-up from stored users in O(n).
+    """
+
+    def __init__(self, tiers: int = 5):
+        self.tiers = tiers
+        self._nodes: Dict[str, _Node] = {}
+
+        # Counters
+        self.roots = 0
+        self.max_depth = 0
+        self.orphans = 0
+        self.cycles_broken = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(tiers=int(os.getenv("REFERRAL_GRAPH_TIERS", "5")))
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._nodes
+
+    # Incremental updates
+    def add(self, user_id: str, referrer_id: Optional[str] = None, earnings: float = 0.0):
+        """Attach a new user under its referrer (a root if there is none)"""
+        if user_id in self._nodes:
+            return
+        node = self._nodes[user_id] = _Node(user_id, earnings)
+        parent = self._nodes.get(referrer_id) if referrer_id else None
+        if parent is None:
+            self.roots += 1
+            if referrer_id:
+                self.orphans += 1
+            return
+        node.parent = parent
+        node.depth = parent.depth + 1
+        parent.children.append(node)
+        if node.depth > self.max_depth:
+            self.max_depth = node.depth
+
+        tiers = self.tiers
+        ancestor, distance = parent, 1
+        while ancestor is not None:
+            ancestor.size += 1
+            ancestor.downline_earnings += earnings
+            if distance <= tiers:
+                if ancestor.tiers is None:
+                    ancestor.tiers = [0] * tiers
+                ancestor.tiers[distance - 1] += 1
+            if ancestor.height < distance:
+                ancestor.height = distance
+            ancestor = ancestor.parent
+            distance += 1
+
+    def add_earnings(self, user_id: str, delta: float):
+        node = self._nodes.get(user_id)
+        if node is None or not delta:
+            return
+        node.earnings += delta
+        ancestor = node.parent
+        while ancestor is not None:
+            ancestor.downline_earnings += delta
+            ancestor = ancestor.parent
+
+    def set_earnings(self, user_id: str, earnings: float):
+        """Absolute form of ``add_earnings``, for changes read back from storage (applying one twice is harmless)"""
+        node = self._nodes.get(user_id)
+        if node is not None:
+            self.add_earnings(user_id, earnings - node.earnings)
+
+    # Queries
+    def network(self, user_id: str) -> Optional[dict]:
+        node = self._nodes.get(user_id)
+        if node is None:
+            return None
+        return {
+            "user_id": user_id,
+            "referrer_id": node.parent.user_id if node.parent else None,
+            "level": node.depth,
+            "direct_referrals": len(node.children),
+            "network_size": node.size,
+            "network_depth": node.height,
+            "network_earnings": round(node.downline_earnings, 2),
+            "tiers": [
+                {"level": level, "users": count} for level, count in enumerate(node.tiers or [0] * self.tiers, 1)
+            ],
+        }
+
+    def direct_referrals(self, user_id: str, limit: int = 20) -> List[Tuple[str, int]]:
+        """(user_id, network_size) of the users this one referred, biggest networks first"""
+        node = self._nodes.get(user_id)
+        if node is None:
+            return []
+        children = sorted(node.children, key=lambda child: child.size, reverse=True)[:limit]
+        return [(child.user_id, child.size) for child in children]
+
+    def upline(self, user_id: str, levels: Optional[int] = None) -> List[str]:
+        """Referrer, referrer's referrer, ... (what tiered bonuses would pay)"""
+        node = self._nodes.get(user_id)
+        chain = []
+        ancestor = node.parent if node else None
+        while ancestor is not None and (levels is None or len(chain) < levels):
+            chain.append(ancestor.user_id)
+            ancestor = ancestor.parent
+        return chain
+
+    # Bulk
+    def clear(self):
+        self._nodes = {}
+        self.roots = self.max_depth = self.orphans = self.cycles_broken = 0
+
+    def rebuild(self, users: Iterable[Tuple[str, Optional[str], float]]):
+        """Replace the graph with (user_id, referrer_id, earnings) rows, in any order"""
+        started = time.perf_counter()
+        tiers = self.tiers
+        nodes: Dict[str, _Node] = {}
+        referrers: List[Tuple[_Node, Optional[str]]] = []
+        for user_id, referrer_id, earnings in users:
+            node = nodes[user_id] = _Node(user_id, earnings or 0.0)
+            referrers.append((node, referrer_id))
+
+        roots = []
+        orphans = 0
+        for node, referrer_id in referrers:
+            parent = nodes.get(referrer_id) if referrer_id else None
+            if parent is None or parent is node:
+                orphans += bool(referrer_id)
+                roots.append(node)
+            else:
+                node.parent = parent
+                parent.children.append(node)
+
+        # Top-down order from the roots; nodes it never reaches sit on a cycle
+        order = self._walk(roots)
+        cycles = 0
+        if len(order) < len(nodes):
+            seen = {id(node) for node in order}
+            for node, _ in referrers:
+                if id(node) not in seen:
+                    # Cut the cycle here and make this node a root
+                    node.parent.children.remove(node)
+                    node.parent = None
+                    cycles += 1
+                    for reached in self._walk([node]):
+                        seen.add(id(reached))
+                        order.append(reached)
+
+        # Bottom-up: fold each node's aggregates into its parent
+        for node in reversed(order):
+            parent = node.parent
+            if parent is None:
+                continue
+            parent_tiers = parent.tiers
+            if parent_tiers is None:
+                parent_tiers = parent.tiers = [0] * tiers
+            parent_tiers[0] += 1
+            if node.tiers is None:
+                # Leaf: the common case, nothing below it to carry up
+                parent.size += 1
+                parent.downline_earnings += node.earnings
+                if parent.height < 1:
+                    parent.height = 1
+                continue
+            parent.size += node.size + 1
+            parent.downline_earnings += node.downline_earnings + node.earnings
+            if parent.height < node.height + 1:
+                parent.height = node.height + 1
+            node_tiers = node.tiers
+            for level in range(1, tiers):
+                parent_tiers[level] += node_tiers[level - 1]
+
+        self._nodes = nodes
+        self.roots = sum(1 for node in order if node.parent is None)
+        self.max_depth = max((node.depth for node in order), default=0)
+        self.orphans = orphans
+        self.cycles_broken = cycles
+        self.rebuilds += 1
+        self.last_rebuild_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    @staticmethod
+    def _walk(roots: List[_Node]) -> List[_Node]:
+        """Breadth-first from ``roots``, setting depths on the way"""
+        order = []
+        queue = deque(roots)
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            node.depth = node.parent.depth + 1 if node.parent else 0
+            queue.extend(node.children)
+        return order
+
+    async def rebuild_from(self, storage, batch_size: int = 10000):
+        """Rebuild from every user in storage (users.referrer_id)"""
+        rows = []
+        async for batch in storage.iter_users(batch_size):
+            rows.extend((user["id"], user.get("referrer_id"), user["total_earnings"]) for user in batch)
+        self.rebuild(rows)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._nodes),
+            "roots": self.roots,
+            "max_depth": self.max_depth,
+            "tiers": self.tiers,
+            "orphans": self.orphans,
+            "cycles_broken": self.cycles_broken,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": self.last_rebuild_ms,
+        }
@@ -0,0 +1,101 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from user_store import DuplicateKeyError
+
+
+class ReferralStore:
+    """In-memory referral link table indexed by link_code and by owner
+
+    ``_by_owner`` maps a user id to an insertion-ordered dict of referral ids,
+    so owner listings come back in creation order and deletes stay O(1).
+    Inserts validate every unique key before touching any index, so a failed
+    insert leaves the store unchanged.
+    """
+
+    def __init__(self):
+        self._referrals: Dict[str, dict] = {}
+        self._by_link_code: Dict[str, str] = {}
+        self._by_owner: Dict[str, Dict[str, None]] = {}
+
+    # Dict-like read access (len, iteration, get)
+    def __len__(self) -> int:
+        return len(self._referrals)
+
+    def __contains__(self, referral_id: str) -> bool:
+        return referral_id in self._referrals
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._referrals)
+
+    def get(self, referral_id: str) -> Optional[dict]:
+        return self._referrals.get(referral_id)
+
+    def values(self):
+        return self._referrals.values()
+
+    # Indexed lookups
+    def get_by_link_code(self, link_code: str) -> Optional[dict]:
+        referral_id = self._by_link_code.get(link_code)
+        return self._referrals.get(referral_id) if referral_id else None
+
+    def list_by_owner(self, user_id: str, limit: Optional[int] = None) -> List[dict]:
+        """Referral links of a user in creation order"""
+        ids = self._by_owner.get(user_id)
+        if not ids:
+            return []
+        result = []
+        for referral_id in ids:
+            if limit is not None and len(result) >= limit:
+                break
+            result.append(self._referrals[referral_id])
+        return result
+
+    def count_by_owner(self, user_id: str) -> int:
+        return len(self._by_owner.get(user_id, ()))
+
+    # Mutations
+    def insert(self, referral: dict) -> dict:
+        referral_id = referral["id"]
+        link_code = referral["link_code"]
+
+        if referral_id in self._referrals:
+            raise DuplicateKeyError("id", referral_id)
+        if link_code in self._by_link_code:
+            raise DuplicateKeyError("link_code", link_code)
+
+        self._referrals[referral_id] = referral
+        self._by_link_code[link_code] = referral_id
+        self._by_owner.setdefault(referral["user_id"], {})[referral_id] = None
+        return referral
+
+    def delete(self, referral_id: str) -> Optional[dict]:
+        referral = self._referrals.pop(referral_id, None)
+        if referral is None:
+            return None
+        self._by_link_code.pop(referral["link_code"], None)
+        owned = self._by_owner.get(referral["user_id"])
+        if owned is not None:
+            owned.pop(referral_id, None)
+            if not owned:
+                del self._by_owner[referral["user_id"]]
+        return referral
+
+    def delete_by_owner(self, user_id: str) -> int:
+        """Drop every link owned by a user (mirrors ON DELETE CASCADE)"""
+        ids = list(self._by_owner.get(user_id, ()))
+        for referral_id in ids:
+            self.delete(referral_id)
+        return len(ids)
+
+    def load(self, referrals: Iterable[dict]):
+        """Replace the contents in bulk (snapshot restore), keeping creation order per owner"""
+        self._referrals = {referral.id: referral for referral in referrals}
+        self._by_link_code = {referral.link_code: referral_id for referral_id, referral in self._referrals.items()}
+        self._by_owner = {}
+        for referral_id, referral in self._referrals.items():
+            self._by_owner.setdefault(referral.user_id, {})[referral_id] = None
+
+    def clear(self):
+        self._referrals.clear()
+        self._by_link_code.clear()
+        self._by_owner.clear()
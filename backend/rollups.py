@@ -0,0 +1,445 @@
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from click_pipeline import StoredClick
+
+CLICKS = 0
+CONVERSIONS = 1
+
+
+def _hour_index(at: datetime) -> int:
+    return at.toordinal() * 24 + at.hour
+
+
+def _day_index(at) -> int:
+    return at.toordinal()
+
+
+class _Series:
+    """Hourly and daily [clicks, conversions] buckets for one link or user"""
+
+    __slots__ = ("hours", "days")
+
+    def __init__(self):
+        self.hours: Dict[int, List[int]] = {}
+        self.days: Dict[int, List[int]] = {}
+
+    def add(self, at: datetime, kind: int, count: int):
+        self.hours.setdefault(_hour_index(at), [0, 0])[kind] += count
+        self.days.setdefault(_day_index(at), [0, 0])[kind] += count
+
+
+class RollupEngine:
+    """Pre-aggregated click/conversion counters per link and per user
+
+    Every event bumps one hourly and one daily bucket for its link and for the
+    link owner. Range queries then sum at most a couple of dozen hourly buckets
+    at the edges plus one daily bucket per whole day in between, so the cost
+    depends on the length of the range and never on the number of raw clicks.
+    Hourly buckets older than ``hourly_retention_hours`` are pruned; daily
+    buckets are kept.
+    """
+
+    def __init__(self, hourly_retention_hours: int = 24 * 14):
+        self.hourly_retention_hours = hourly_retention_hours
+        self._links: Dict[str, _Series] = {}
+        self._users: Dict[str, _Series] = {}
+        self._oldest_hour: Optional[int] = None
+
+    # Ingestion
+    def _record(self, link_id: str, user_id: str, at: datetime, kind: int, count: int):
+        link_series = self._links.get(link_id)
+        if link_series is None:
+            link_series = self._links[link_id] = _Series()
+        user_series = self._users.get(user_id)
+        if user_series is None:
+            user_series = self._users[user_id] = _Series()
+        link_series.add(at, kind, count)
+        user_series.add(at, kind, count)
+
+        hour = _hour_index(at)
+        if self._oldest_hour is None or hour < self._oldest_hour:
+            self._oldest_hour = hour
+
+    def record_click(self, link_id: str, user_id: str, at: datetime, count: int = 1):
+        self._record(link_id, user_id, at, CLICKS, count)
+
+    def record_conversion(self, link_id: str, user_id: str, at: datetime, count: int = 1):
+        self._record(link_id, user_id, at, CONVERSIONS, count)
+
+    def prune(self, now: Optional[datetime] = None):
+        """Drop hourly buckets that fell out of the retention window"""
+        cutoff = _hour_index(now or datetime.utcnow()) - self.hourly_retention_hours
+        if self._oldest_hour is None or self._oldest_hour >= cutoff:
+            return
+        for series_map in (self._links, self._users):
+            for series in series_map.values():
+                for hour in [h for h in series.hours if h < cutoff]:
+                    del series.hours[hour]
+        self._oldest_hour = cutoff
+
+    # Queries
+    def _sum(self, series: Optional[_Series], start: datetime, end: datetime) -> Tuple[int, int]:
+        """Totals for [start, end) at hour precision"""
+        if series is None or end <= start:
+            return 0, 0
+        clicks = conversions = 0
+        first_hour, last_hour = _hour_index(start), _hour_index(end)
+        # Whole days are read from daily buckets, partial days from hourly ones
+        first_full_day = _day_index(start) if start.hour == 0 else _day_index(start) + 1
+        last_full_day = _day_index(end)  # exclusive
+        if first_full_day >= last_full_day:
+            for hour in range(first_hour, last_hour):
+                bucket = series.hours.get(hour)
+                if bucket:
+                    clicks += bucket[CLICKS]
+                    conversions += bucket[CONVERSIONS]
+            return clicks, conversions
+
+        edge_hours = list(range(first_hour, first_full_day * 24)) + list(range(last_full_day * 24, last_hour))
+        for hour in edge_hours:
+            bucket = series.hours.get(hour)
+            if bucket:
+                clicks += bucket[CLICKS]
+                conversions += bucket[CONVERSIONS]
+        for day in range(first_full_day, last_full_day):
+            bucket = series.days.get(day)
+            if bucket:
+                clicks += bucket[CLICKS]
+                conversions += bucket[CONVERSIONS]
+        return clicks, conversions
+
+    def link_totals(self, link_id: str, start: datetime, end: datetime) -> Tuple[int, int]:
+        return self._sum(self._links.get(link_id), start, end)
+
+    def user_totals(self, user_id: str, start: datetime, end: datetime) -> Tuple[int, int]:
+        return self._sum(self._users.get(user_id), start, end)
+
+    def daily_series(self, user_id: str, start: date, end: date) -> List[dict]:
+        """One row per day in [start, end] for a user's links"""
+        series = self._users.get(user_id)
+        rows = []
+        day = start
+        while day <= end:
+            bucket = series.days.get(day.toordinal()) if series else None
+            rows.append({
+                "date": day.strftime('%Y-%m-%d'),
+                "clicks": bucket[CLICKS] if bucket else 0,
+                "conversions": bucket[CONVERSIONS] if bucket else 0,
+            })
+            day += timedelta(days=1)
+        return rows
+
+    def hourly_series(self, user_id: str, start: datetime, end: datetime) -> List[dict]:
+        """One row per hour in [start, end) for a user's links"""
+        series = self._users.get(user_id)
+        rows = []
+        for hour in range(_hour_index(start), _hour_index(end)):
+            bucket = series.hours.get(hour) if series else None
+            at = datetime.fromordinal(hour // 24) + timedelta(hours=hour % 24)
+            rows.append({
+                "hour": at.strftime('%Y-%m-%dT%H:00'),
+                "clicks": bucket[CLICKS] if bucket else 0,
+                "conversions": bucket[CONVERSIONS] if bucket else 0,
+            })
+        return rows
+
+    def top_links(
+        self,
+        link_ids: Iterable[str],
+        start: datetime,
+        end: datetime,
+        limit: int = 5,
+        rank_by: str = "clicks",
+    ) -> List[Tuple[str, int, int]]:
+        """(link_id, clicks, conversions) for the best links in the range"""
+        primary = CONVERSIONS if rank_by == "conversions" else CLICKS
+        scored = []
+        for link_id in link_ids:
+            totals = self._sum(self._links.get(link_id), start, end)
+            scored.append((totals[primary], totals[1 - primary], link_id, totals))
+        scored.sort(key=lambda row: (row[0], row[1]), reverse=True)
+        return [(link_id, totals[CLICKS], totals[CONVERSIONS]) for _, _, link_id, totals in scored[:limit]]
+
+    def clear(self):
+        self._links.clear()
+        self._users.clear()
+        self._oldest_hour = None
+
+
+class RollupSync:
+    """Keeps a RollupEngine in step with the stored clicks (referral_clicks)
+
+    The click table is the source of truth, shared by every worker: on
+    ``load`` the buckets are rebuilt from hourly counts of every stored row,
+    and from then on new rows are tailed by id every ``interval`` seconds, so
+    the rollups survive restarts and include clicks taken by other workers.
+    A registration through a link is stored as a row with
+    ``completed_registration`` set and counts as a conversion, not a click.
+
+    An optional ``ClickDeduplicator`` is fed every stored click the same way,
+    so its counts and unique-visitor estimates cover all workers too. Its
+    HyperLogLog registers are saved to the click sink every
+    ``sketch_interval`` seconds (and on stop) with the id they are complete
+    up to, so ``load`` only reads the clicks after that checkpoint or inside
+    the duplicate window, not the whole table; raw and duplicate counts are
+    summed by the database like the rollup buckets.
+
+    Ids are taken before commit, so a row can become visible after a higher
+    one. Skipped ids are remembered as gaps and looked up again on every
+    refresh until they show up or ``gap_grace`` seconds pass (a rolled back
+    insert leaves its id unused for good).
+    """
+
+    def __init__(
+        self,
+        engine: RollupEngine,
+        sink,
+        storage,
+        interval: float = 1.0,
+        batch_size: int = 5000,
+        gap_grace: float = 30.0,
+        settle_ids: int = 1000,
+        dedup=None,
+        sketch_interval: float = 300.0,
+    ):
+        self.engine = engine
+        self.dedup = dedup
+        self.sink = sink
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.gap_grace = gap_grace
+        self.settle_ids = settle_ids
+        self.sketch_interval = sketch_interval
+
+        self._last_id = 0
+        self._gaps: Dict[int, float] = {}
+        self._links: Dict[str, Tuple[str, str]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+        self._last_sketch_save = 0.0
+
+        # Counters
+        self.loaded_rows = 0
+        self.replayed_rows = 0
+        self.sketches_saved = 0
+        self.tailed_rows = 0
+        self.unknown_links = 0
+        self.gaps_filled = 0
+        self.gaps_dropped = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.last_load_ms = 0.0
+        self.last_refresh_ms = 0.0
+
+    @classmethod
+    def from_env(cls, engine: RollupEngine, sink, storage, dedup=None):
+        return cls(
+            engine,
+            sink,
+            storage,
+            interval=float(os.getenv("ROLLUP_REFRESH_INTERVAL", "1.0")),
+            batch_size=int(os.getenv("ROLLUP_REFRESH_BATCH", "5000")),
+            gap_grace=float(os.getenv("ROLLUP_GAP_GRACE", "30")),
+            dedup=dedup,
+            sketch_interval=float(os.getenv("ROLLUP_SKETCH_INTERVAL", "300")),
+        )
+
+    async def _link(self, link_code: str) -> Optional[Tuple[str, str]]:
+        """(link id, owner id) for a link code; links never change owner, so hits are cached"""
+        link = self._links.get(link_code)
+        if link is None:
+            referral = await self.storage.get_referral_by_link_code(link_code)
+            if referral is None:
+                # Clicks of links that no longer exist (e.g. before a demo reset)
+                self.unknown_links += 1
+                return None
+            link = self._links[link_code] = (referral["id"], referral["user_id"])
+        return link
+
+    async def _apply(self, link_code: str, completed: bool, at: Optional[datetime],
+                     count: int = 1) -> Optional[Tuple[str, str]]:
+        if at is None:
+            return None
+        link = await self._link(link_code)
+        if link is None:
+            return None
+        if completed:
+            self.engine.record_conversion(link[0], link[1], at, count)
+        else:
+            self.engine.record_click(link[0], link[1], at, count)
+        return link
+
+    async def _apply_row(self, row: StoredClick):
+        await self._apply(row[1], row[2], row[3])
+        await self._dedup(row, counted=False)
+
+    async def _dedup(self, row: StoredClick, counted: bool):
+        """Feed a click to the deduplicator; ``counted`` rows are already in its raw/duplicate counts"""
+        _, link_code, completed, at, ip_address, user_agent, duplicate = row
+        if self.dedup is None or completed or at is None:
+            return
+        link = await self._link(link_code)
+        if link is None:
+            return
+        # Stored times are naive UTC (datetime.utcnow() at the request)
+        timestamp = at.replace(tzinfo=timezone.utc).timestamp()
+        if counted:
+            self.dedup.add_visitor(link[0], ip_address, user_agent, timestamp)
+        else:
+            self.dedup.record(link[0], ip_address, user_agent, timestamp, duplicate)
+
+    async def load(self):
+        """Rebuild every bucket from the click table (startup and resets)"""
+        started = time.perf_counter()
+        async with self._lock:
+            self.engine.clear()
+            self._links.clear()
+            self._gaps.clear()
+            last_id = await self.sink.last_click_id()
+            # Older rows are summed by the database; the newest ones are tailed
+            # one by one, so ids still being inserted below last_id become gaps
+            first_recent = max(0, last_id - self.settle_ids)
+            if self.dedup is not None:
+                self.dedup.clear()
+            for link_code, completed, hour, count, duplicates in await self.sink.hourly_counts(first_recent):
+                link = await self._apply(link_code, completed, hour, count)
+                self.loaded_rows += count
+                if link is not None and self.dedup is not None and not completed:
+                    self.dedup.add_counts(link[0], count, duplicates)
+            if self.dedup is not None:
+                await self._load_visitors(first_recent)
+            self._last_id = first_recent
+            await self._tail(time.monotonic())
+            self.engine.prune()
+            if self.dedup is not None:
+                # The next start reads from here instead of from whatever was saved before
+                await self._save_sketches()
+        self.last_load_ms = (time.perf_counter() - started) * 1000
+
+    async def _load_visitors(self, up_to_id: int):
+        """Saved sketches, then the clicks they miss and the ones inside the duplicate window"""
+        checkpoint, sketches = await self.sink.load_sketches()
+        self.dedup.load_sketches(sketches)
+        after_id = checkpoint
+        if self.dedup.enabled:
+            window_start = datetime.utcnow() - timedelta(seconds=self.dedup.seen.window)
+            first_in_window = await self.sink.first_click_since(window_start)
+            if first_in_window is not None:
+                after_id = min(after_id, first_in_window - 1)
+        while after_id < up_to_id:
+            rows = await self.sink.clicks_after(after_id, self.batch_size)
+            for row in rows:
+                if row[0] > up_to_id:
+                    return
+                await self._dedup(row, counted=True)
+                self.replayed_rows += 1
+            if len(rows) < self.batch_size:
+                return
+            after_id = rows[-1][0]
+
+    async def save_sketches(self):
+        """Persist the unique-visitor sketches that changed (also done periodically and on stop)"""
+        if self.dedup is not None:
+            async with self._lock:
+                await self._save_sketches()
+
+    async def _save_sketches(self):
+        sketches = self.dedup.dirty_sketches()
+        if not sketches:
+            return
+        # Complete up to the first id still missing: a gap filled later makes its link dirty again
+        up_to_id = min(self._gaps) - 1 if self._gaps else self._last_id
+        await self.sink.save_sketches(up_to_id, sketches)
+        self.dedup.mark_saved(sketches)
+        self.sketches_saved += len(sketches)
+        self._last_sketch_save = time.monotonic()
+
+    async def refresh(self):
+        """Apply clicks stored since the last refresh"""
+        started = time.perf_counter()
+        async with self._lock:
+            now = time.monotonic()
+            if self._gaps:
+                for row in await self.sink.clicks_by_id(self._gaps):
+                    del self._gaps[row[0]]
+                    await self._apply_row(row)
+                    self.gaps_filled += 1
+                for click_id in [i for i, seen in self._gaps.items() if now - seen > self.gap_grace]:
+                    del self._gaps[click_id]
+                    self.gaps_dropped += 1
+            await self._tail(now)
+            self.refreshes += 1
+        self.last_refresh_ms = (time.perf_counter() - started) * 1000
+
+    async def _tail(self, now: float):
+        while True:
+            rows = await self.sink.clicks_after(self._last_id, self.batch_size)
+            for row in rows:
+                click_id = row[0]
+                for missing in range(self._last_id + 1, click_id):
+                    self._gaps[missing] = now
+                self._last_id = click_id
+                await self._apply_row(row)
+            self.tailed_rows += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Rollup refresh failed: {e}")
+            # Hourly buckets are only kept for the retention window
+            if time.monotonic() - self._last_prune >= 3600:
+                self._last_prune = time.monotonic()
+                self.engine.prune()
+            if self.dedup is not None and time.monotonic() - self._last_sketch_save >= self.sketch_interval:
+                try:
+                    await self.save_sketches()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"⚠️ Saving click sketches failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._last_prune = self._last_sketch_save = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                await self.save_sketches()
+            except Exception as e:
+                print(f"⚠️ Saving click sketches failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "last_click_id": self._last_id,
+            "pending_gaps": len(self._gaps),
+            "loaded_rows": self.loaded_rows,
+            "replayed_rows": self.replayed_rows,
+            "sketches_saved": self.sketches_saved,
+            "tailed_rows": self.tailed_rows,
+            "unknown_links": self.unknown_links,
+            "gaps_filled": self.gaps_filled,
+            "gaps_dropped": self.gaps_dropped,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "last_load_ms": round(self.last_load_ms, 3),
+            "last_refresh_ms": round(self.last_refresh_ms, 3),
+        }
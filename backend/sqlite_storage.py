@@ -0,0 +1,654 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from records import ReferralLink, User
+from token_cache import token_hash
+from user_store import DuplicateKeyError, normalize_email
+from storage import (
+    REFERRAL_COUNTERS, TOTAL_FIELDS, USER_COUNTERS, VERSIONED_RESOURCES, UserChange, _totals_drift,
+)
+
+# Same tables as init.sql, plus email_key (the normalized email, unique) and
+# achievements stored as a JSON array on the user row
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    email_key TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    referral_code TEXT UNIQUE,
+    total_referrals INTEGER NOT NULL DEFAULT 0,
+    total_earnings REAL NOT NULL DEFAULT 0,
+    achievements TEXT NOT NULL DEFAULT '[]',
+    created_at TEXT,
+    referrer_id TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    change_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_leaderboard ON users(total_referrals DESC, total_earnings DESC, id);
+
+CREATE TABLE IF NOT EXISTS referral_links (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    link_code TEXT NOT NULL UNIQUE,
+    full_url TEXT NOT NULL,
+    click_count INTEGER NOT NULL DEFAULT 0,
+    registration_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_referral_links_user_id ON referral_links(user_id, created_at, id);
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_hash TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    revoked_at REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_activity (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    UNIQUE (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('referral_code', 0);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('user_change', 0);
+
+CREATE TABLE IF NOT EXISTS system_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_users INTEGER NOT NULL DEFAULT 0,
+    total_links INTEGER NOT NULL DEFAULT 0,
+    total_referrals INTEGER NOT NULL DEFAULT 0,
+    total_earnings REAL NOT NULL DEFAULT 0,
+    total_clicks INTEGER NOT NULL DEFAULT 0,
+    total_registrations INTEGER NOT NULL DEFAULT 0,
+    leaderboard_version INTEGER NOT NULL DEFAULT 0,
+    stats_version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO system_stats (id) VALUES (1);
+"""
+
+# Columns added since the first schema: (table, column, definition)
+MIGRATIONS = (
+    ("users", "referrer_id", "TEXT"),
+    ("users", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "change_seq", "INTEGER NOT NULL DEFAULT 0"),
+    ("system_stats", "leaderboard_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("system_stats", "stats_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("revoked_tokens", "revoked_at", "REAL NOT NULL DEFAULT 0"),
+)
+
+# Indexes on migrated columns, created once the column exists
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens(revoked_at)",
+    "CREATE INDEX IF NOT EXISTS idx_users_change_seq ON users(change_seq)",
+)
+
+# Keep system totals and resource versions (ETags), as init.sql does. Dropped
+# and recreated on every connect, so files from older versions get the
+# current definitions.
+TRIGGERS = {
+    "users_totals_insert": """AFTER INSERT ON users BEGIN
+    UPDATE system_stats SET
+        total_users = total_users + 1,
+        total_referrals = total_referrals + NEW.total_referrals,
+        total_earnings = total_earnings + NEW.total_earnings,
+        leaderboard_version = leaderboard_version + 1,
+        stats_version = stats_version + 1;
+END""",
+    "users_totals_update": """AFTER UPDATE OF total_referrals, total_earnings ON users BEGIN
+    UPDATE system_stats SET
+        total_referrals = total_referrals + NEW.total_referrals - OLD.total_referrals,
+        total_earnings = total_earnings + NEW.total_earnings - OLD.total_earnings,
+        leaderboard_version = leaderboard_version + 1,
+        stats_version = stats_version + 1;
+END""",
+    "users_leaderboard_names": """AFTER UPDATE OF first_name, last_name ON users BEGIN
+    UPDATE system_stats SET leaderboard_version = leaderboard_version + 1;
+END""",
+    # Every insert or update gets the next change number, which other workers
+    # tail (see worker_sync.py). The insert trigger's update moves change_seq,
+    # so users_row_version skips it; recursive triggers are off, so that
+    # trigger's own update does not fire it again.
+    "users_change_insert": """AFTER INSERT ON users BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'user_change';
+    UPDATE users SET change_seq = (SELECT value FROM counters WHERE name = 'user_change') WHERE id = NEW.id;
+END""",
+    "users_row_version": """AFTER UPDATE ON users WHEN NEW.version = OLD.version AND NEW.change_seq = OLD.change_seq BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'user_change';
+    UPDATE users SET version = version + 1, change_seq = (SELECT value FROM counters WHERE name = 'user_change')
+    WHERE id = NEW.id;
+END""",
+    "links_totals_insert": """AFTER INSERT ON referral_links BEGIN
+    UPDATE system_stats SET
+        total_links = total_links + 1,
+        total_clicks = total_clicks + NEW.click_count,
+        total_registrations = total_registrations + NEW.registration_count,
+        stats_version = stats_version + 1;
+END""",
+    "links_totals_update": """AFTER UPDATE OF click_count, registration_count ON referral_links BEGIN
+    UPDATE system_stats SET
+        total_clicks = total_clicks + NEW.click_count - OLD.click_count,
+        total_registrations = total_registrations + NEW.registration_count - OLD.registration_count,
+        stats_version = stats_version + 1;
+END""",
+}
+
+# Column order matches User.FIELDS / ReferralLink.FIELDS, so rows map straight to records
+SQL_USER_SELECT = "SELECT " + ", ".join(User.FIELDS) + " FROM users"
+SQL_REFERRAL_SELECT = "SELECT " + ", ".join(ReferralLink.FIELDS) + " FROM referral_links"
+SQL_INSERT_USER = (
+    "INSERT INTO users (" + ", ".join(User.FIELDS) + ", email_key) VALUES ("
+    + ", ".join("?" for _ in User.FIELDS) + ", ?)"
+)
+SQL_INSERT_REFERRAL = (
+    "INSERT INTO referral_links (" + ", ".join(ReferralLink.FIELDS) + ") VALUES ("
+    + ", ".join("?" for _ in ReferralLink.FIELDS) + ")"
+)
+SQL_LEADERBOARD = SQL_USER_SELECT + " ORDER BY total_referrals DESC, total_earnings DESC, id LIMIT ? OFFSET ?"
+SQL_USER_RANK = """
+    SELECT (
+        SELECT count(*) FROM users o
+        WHERE o.total_referrals > u.total_referrals
+           OR (o.total_referrals = u.total_referrals AND o.total_earnings > u.total_earnings)
+           OR (o.total_referrals = u.total_referrals AND o.total_earnings = u.total_earnings AND o.id < u.id)
+    ) + 1
+    FROM users u WHERE u.id = ?
+"""
+SQL_ADD_ACHIEVEMENT = """
+    UPDATE users SET achievements = json_insert(achievements, '$[#]', ?2)
+    WHERE id = ?1 AND NOT EXISTS (SELECT 1 FROM json_each(users.achievements) WHERE value = ?2)
+"""
+SQL_SYSTEM_TOTALS = "SELECT " + ", ".join(TOTAL_FIELDS) + " FROM system_stats WHERE id = 1"
+SQL_RESOURCE_VERSIONS = (
+    "SELECT " + ", ".join(f"{resource}_version" for resource in VERSIONED_RESOURCES) + " FROM system_stats WHERE id = 1"
+)
+SQL_BUMP_VERSIONS = ", ".join(f"{resource}_version = {resource}_version + 1" for resource in VERSIONED_RESOURCES)
+SQL_RECOUNT_TOTALS = """
+    SELECT
+        (SELECT count(*) FROM users),
+        (SELECT count(*) FROM referral_links),
+        (SELECT coalesce(sum(total_referrals), 0) FROM users),
+        (SELECT coalesce(sum(total_earnings), 0) FROM users),
+        (SELECT coalesce(sum(click_count), 0) FROM referral_links),
+        (SELECT coalesce(sum(registration_count), 0) FROM referral_links)
+"""
+
+# Unique index -> the field name DuplicateKeyError reports
+UNIQUE_FIELDS = {
+    "users.id": "id",
+    "users.email_key": "email",
+    "users.referral_code": "referral_code",
+    "referral_links.id": "id",
+    "referral_links.link_code": "link_code",
+}
+
+ACHIEVEMENTS = User.FIELDS.index("achievements")
+CREATED_AT = User.FIELDS.index("created_at")
+VERSION = User.FIELDS.index("version")
+
+
+def _as_text(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _user_values(user) -> list:
+    values = [user.get(field) for field in User.FIELDS]
+    values[ACHIEVEMENTS] = json.dumps(list(values[ACHIEVEMENTS] or []))
+    values[CREATED_AT] = _as_text(values[CREATED_AT]) or datetime.utcnow().isoformat()
+    values[VERSION] = values[VERSION] or 0
+    values.append(normalize_email(user["email"]))
+    return values
+
+
+def _referral_values(referral) -> list:
+    values = [referral.get(field) for field in ReferralLink.FIELDS]
+    values[-1] = _as_text(values[-1]) or datetime.utcnow().isoformat()
+    return values
+
+
+def _duplicate_key(error: sqlite3.IntegrityError, values: dict) -> DuplicateKeyError:
+    # "UNIQUE constraint failed: users.email_key"
+    index = str(error).rpartition(": ")[2]
+    field = UNIQUE_FIELDS.get(index, index)
+    return DuplicateKeyError(field, values.get(field, "batch"))
+
+
+class SQLiteStorage:
+    """Storage in one SQLite file in WAL mode, shared by every worker process
+
+    This is what lets ``uvicorn --workers N`` (or several processes on one
+    host sharing a local volume) serve the same users, links and counters. Reads run inline on a
+    per-process reader connection; WAL readers never wait for writers and
+    always see the last committed transaction. Writes from all requests of a
+    process are queued and applied by one writer connection on a worker
+    thread, many per ``BEGIN IMMEDIATE`` transaction (each in its own
+    savepoint, so one failing write does not undo the others). Processes
+    then take turns on SQLite's write lock once per group instead of once
+    per request. System totals and resource versions are kept by triggers,
+    as in init.sql.
+    """
+
+    name = "sqlite"
+    # Versions live in the file and never go back
+    version_epoch = ""
+    # Writes commit one transaction at a time, so change numbers show up in order
+    changes_in_order = True
+
+    def __init__(self, path: str = "referrals.db", busy_timeout: float = 10.0, write_batch_size: int = 256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.write_batch_size = write_batch_size
+        self._reader: Optional[sqlite3.Connection] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writes: Optional[asyncio.Queue] = None
+        self._write_task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.reads = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.transactions = 0
+        self.max_group = 0
+        self.max_commit_ms = 0.0
+        self._total_commit_ms = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("SQLITE_PATH", "referrals.db"),
+            busy_timeout=float(os.getenv("SQLITE_BUSY_TIMEOUT", "10")),
+            write_batch_size=int(os.getenv("SQLITE_WRITE_BATCH_SIZE", "256")),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits are atomic and survive a process crash; only
+        # an OS crash can lose the last few, like the memory journal's fsync=false
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    async def connect(self):
+        self._writer = self._connect()
+        # Every worker runs this at startup; IF NOT EXISTS keeps it idempotent
+        self._writer.executescript("BEGIN IMMEDIATE;" + SCHEMA)
+        for table, column, definition in MIGRATIONS:
+            if column not in {row[1] for row in self._writer.execute(f"PRAGMA table_info({table})")}:
+                self._writer.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        for statement in INDEXES:
+            self._writer.execute(statement)
+        for name, body in TRIGGERS.items():
+            self._writer.execute(f"DROP TRIGGER IF EXISTS {name}")
+            self._writer.execute(f"CREATE TRIGGER {name} {body}")
+        self._writer.execute("COMMIT")
+        self._reader = self._connect()
+        self._writes = asyncio.Queue()
+        self._write_task = asyncio.create_task(self._run_writer())
+
+    async def close(self):
+        if self._write_task is not None:
+            # Writes are applied in order, so this returns once all earlier ones are done
+            await self._write(lambda conn: None)
+            self._write_task.cancel()
+            try:
+                await self._write_task
+            except asyncio.CancelledError:
+                pass
+            self._write_task = None
+        for conn in (self._reader, self._writer):
+            if conn is not None:
+                conn.close()
+        self._reader = self._writer = None
+
+    # Reads (inline, WAL snapshot per statement)
+    def _fetchone(self, query: str, *args):
+        self.reads += 1
+        return self._reader.execute(query, args).fetchone()
+
+    def _fetchall(self, query: str, *args):
+        self.reads += 1
+        return self._reader.execute(query, args).fetchall()
+
+    @staticmethod
+    def _row_to_user(row) -> Optional[User]:
+        if row is None:
+            return None
+        values = list(row)
+        values[ACHIEVEMENTS] = json.loads(values[ACHIEVEMENTS])
+        return User.from_tuple(values)
+
+    @staticmethod
+    def _row_to_referral(row) -> Optional[ReferralLink]:
+        return ReferralLink.from_tuple(row) if row is not None else None
+
+    # Writes (grouped per transaction on the writer thread)
+    async def _write(self, fn, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((fn, args, future))
+        return await future
+
+    async def _run_writer(self):
+        while True:
+            group = [await self._writes.get()]
+            while len(group) < self.write_batch_size and not self._writes.empty():
+                group.append(self._writes.get_nowait())
+            started = time.perf_counter()
+            try:
+                results = await asyncio.to_thread(self._apply_group, group)
+            except Exception as e:
+                # BEGIN or COMMIT failed (e.g. busy past the timeout): nothing was written
+                results = [(False, e)] * len(group)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.transactions += 1
+            self.max_group = max(self.max_group, len(group))
+            self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+            self._total_commit_ms += elapsed_ms
+            for (_, _, future), (ok, value) in zip(group, results):
+                self.writes += 1
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    self.write_errors += 1
+                    future.set_exception(value)
+
+    def _apply_group(self, group) -> list:
+        conn = self._writer
+        conn.execute("BEGIN IMMEDIATE")
+        results = []
+        try:
+            for fn, args, _ in group:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((True, fn(conn, *args)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    results.append((False, e))
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    async def clear(self):
+        def clear(conn):
+            conn.execute("DELETE FROM users")
+            conn.execute("DELETE FROM referral_links")
+            conn.execute("DELETE FROM revoked_tokens")
+            conn.execute("DELETE FROM user_activity")
+            # Versions keep counting, so no ETag from before the clear can match again
+            conn.execute(
+                "UPDATE system_stats SET " + ", ".join(f"{field} = 0" for field in TOTAL_FIELDS)
+                + ", " + SQL_BUMP_VERSIONS
+            )
+        await self._write(clear)
+
+    # Users
+    async def get_user(self, user_id: str) -> Optional[User]:
+        return self._row_to_user(self._fetchone(SQL_USER_SELECT + " WHERE id = ?", user_id))
+
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        return self._row_to_user(self._fetchone(SQL_USER_SELECT + " WHERE email_key = ?", normalize_email(email)))
+
+    async def get_user_by_referral_code(self, referral_code: str) -> Optional[User]:
+        return self._row_to_user(self._fetchone(SQL_USER_SELECT + " WHERE referral_code = ?", referral_code))
+
+    async def email_exists(self, email: str) -> bool:
+        return self._fetchone("SELECT 1 FROM users WHERE email_key = ?", normalize_email(email)) is not None
+
+    async def referral_code_exists(self, referral_code: str) -> bool:
+        return self._fetchone("SELECT 1 FROM users WHERE referral_code = ?", referral_code) is not None
+
+    async def insert_user(self, user: dict) -> User:
+        values = _user_values(user)
+
+        def insert(conn):
+            try:
+                conn.execute(SQL_INSERT_USER, values)
+            except sqlite3.IntegrityError as e:
+                raise _duplicate_key(e, user)
+        await self._write(insert)
+        return User.from_mapping(user)
+
+    async def update_user(self, user_id: str, **fields) -> User:
+        columns = [column for column in fields if column in User.FIELDS and column != "id"]
+        values = [json.dumps(fields[c]) if c == "achievements" else _as_text(fields[c]) for c in columns]
+        if "email" in fields:
+            columns.append("email_key")
+            values.append(normalize_email(fields["email"]))
+
+        def update(conn):
+            if columns:
+                try:
+                    conn.execute(
+                        "UPDATE users SET " + ", ".join(f"{column} = ?" for column in columns) + " WHERE id = ?",
+                        (*values, user_id),
+                    )
+                except sqlite3.IntegrityError as e:
+                    raise _duplicate_key(e, fields)
+            return conn.execute(SQL_USER_SELECT + " WHERE id = ?", (user_id,)).fetchone()
+        return self._row_to_user(await self._write(update))
+
+    async def increment_user(self, user_id: str, **deltas) -> User:
+        for field in deltas:
+            if field not in USER_COUNTERS:
+                raise ValueError(f"Not a user counter: {field}")
+        assignments = ", ".join(f"{field} = {field} + ?" for field in deltas)
+
+        def increment(conn):
+            conn.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*deltas.values(), user_id))
+            return conn.execute(SQL_USER_SELECT + " WHERE id = ?", (user_id,)).fetchone()
+        return self._row_to_user(await self._write(increment))
+
+    async def add_achievement(self, user_id: str, achievement_id: str) -> bool:
+        def add(conn):
+            return conn.execute(SQL_ADD_ACHIEVEMENT, (user_id, achievement_id)).rowcount > 0
+        return await self._write(add)
+
+    # Sessions
+    async def revoke_token(self, token: str, expires_at: float):
+        def revoke(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO revoked_tokens (token_hash, expires_at, revoked_at) VALUES (?, ?, ?)",
+                (token_hash(token), expires_at, time.time()),
+            )
+            conn.execute("DELETE FROM revoked_tokens WHERE expires_at < ?", (time.time(),))
+        await self._write(revoke)
+
+    async def is_token_revoked(self, token: str) -> bool:
+        return self._fetchone(
+            "SELECT 1 FROM revoked_tokens WHERE token_hash = ? AND expires_at > ?", token_hash(token), time.time()
+        ) is not None
+
+    async def revoked_tokens_since(self, since: float) -> List[Tuple[str, float, float]]:
+        return self._fetchall(
+            "SELECT token_hash, expires_at, revoked_at FROM revoked_tokens WHERE revoked_at >= ? AND expires_at > ?",
+            since, time.time(),
+        )
+
+    # Cohort activity
+    async def record_activity(self, entries: Iterable[Tuple[str, int]]):
+        entries = list(entries)
+        if entries:
+            await self._write(lambda conn: conn.executemany(
+                "INSERT OR IGNORE INTO user_activity (user_id, day) VALUES (?, ?)", entries
+            ))
+
+    async def activity_after(self, after_id: int, limit: int) -> List[Tuple[int, str, int]]:
+        return self._fetchall("SELECT id, user_id, day FROM user_activity WHERE id > ? ORDER BY id LIMIT ?", after_id, limit)
+
+    # Batch operations (bulk import)
+    def _fetch_in(self, query: str, values: list) -> list:
+        """Rows of ``query`` ending in ``IN ({})``, chunked below SQLite's parameter limit"""
+        rows = []
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            rows.extend(self._fetchall(query.format(", ".join("?" for _ in chunk)), *chunk))
+        return rows
+
+    async def existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        keys = list({normalize_email(email) for email in emails})
+        return {row[0] for row in self._fetch_in("SELECT email_key FROM users WHERE email_key IN ({})", keys)}
+
+    async def existing_referral_codes(self, codes: Iterable[str]) -> Set[str]:
+        rows = self._fetch_in("SELECT referral_code FROM users WHERE referral_code IN ({})", list(codes))
+        return {row[0] for row in rows}
+
+    async def reserve_code_counters(self, count: int) -> range:
+        """Next ``count`` values of the shared referral code counter"""
+        def reserve(conn):
+            conn.execute("UPDATE counters SET value = value + ? WHERE name = 'referral_code'", (count,))
+            return conn.execute("SELECT value FROM counters WHERE name = 'referral_code'").fetchone()[0]
+        end = await self._write(reserve)
+        return range(end - count, end)
+
+    async def get_users_by_referral_codes(self, codes: Iterable[str]) -> Dict[str, User]:
+        users = map(self._row_to_user, self._fetch_in(SQL_USER_SELECT + " WHERE referral_code IN ({})", list(codes)))
+        return {user.referral_code: user for user in users}
+
+    async def insert_users(self, users: List[dict], increments: Optional[Dict[str, dict]] = None):
+        """Insert a batch of users and apply counter deltas in one savepoint"""
+        rows = [_user_values(user) for user in users]
+        updates = [
+            (deltas.get("total_referrals", 0), deltas.get("total_earnings", 0), user_id)
+            for user_id, deltas in (increments or {}).items()
+        ]
+
+        def insert(conn):
+            try:
+                conn.executemany(SQL_INSERT_USER, rows)
+            except sqlite3.IntegrityError as e:
+                raise _duplicate_key(e, {})
+            conn.executemany(
+                "UPDATE users SET total_referrals = total_referrals + ?, total_earnings = total_earnings + ? "
+                "WHERE id = ?",
+                updates,
+            )
+        await self._write(insert)
+        for user in users:
+            user.setdefault("achievements", [])
+
+    async def count_users(self) -> int:
+        return self._fetchone("SELECT total_users FROM system_stats WHERE id = 1")[0]
+
+    async def iter_users(self, batch_size: int = 1000) -> AsyncIterator[List[User]]:
+        """All users in batches (keyset pagination on id), for bulk maintenance jobs"""
+        last_id = ""
+        while True:
+            rows = self._fetchall(SQL_USER_SELECT + " WHERE id > ? ORDER BY id LIMIT ?", last_id, batch_size)
+            if not rows:
+                return
+            yield [self._row_to_user(row) for row in rows]
+            last_id = rows[-1][0]
+
+    async def last_user_change_seq(self) -> int:
+        return self._fetchone("SELECT value FROM counters WHERE name = 'user_change'")[0]
+
+    async def user_changes_after(self, after_seq: int, limit: int) -> List[UserChange]:
+        return self._fetchall(
+            "SELECT change_seq, id, referrer_id, total_earnings, created_at FROM users"
+            " WHERE change_seq > ? ORDER BY change_seq LIMIT ?",
+            after_seq, limit,
+        )
+
+    async def leaderboard(self, limit: int = 10, offset: int = 0) -> List[User]:
+        return [self._row_to_user(row) for row in self._fetchall(SQL_LEADERBOARD, limit, offset)]
+
+    async def user_rank(self, user_id: str) -> Optional[int]:
+        row = self._fetchone(SQL_USER_RANK, user_id)
+        return row[0] if row else None
+
+    # Referral links
+    async def insert_referral(self, referral: dict) -> ReferralLink:
+        values = _referral_values(referral)
+
+        def insert(conn):
+            try:
+                conn.execute(SQL_INSERT_REFERRAL, values)
+            except sqlite3.IntegrityError as e:
+                raise _duplicate_key(e, referral)
+        await self._write(insert)
+        return ReferralLink.from_mapping(referral)
+
+    async def get_referral_by_link_code(self, link_code: str) -> Optional[ReferralLink]:
+        return self._row_to_referral(self._fetchone(SQL_REFERRAL_SELECT + " WHERE link_code = ?", link_code))
+
+    async def list_referrals(self, user_id: str, limit: Optional[int] = None) -> List[ReferralLink]:
+        rows = self._fetchall(
+            SQL_REFERRAL_SELECT + " WHERE user_id = ? ORDER BY created_at, id LIMIT ?",
+            user_id, -1 if limit is None else limit,
+        )
+        return [self._row_to_referral(row) for row in rows]
+
+    async def increment_referral(self, referral_id: str, **deltas) -> ReferralLink:
+        for field in deltas:
+            if field not in REFERRAL_COUNTERS:
+                raise ValueError(f"Not a referral counter: {field}")
+        assignments = ", ".join(f"{field} = {field} + ?" for field in deltas)
+
+        def increment(conn):
+            conn.execute(f"UPDATE referral_links SET {assignments} WHERE id = ?", (*deltas.values(), referral_id))
+            return conn.execute(SQL_REFERRAL_SELECT + " WHERE id = ?", (referral_id,)).fetchone()
+        return self._row_to_referral(await self._write(increment))
+
+    async def count_referrals(self) -> int:
+        return self._fetchone("SELECT total_links FROM system_stats WHERE id = 1")[0]
+
+    # System totals (kept by triggers)
+    async def system_totals(self) -> dict:
+        return dict(zip(TOTAL_FIELDS, self._fetchone(SQL_SYSTEM_TOTALS)))
+
+    async def reconcile_totals(self) -> dict:
+        """Recount totals from the tables and replace the running counters"""
+        def reconcile(conn):
+            before = dict(zip(TOTAL_FIELDS, conn.execute(SQL_SYSTEM_TOTALS).fetchone()))
+            after = dict(zip(TOTAL_FIELDS, conn.execute(SQL_RECOUNT_TOTALS).fetchone()))
+            conn.execute(
+                "UPDATE system_stats SET " + ", ".join(f"{field} = ?" for field in TOTAL_FIELDS)
+                + ", " + SQL_BUMP_VERSIONS + " WHERE id = 1",
+                [after[field] for field in TOTAL_FIELDS],
+            )
+            return before, after
+        before, after = await self._write(reconcile)
+        return {"before": before, "after": after, "drift": _totals_drift(before, after)}
+
+    # Resource versions (kept by triggers)
+    async def resource_versions(self) -> Dict[str, int]:
+        return dict(zip(VERSIONED_RESOURCES, self._fetchone(SQL_RESOURCE_VERSIONS)))
+
+    # Clicks
+    def click_sink(self):
+        from click_pipeline import SQLiteClickSink
+        # Same file: raw clicks are shared across workers too
+        return SQLiteClickSink(self.path)
+
+    def health(self) -> dict:
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "pid": os.getpid(),
+            "reads": self.reads,
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "write_queue": self._writes.qsize() if self._writes else 0,
+            "transactions": self.transactions,
+            "avg_group_size": round(self.writes / self.transactions, 2) if self.transactions else 0.0,
+            "max_group_size": self.max_group,
+            "avg_commit_ms": round(self._total_commit_ms / self.transactions, 3) if self.transactions else 0.0,
+            "max_commit_ms": round(self.max_commit_ms, 3),
+        }
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the backend modules the same way main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_storage import SQLiteStorage  # noqa: E402
+from storage import MemoryStorage, PostgresStorage  # noqa: E402
+
+STORAGE_BACKENDS = ["memory", "sqlite", "postgres"]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=STORAGE_BACKENDS)
+async def storage(request, tmp_path):
+    """Each backend, connected and empty (postgres only with TEST_DATABASE_URL)"""
+    if request.param == "memory":
+        backend = MemoryStorage()
+    elif request.param == "sqlite":
+        backend = SQLiteStorage(str(tmp_path / "referrals.db"))
+    else:
+        dsn = os.getenv("TEST_DATABASE_URL")
+        if not dsn:
+            pytest.skip("TEST_DATABASE_URL is not set")
+        backend = PostgresStorage(dsn, min_size=1, max_size=4)
+    await backend.connect()
+    await backend.clear()
+    yield backend
+    await backend.close()
@@ -0,0 +1,105 @@
+import pytest
+
+from achievement_engine import AchievementEngine
+from storage import MemoryStorage
+
+from .test_storage import make_user
+
+pytestmark = pytest.mark.anyio
+
+
+def _achievement(achievement_id, category, target, reward=0.0):
+    return {"id": achievement_id, "title": achievement_id, "description": "", "icon": "",
+            "target_value": target, "reward_amount": reward, "category": category}
+
+
+CATALOG = [
+    _achievement("ref_5", "referrals", 5),
+    _achievement("ref_1", "referrals", 1, reward=10.0),
+    _achievement("ref_10", "referrals", 10),
+    _achievement("earn_10", "earnings", 10, reward=5.0),
+    _achievement("earn_15", "earnings", 15),
+    _achievement("earn_100", "earnings", 100),
+    _achievement("streak", "streaks", 3),
+]
+
+
+def _user(referrals=0, earnings=0.0, achievements=()):
+    return {"id": "u1", "total_referrals": referrals, "total_earnings": earnings, "achievements": list(achievements)}
+
+
+def _ids(achievements):
+    return [achievement["id"] for achievement in achievements]
+
+
+def test_thresholds_are_crossed_in_target_order():
+    engine = AchievementEngine(CATALOG)
+
+    assert engine.evaluate(_user(referrals=0)) == []
+    # Exactly on a target counts; categories without a counter never unlock
+    assert _ids(engine.evaluate(_user(referrals=5))) == ["ref_1", "ref_5", "earn_10", "earn_15"]
+    assert _ids(engine.evaluate(_user(referrals=9, earnings=15.0))) == []
+    assert _ids(engine.evaluate(_user(referrals=10, earnings=15.0))) == ["ref_10"]
+
+
+def test_a_reward_can_cross_the_next_earnings_tier():
+    engine = AchievementEngine(CATALOG)
+    # ref_1 pays 10 -> earn_10, which pays 5 -> earn_15
+    assert _ids(engine.evaluate(_user(referrals=1))) == ["ref_1", "earn_10", "earn_15"]
+
+
+def test_nothing_is_unlocked_twice():
+    engine = AchievementEngine(CATALOG)
+    assert _ids(engine.evaluate(_user(referrals=1, earnings=15.0))) == ["ref_1", "earn_10", "earn_15"]
+    assert engine.evaluate(_user(referrals=1, earnings=30.0)) == []
+
+    # A user the engine never saw starts from what storage already unlocked
+    fresh = AchievementEngine(CATALOG)
+    assert _ids(fresh.evaluate(_user(referrals=5, earnings=30.0, achievements=["ref_1", "earn_10"]))) == [
+        "ref_5", "earn_15",
+    ]
+
+
+def test_a_new_catalog_version_rechecks_every_tier():
+    engine = AchievementEngine(CATALOG)
+    engine.evaluate(_user(referrals=5, earnings=15.0))
+    version = engine.catalog_version
+
+    engine.load_catalog(CATALOG + [_achievement("ref_3", "referrals", 3)])
+    assert engine.catalog_version == version + 1
+    # Only the new tier below the user's counter comes out
+    assert _ids(engine.evaluate(_user(referrals=5, earnings=15.0))) == ["ref_3"]
+
+
+def test_progress_is_kept_for_a_bounded_number_of_users():
+    engine = AchievementEngine(CATALOG, max_users=2)
+    for n in range(3):
+        engine.evaluate({**_user(referrals=1), "id": f"u{n}"})
+    assert (len(engine), engine.evicted) == (2, 1)
+    assert engine.stats()["cached_users"] == 2
+
+    # u0 was evicted: it starts over from storage, which has what it unlocked
+    assert engine.evaluate({**_user(referrals=1, achievements=["ref_1", "earn_10", "earn_15"]), "id": "u0"}) == []
+    assert engine.evicted == 2  # u1 made room for it
+    # Using u2 keeps it warm, so u0 is the next one out
+    engine.evaluate({**_user(referrals=1), "id": "u2"})
+    engine.evaluate({**_user(), "id": "u3"})
+    assert engine.evicted == 3
+    # Still cached: nothing comes back even though this dict lists no achievements
+    assert engine.evaluate({**_user(referrals=1), "id": "u2"}) == []
+
+
+async def test_storage_refuses_to_pay_an_achievement_twice():
+    storage = MemoryStorage()
+    user = make_user("engine@example.com", total_referrals=1)
+    await storage.insert_user(user)
+
+    # Two engines (two workers, or one that evicted the user) see the same unlock
+    paid = 0.0
+    for engine in (AchievementEngine(CATALOG), AchievementEngine(CATALOG)):
+        for achievement in engine.evaluate(await storage.get_user(user["id"])):
+            if await storage.add_achievement(user["id"], achievement["id"]):
+                await storage.increment_user(user["id"], total_earnings=achievement["reward_amount"])
+                paid += achievement["reward_amount"]
+    assert paid == 15.0
+    assert (await storage.get_user(user["id"]))["total_earnings"] == 15.0
@@ -0,0 +1,84 @@
+import pytest
+
+from admission import AdmissionController, RouteClass, TokenBucketMap
+
+
+def test_burst_then_one_token_per_interval():
+    buckets = TokenBucketMap(rate=2.0, burst=3)
+
+    assert [buckets.take("ip", now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("ip", now=0.0) == pytest.approx(0.5)
+    assert buckets.take("ip", now=0.25) == pytest.approx(0.25)
+    assert buckets.take("ip", now=0.5) == 0.0
+    assert buckets.take("ip", now=0.5) == pytest.approx(0.5)
+
+
+def test_refill_never_exceeds_the_burst():
+    buckets = TokenBucketMap(rate=1.0, burst=2, max_keys=10)
+    buckets.take("ip", now=0.0)
+
+    # Long idle, but still only two requests in a row
+    assert buckets.take("other", now=1.0) == 0.0
+    assert [buckets.take("ip", now=1000.0) for _ in range(3)][2] > 0
+
+
+def test_keys_are_limited_independently():
+    buckets = TokenBucketMap(rate=1.0, burst=1)
+
+    assert buckets.take("a", now=0.0) == 0.0
+    assert buckets.take("a", now=0.0) > 0
+    assert buckets.take("b", now=0.0) == 0.0
+
+
+def test_refilled_buckets_are_dropped_without_counting_as_evictions():
+    buckets = TokenBucketMap(rate=1.0, burst=5)
+    buckets.take("a", now=0.0)
+    buckets.take("b", now=1.0)
+
+    # "a" has been idle for burst / rate seconds: as good as new, so forgotten
+    buckets.take("c", now=5.0)
+    assert len(buckets) == 2
+    assert buckets.evicted == 0
+    buckets.take("d", now=6.0)
+    assert len(buckets) == 2
+
+
+def test_max_keys_evicts_the_least_recently_used():
+    buckets = TokenBucketMap(rate=0.001, burst=1, max_keys=2)
+    buckets.take("a", now=0.0)
+    buckets.take("b", now=0.0)
+    # Touching "a" makes "b" the coldest key
+    buckets.take("a", now=0.0)
+    buckets.take("c", now=0.0)
+
+    assert len(buckets) == 2
+    assert buckets.evicted == 1
+    # "a" is still empty; "b" starts over with a full bucket
+    assert buckets.take("a", now=0.0) > 0
+    assert buckets.take("b", now=0.0) == 0.0
+
+
+def test_admit_checks_concurrency_then_ip_then_key():
+    route = RouteClass("click", ip_rate=1.0, ip_burst=2, key_rate=1.0, key_burst=1, max_concurrency=1)
+    controller = AdmissionController({"click": route})
+
+    assert controller.admit(route, "1.1.1.1", "link") is None
+    status, retry_after = controller.admit(route, "1.1.1.1", "link")
+    assert status == 429 and retry_after > 0
+    assert route.rejected_key == 1
+    assert controller.admit(route, "1.1.1.1", "link")[0] == 429
+    assert route.rejected_ip == 1
+
+    route.in_flight = 1
+    assert controller.admit(route, "2.2.2.2", "other") == (503, 1.0)
+    assert route.stats()["rejected_concurrency"] == 1
+
+
+def test_only_the_public_posts_are_classified():
+    controller = AdmissionController.from_env()
+
+    route, key, template = controller.classify("POST", "/api/track-click/abc")
+    assert (route.name, key, template) == ("click", "abc", "/api/track-click/{link_code}")
+    assert controller.classify("POST", "/api/login")[0].name == "login"
+    assert controller.classify("GET", "/api/login") is None
+    assert controller.classify("POST", "/api/referrals") is None
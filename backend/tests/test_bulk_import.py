@@ -0,0 +1,142 @@
+import json
+import os
+
+import pytest
+
+from bulk_import import BulkImporter, DeferredRows, ImportJob, ImportRow, _clean_record
+from password_hasher import PasswordHasher
+from storage import MemoryStorage
+
+pytestmark = pytest.mark.anyio
+
+
+def _row(n: int, referred_by=None) -> dict:
+    row = {"first_name": f"F{n}", "last_name": "L", "email": f"u{n}@x.com",
+           "password": "secret123", "referral_code": f"C{n}"}
+    if referred_by:
+        row["referred_by"] = referred_by
+    return row
+
+
+async def _run_import(importer: BulkImporter, rows) -> ImportJob:
+    async def chunks():
+        yield "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+    job = await importer.submit(chunks(), "jsonl")
+    await importer._tasks[job.id]
+    assert job.status == "completed", job.message
+    return job
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(bcrypt_rounds=4)
+    yield hasher
+    hasher.close()
+
+
+def _errors(job: ImportJob) -> dict:
+    return {error["email"]: error["error"] for error in job.errors}
+
+
+async def test_referrer_later_in_the_same_batch_is_linked(hasher):
+    storage = MemoryStorage()
+    importer = BulkImporter(storage, hasher, batch_size=10)
+
+    job = await _run_import(importer, [_row(1, referred_by="C2"), _row(2)])
+
+    assert (job.imported, job.rejected, job.referrals_linked) == (2, 0, 1)
+    referrer = await storage.get_user_by_referral_code("C2")
+    referral = await storage.get_user_by_referral_code("C1")
+    assert referral["referrer_id"] == referrer["id"]
+    assert referrer["total_referrals"] == 1
+
+
+async def test_referrer_in_a_later_batch_is_linked_after_the_file(hasher):
+    storage = MemoryStorage()
+    importer = BulkImporter(storage, hasher, batch_size=2)
+
+    rows = [_row(1, referred_by="C5"), _row(2), _row(3), _row(4, referred_by="C1"), _row(5)]
+    job = await _run_import(importer, rows)
+
+    # Row 1 waits for C5 and row 4 waits for row 1, both go in at the end
+    assert (job.imported, job.rejected, job.referrals_linked) == (5, 0, 2)
+    assert job.rows_deferred == 2
+    assert (await storage.get_user_by_referral_code("C5"))["total_referrals"] == 1
+    assert (await storage.get_user_by_referral_code("C1"))["total_referrals"] == 1
+
+
+async def test_unresolvable_referrers_are_rejected(hasher):
+    storage = MemoryStorage()
+    importer = BulkImporter(storage, hasher, batch_size=2)
+
+    rows = [_row(1, referred_by="ZZZ"), _row(2, referred_by="C3"), _row(3, referred_by="C2"),
+            _row(4, referred_by="C4"), _row(5)]
+    job = await _run_import(importer, rows)
+
+    assert (job.imported, job.rejected) == (1, 4)
+    errors = _errors(job)
+    assert errors["u1@x.com"] == "Unknown referral code in referred_by: ZZZ"
+    # A cycle and a self-referral never resolve either
+    assert errors["u2@x.com"] == "Unknown referral code in referred_by: C3"
+    assert errors["u3@x.com"] == "Unknown referral code in referred_by: C2"
+    assert errors["u4@x.com"] == "Unknown referral code in referred_by: C4"
+
+
+class RacingStorage(MemoryStorage):
+    """Reports no taken emails, like a registration landing after the import's check"""
+
+    async def existing_emails(self, emails):
+        return set()
+
+
+async def test_duplicate_key_at_commit_falls_back_to_row_by_row(hasher):
+    storage = RacingStorage()
+    await storage.insert_users([{
+        "id": "live-user", "first_name": "Live", "last_name": "User", "email": "u1@x.com",
+        "password_hash": "x", "referral_code": "LIVE",
+    }])
+    importer = BulkImporter(storage, hasher, batch_size=10)
+
+    job = await _run_import(importer, [_row(1), _row(2, referred_by="C1"), _row(3, referred_by="LIVE")])
+
+    # Only the taken email and the row that depended on it are rejected
+    assert (job.imported, job.rejected, job.referrals_linked) == (1, 2, 1)
+    errors = _errors(job)
+    assert errors["u1@x.com"] == "Duplicate email: u1@x.com"
+    assert errors["u2@x.com"] == "Referrer row in the same batch was rejected"
+    assert await storage.get_user_by_referral_code("C3") is not None
+    assert await storage.get_user_by_referral_code("C2") is None
+    assert (await storage.get_user_by_referral_code("LIVE"))["total_referrals"] == 1
+
+
+async def test_deferred_rows_round_trip_through_the_spool():
+    spool = DeferredRows()
+    rows = [(n, ImportRow(**_clean_record({**_row(n), "createdAt": "2026-01-02T03:04:05"}))) for n in range(5)]
+    for line, row in rows:
+        spool.append(line, row)
+
+    batches = [batch async for batch in spool.batches(2)]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [(line, row) for batch in batches for line, row in batch] == rows
+    # Read again from the start for the next pass
+    assert sum([len(batch) async for batch in spool.batches(10)], 0) == 5
+
+    spool.close()
+    assert not os.path.exists(spool.path)
+
+
+async def test_spools_are_removed_and_progress_counts_hashes(hasher):
+    storage = MemoryStorage()
+    importer = BulkImporter(storage, hasher, batch_size=1)
+
+    rows = [_row(1, referred_by="C3"), _row(2, referred_by="C1"), _row(3), _row(4, referred_by="NOPE")]
+    job = await _run_import(importer, rows)
+
+    assert (job.imported, job.rejected) == (3, 1)
+    assert not os.path.exists(job.deferred.path)
+    assert not os.path.exists(job.path)
+    progress = job.to_dict()
+    assert progress["passwords_hashed"] == 3
+    # Rows 1, 2 and 4 wait for the end; row 4 waits again on both retry passes
+    assert progress["rows_deferred"] == 5
@@ -0,0 +1,152 @@
+"""ChatService against fake_openai_server.py running on a local port"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("openai")
+import uvicorn  # noqa: E402
+from openai import APITimeoutError, InternalServerError  # noqa: E402
+
+import fake_openai_server as fake  # noqa: E402
+from chat_service import ChatBusyError, ChatService, CircuitBreaker, CircuitOpenError  # noqa: E402
+
+pytestmark = pytest.mark.anyio
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture(scope="module")
+def fake_openai_url():
+    server = uvicorn.Server(uvicorn.Config(fake.app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "fake OpenAI server did not start"
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture(autouse=True)
+def fast_fake(monkeypatch):
+    monkeypatch.setattr(fake, "LATENCY", 0.0)
+    monkeypatch.setattr(fake, "TOKEN_DELAY", 0.0)
+    monkeypatch.setattr(fake, "FAIL_RATE", 0.0)
+
+
+def fail_requests(monkeypatch, *pattern):
+    """Make the fake answer 500 for each True in ``pattern``, then succeed"""
+    draws = iter([0.0 if fail else 1.0 for fail in pattern])
+    monkeypatch.setattr(fake, "FAIL_RATE", 0.5)
+    monkeypatch.setattr(fake, "random", SimpleNamespace(random=lambda: next(draws, 1.0)))
+
+
+@pytest.fixture
+async def make_service(fake_openai_url):
+    services = []
+
+    def make(**options):
+        options.setdefault("retry_backoff", 0.01)
+        services.append(ChatService(api_key="fake", base_url=fake_openai_url, **options))
+        return services[-1]
+
+    yield make
+    for service in services:
+        await service.close()
+
+
+async def test_complete_and_stream(make_service):
+    service = make_service()
+
+    reply = await service.complete(MESSAGES)
+    streamed = [delta async for delta in service.stream(MESSAGES)]
+
+    assert reply == fake.CANNED_REPLY
+    assert "".join(streamed) == fake.CANNED_REPLY
+    assert len(streamed) > 1
+    assert service.stats()["completed"] == 2
+    assert service.in_flight == 0
+
+
+async def test_transient_errors_are_retried(make_service, monkeypatch):
+    fail_requests(monkeypatch, True)
+    service = make_service(max_retries=1)
+
+    assert await service.complete(MESSAGES) == fake.CANNED_REPLY
+    assert (service.retries, service.failed, service.breaker.failures) == (1, 0, 0)
+
+
+async def test_stream_retries_before_the_first_token(make_service, monkeypatch):
+    fail_requests(monkeypatch, True)
+    service = make_service(max_retries=1)
+
+    assert "".join([delta async for delta in service.stream(MESSAGES)]) == fake.CANNED_REPLY
+    assert service.retries == 1
+
+
+async def test_failure_after_the_last_retry(make_service, monkeypatch):
+    fail_requests(monkeypatch, True, True, True)
+    service = make_service(max_retries=2)
+
+    with pytest.raises(InternalServerError):
+        await service.complete(MESSAGES)
+    assert (service.retries, service.failed, service.breaker.failures) == (2, 1, 1)
+
+
+async def test_slow_upstream_times_out(make_service, monkeypatch):
+    monkeypatch.setattr(fake, "LATENCY", 1.0)
+    service = make_service(request_timeout=0.1, max_retries=0)
+
+    started = time.monotonic()
+    with pytest.raises(APITimeoutError):
+        await service.complete(MESSAGES)
+    assert time.monotonic() - started < 0.8
+    assert service.failed == 1
+    assert service.in_flight == 0
+
+
+async def test_breaker_opens_then_recovers(make_service, monkeypatch):
+    fail_requests(monkeypatch, True, True, True)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    service = make_service(max_retries=0, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(InternalServerError):
+            await service.complete(MESSAGES)
+    assert breaker.state == "open"
+
+    # Rejected without calling upstream
+    with pytest.raises(CircuitOpenError):
+        await service.complete(MESSAGES)
+    assert service.rejected_open == 1
+
+    # The half-open trial fails and re-opens the breaker
+    await asyncio.sleep(0.25)
+    with pytest.raises(InternalServerError):
+        await service.complete(MESSAGES)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+
+    # The next trial succeeds and closes it
+    await asyncio.sleep(0.25)
+    assert await service.complete(MESSAGES) == fake.CANNED_REPLY
+    assert breaker.state == "closed"
+
+
+async def test_busy_when_no_slot_frees_up(make_service, monkeypatch):
+    monkeypatch.setattr(fake, "LATENCY", 0.3)
+    service = make_service(max_concurrency=1, queue_timeout=0.05)
+
+    results = await asyncio.gather(service.complete(MESSAGES), service.complete(MESSAGES), return_exceptions=True)
+
+    assert sum(isinstance(result, ChatBusyError) for result in results) == 1
+    assert fake.CANNED_REPLY in results
+    assert service.rejected_busy == 1
+    # Being busy says nothing about upstream health
+    assert service.breaker.failures == 0
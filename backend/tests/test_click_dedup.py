@@ -0,0 +1,129 @@
+import random
+import time
+
+import pytest
+
+from click_dedup import ClickDeduplicator, HyperLogLog, RotatingBloomFilter
+
+
+def _key(n: int):
+    rng = random.Random(n)
+    return rng.getrandbits(64), rng.getrandbits(64) | 1
+
+
+def test_bloom_filter_remembers_keys_for_half_to_one_window():
+    bloom = RotatingBloomFilter(window=100, capacity=1000)
+    start = bloom._rotated_at
+
+    assert not bloom.check_and_add(*_key(1), now=start)
+    assert bloom.check_and_add(*_key(1), now=start + 10)
+    # One rotation: the key is still in the previous generation
+    assert not bloom.check_and_add(*_key(2), now=start + 60)
+    assert bloom.check_and_add(*_key(1), now=start + 70)
+    assert bloom.rotations == 1
+    # Two rotations after it was last added it is gone
+    assert not bloom.check_and_add(*_key(3), now=start + 120)
+    assert not bloom.check_and_add(*_key(1), now=start + 170)
+
+
+def test_bloom_filter_forgets_everything_after_a_quiet_window():
+    bloom = RotatingBloomFilter(window=100, capacity=1000)
+    start = bloom._rotated_at
+    bloom.check_and_add(*_key(1), now=start + 49)
+
+    # Nothing for a full window: both generations are dropped, not just one
+    assert not bloom.check_and_add(*_key(1), now=start + 150)
+    assert bloom.rotations == 2
+
+
+def test_bloom_filter_false_positive_rate_stays_near_target():
+    bloom = RotatingBloomFilter(window=100, capacity=10_000, error_rate=0.01)
+    now = bloom._rotated_at
+    for n in range(10_000):
+        bloom.check_and_add(*_key(n), now=now)
+
+    false_positives = sum(bloom.check_and_add(*_key(n), now=now) for n in range(10_000, 11_000))
+    assert false_positives / 1000 < 0.03
+
+
+@pytest.mark.parametrize("count", [0, 10, 1000, 50_000])
+def test_hyperloglog_estimate_is_within_a_few_percent(count):
+    sketch = HyperLogLog(precision=12)
+    rng = random.Random(count)
+    for _ in range(count):
+        value = rng.getrandbits(64)
+        sketch.add_hash(value)
+        sketch.add_hash(value)
+
+    assert abs(sketch.estimate() - count) <= max(2, count * 0.05)
+
+
+def test_repeat_clicks_are_flagged_at_request_time():
+    dedup = ClickDeduplicator(window=1800, capacity=1000)
+
+    first = [dedup.check("link", "1.1.1.1", "bot") for _ in range(5)]
+    others = [dedup.check("link", "1.1.1.1", f"browser{i}") for i in range(3)]
+    other_link = dedup.check("other", "1.1.1.1", "bot")
+
+    assert first == [False, True, True, True, True]
+    assert not any(others) and not other_link
+    assert (dedup.checked, dedup.flagged) == (9, 4)
+
+
+def test_link_stats_come_from_the_stored_verdicts():
+    dedup = ClickDeduplicator(window=1800, capacity=1000)
+    now = time.time()
+    for n in range(5):
+        dedup.record("link", "1.1.1.1", "bot", now, duplicate=n > 0)
+    for i in range(3):
+        dedup.record("link", "1.1.1.1", f"browser{i}", now, duplicate=False)
+
+    # Conversion is over unique clicks: 2 registrations from 4 visitors
+    assert dedup.link_stats("link", registrations=2) == {
+        "raw_clicks": 8, "unique_clicks": 4, "duplicate_clicks": 4, "conversion_rate": 50.0,
+    }
+    assert dedup.link_stats("missing", registrations=1) == {
+        "raw_clicks": 0, "unique_clicks": 0, "duplicate_clicks": 0, "conversion_rate": 0,
+    }
+    assert (dedup.raw_clicks, dedup.duplicate_clicks) == (8, 4)
+    # Stored clicks (from any worker) go into the filter, so the next repeat is caught
+    assert dedup.check("link", "1.1.1.1", "browser0")
+    # Clicks older than the window only count towards the estimates
+    dedup.record("link", "9.9.9.9", "old", now - 3600, duplicate=False)
+    assert not dedup.check("link", "9.9.9.9", "old")
+
+
+def test_saved_sketches_merge_into_the_estimates():
+    saved = ClickDeduplicator(window=1800)
+    for n in range(50):
+        saved.record("link", f"10.0.0.{n}", "ua", None, duplicate=False)
+    sketches = saved.dirty_sketches()
+    assert list(sketches) == ["link"]
+    saved.mark_saved(sketches)
+    assert saved.dirty_sketches() == {}
+
+    restarted = ClickDeduplicator(window=1800)
+    restarted.add_counts("link", raw=60, duplicates=10)
+    restarted.load_sketches(sketches)
+    # Visitors in the sketch and seen again after the checkpoint count once
+    for n in range(40, 60):
+        restarted.add_visitor("link", f"10.0.0.{n}", "ua", None)
+    stats = restarted.link_stats("link")
+    assert (stats["raw_clicks"], stats["duplicate_clicks"]) == (60, 10)
+    everyone = ClickDeduplicator(window=1800)
+    for n in range(60):
+        everyone.add_visitor("link", f"10.0.0.{n}", "ua", None)
+    assert stats["unique_clicks"] == everyone.unique_clicks("link")
+    # Registers of another precision are ignored rather than mixed in
+    other = ClickDeduplicator(precision=12)
+    other.load_sketches(sketches)
+    assert (other.sketches_loaded, other.unique_clicks("link")) == (0, 0)
+
+
+def test_disabled_window_never_flags_duplicates():
+    dedup = ClickDeduplicator(window=0)
+
+    assert not any(dedup.check("link", "1.1.1.1", "bot") for _ in range(3))
+    for _ in range(3):
+        dedup.record("link", "1.1.1.1", "bot", None, duplicate=False)
+    assert dedup.link_stats("link")["unique_clicks"] == 1
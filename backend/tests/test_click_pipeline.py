@@ -0,0 +1,150 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from click_pipeline import ClickIngestor, SQLiteClickSink
+from records import Click
+
+pytestmark = pytest.mark.anyio
+
+
+class ListSink:
+    """Keeps written batches in memory; ``gate`` holds writes until it is set"""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.closed = False
+
+    async def write_batch(self, batch):
+        await self.gate.wait()
+        self.batches.append([click.link_code for click in batch])
+
+    @property
+    def written(self):
+        return [code for batch in self.batches for code in batch]
+
+    async def clear(self):
+        self.batches.clear()
+
+    async def close(self):
+        self.closed = True
+
+
+def _click(n: int) -> Click:
+    return Click(link_code=f"L{n}", ip_address="1.2.3.4", user_agent="ua", clicked_at=datetime(2026, 3, 10, 12, 0))
+
+
+async def test_drop_newest_rejects_clicks_once_the_queue_is_full():
+    sink = ListSink()
+    ingestor = ClickIngestor(sink, max_queue=2, overflow_policy="drop_newest")
+
+    assert [await ingestor.put(_click(n)) for n in range(4)] == [True, True, False, False]
+    stats = ingestor.stats()
+    assert (stats["queue_depth"], stats["enqueued"], stats["dropped"]) == (2, 2, 2)
+
+    await ingestor.stop()
+    assert sink.written == []  # never started, nothing flushed
+
+
+async def test_drop_oldest_evicts_the_head_of_the_queue():
+    sink = ListSink()
+    ingestor = ClickIngestor(sink, max_queue=2, batch_size=10, flush_interval=0.01, overflow_policy="drop_oldest")
+
+    for n in range(4):
+        assert await ingestor.put(_click(n))
+    assert (ingestor.dropped, ingestor.enqueued, ingestor.max_queue_depth) == (2, 4, 2)
+
+    ingestor.start()
+    await ingestor.stop()
+    assert sink.written == ["L2", "L3"]
+    assert ingestor.flushed == 2
+
+
+async def test_block_waits_for_room_then_gives_up():
+    sink = ListSink()
+    ingestor = ClickIngestor(sink, max_queue=1, batch_size=1, flush_interval=0.01,
+                             overflow_policy="block", block_timeout=0.05)
+    assert await ingestor.put(_click(0))
+
+    # Nobody drains the queue: the click is dropped after block_timeout
+    assert not await ingestor.put(_click(1))
+    assert ingestor.dropped == 1
+
+    # With the worker running, the blocked put gets the slot it frees
+    ingestor.block_timeout = 1.0
+    ingestor.start()
+    assert await ingestor.put(_click(2))
+    await ingestor.stop()
+    assert sink.written == ["L0", "L2"]
+    assert (ingestor.flushed, ingestor.dropped) == (2, 1)
+
+
+async def test_full_batches_flush_without_waiting_for_the_interval():
+    sink = ListSink()
+    ingestor = ClickIngestor(sink, batch_size=3, flush_interval=0.5)
+    ingestor.start()
+    for n in range(7):
+        await ingestor.put(_click(n))
+
+    # Well before the interval is up
+    for _ in range(10):
+        if len(sink.batches) == 2:
+            break
+        await asyncio.sleep(0.01)
+    assert sink.batches == [["L0", "L1", "L2"], ["L3", "L4", "L5"]]
+    assert (ingestor.flushed, ingestor.batches) == (6, 2)
+
+    await ingestor.stop()
+    assert sink.batches[-1] == ["L6"]
+
+
+async def test_stop_flushes_pending_clicks_and_refuses_new_ones():
+    sink = ListSink()
+    sink.gate.clear()
+    ingestor = ClickIngestor(sink, batch_size=2, flush_interval=0.1)
+    ingestor.start()
+    for n in range(5):
+        await ingestor.put(_click(n))
+    await asyncio.sleep(0)
+
+    stopping = asyncio.create_task(ingestor.stop())
+    await asyncio.sleep(0.01)
+    assert not await ingestor.put(_click(5))
+    sink.gate.set()
+    await stopping
+
+    assert sink.written == [f"L{n}" for n in range(5)]
+    stats = ingestor.stats()
+    assert (stats["flushed"], stats["dropped"], stats["queue_depth"]) == (5, 1, 0)
+    assert sink.closed
+
+
+async def test_failed_batches_are_counted_and_dropped():
+    class FailingSink(ListSink):
+        async def write_batch(self, batch):
+            raise RuntimeError("store is down")
+
+    ingestor = ClickIngestor(FailingSink(), batch_size=2, flush_interval=0.01)
+    ingestor.start()
+    for n in range(3):
+        await ingestor.put(_click(n))
+    await ingestor.stop()
+    assert (ingestor.flushed, ingestor.failed, ingestor.batches) == (0, 3, 2)
+
+
+async def test_sqlite_sink_stores_the_flushed_clicks(tmp_path):
+    sink = SQLiteClickSink(str(tmp_path / "clicks.db"))
+    ingestor = ClickIngestor(sink, batch_size=2, flush_interval=0.01)
+    ingestor.start()
+    for n in range(3):
+        await ingestor.put(_click(n))
+    await ingestor.stop()
+
+    reopened = SQLiteClickSink(str(tmp_path / "clicks.db"))
+    rows = await reopened.clicks_after(0, 10)
+    assert [(row[0], row[1], row[4]) for row in rows] == [(1, "L0", "1.2.3.4"), (2, "L1", "1.2.3.4"), (3, "L2", "1.2.3.4")]
+    assert rows[0][3] == datetime(2026, 3, 10, 12, 0)
+    await reopened.close()
@@ -0,0 +1,172 @@
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from cohort_matrix import retention_matrix
+from cohorts import ACTIVITY, REFERRAL, CohortAnalyzer
+
+pytestmark = pytest.mark.anyio
+
+MONDAY = date(2024, 1, 1)
+
+
+def _day(n: int) -> datetime:
+    return datetime.combine(MONDAY + timedelta(days=n), datetime.min.time())
+
+
+async def _weekly(cohorts: CohortAnalyzer, **options) -> dict:
+    options = {"period": "week", "periods": 3, **options}
+    return await cohorts.retention(MONDAY, MONDAY + timedelta(days=13), **options)
+
+
+async def test_weekly_retention_counts_a_user_once_per_period():
+    cohorts = CohortAnalyzer()
+    cohorts.add_user("u1", _day(0))
+    cohorts.add_user("u2", _day(2))
+    cohorts.add_user("u3", _day(7))
+    for user_id, day in [("u1", 0), ("u1", 1), ("u1", 1), ("u1", 8), ("u2", 15), ("u3", 7), ("u3", 19)]:
+        cohorts.record_activity(user_id, _day(day))
+
+    result = await _weekly(cohorts)
+
+    assert [(row["cohort"], row["users"], row["active"]) for row in result["cohorts"]] == [
+        ("2024-01-01", 2, [1, 1, 1]),
+        ("2024-01-08", 1, [1, 1, 0]),
+    ]
+    assert result["cohorts"][0]["retention"] == [50.0, 50.0, 50.0]
+    assert result["summary"]["users"] == 3
+
+
+async def test_referral_metric_only_counts_referrals():
+    cohorts = CohortAnalyzer()
+    cohorts.add_user("u1", _day(0))
+    cohorts.add_user("u2", _day(0))
+    cohorts.record_activity("u2", _day(1))
+    # u1's code used in the second week
+    cohorts.add_user("u3", _day(9), referrer_id="u1")
+
+    result = await _weekly(cohorts, metric="referrals")
+
+    assert [row["active"] for row in result["cohorts"]] == [[0, 1, 0], [0, 0, 0]]
+
+
+async def test_churn_is_no_event_within_churn_days():
+    today = datetime.utcnow()
+    cohorts = CohortAnalyzer()
+    cohorts.add_user("active", today - timedelta(days=100))
+    cohorts.add_user("gone", today - timedelta(days=100))
+    cohorts.add_user("new", today - timedelta(days=5))
+    cohorts.record_activity("active", today - timedelta(days=3))
+
+    result = await cohorts.retention((today - timedelta(days=120)).date(), today.date(), period="month",
+                                     churn_days=30)
+
+    # "new" signed up too recently to count either way
+    assert result["summary"] == {"users": 3, "churned_users": 1, "churn_rate": 50.0}
+
+
+async def test_periods_that_have_not_happened_yet_are_null():
+    today = datetime.utcnow()
+    cohorts = CohortAnalyzer()
+    cohorts.add_user("u1", today)
+    cohorts.record_activity("u1", today)
+
+    result = await cohorts.retention(today.date(), today.date(), period="month", periods=3)
+
+    assert result["cohorts"][0]["active"] == [1, None, None]
+    assert result["cohorts"][0]["retention"] == [100.0, None, None]
+
+
+async def test_results_are_cached_until_the_data_changes_and_the_ttl_passes():
+    cohorts = CohortAnalyzer(cache_ttl=0)
+    cohorts.add_user("u1", _day(0))
+
+    assert not (await _weekly(cohorts))["cached"]
+    assert (await _weekly(cohorts))["cached"]
+    cohorts.add_user("u2", _day(1))
+    result = await _weekly(cohorts)
+    assert not result["cached"] and result["summary"]["users"] == 2
+
+    # Within the TTL a changing window is served from cache
+    cohorts.cache_ttl = 3600
+    cohorts.add_user("u3", _day(2))
+    assert (await _weekly(cohorts))["summary"]["users"] == 2
+
+
+async def test_invalid_windows_are_rejected():
+    cohorts = CohortAnalyzer()
+    with pytest.raises(ValueError):
+        await cohorts.retention(MONDAY, MONDAY, period="day")
+    with pytest.raises(ValueError):
+        await cohorts.retention(MONDAY, MONDAY, metric="logins")
+    with pytest.raises(ValueError):
+        await cohorts.retention(MONDAY + timedelta(days=1), MONDAY)
+
+
+@pytest.mark.parametrize("period", ["week", "month"])
+@pytest.mark.parametrize("metric", ["activity", "referrals"])
+def test_matrix_matches_a_plain_python_count(period, metric):
+    rng = random.Random(7)
+    cohorts = CohortAnalyzer()
+    first = MONDAY.toordinal()
+    for n in range(300):
+        cohorts.add_user(f"u{n}", _day(rng.randrange(120)), referrer_id=f"u{rng.randrange(300)}")
+    for n in range(300):
+        for day in sorted(rng.sample(range(200), 10)):
+            cohorts.record_activity(f"u{n}", _day(day))
+    start, end, periods, churn_days, today = first + 10, first + 100, 5, 30, first + 150
+
+    result = retention_matrix(cohorts._signup, cohorts._event_user, cohorts._event_day, cohorts._event_kind,
+                              start, end, period, metric, periods, churn_days, today)
+
+    def unit(day: int) -> int:
+        if period == "week":
+            return (day - 1) // 7
+        moment = date.fromordinal(day)
+        return moment.year * 12 + moment.month - 1
+
+    kinds = (REFERRAL,) if metric == "referrals" else (REFERRAL, ACTIVITY)
+    expected, sizes = {}, {}
+    for signup in cohorts._signup:
+        if start <= signup <= end:
+            sizes[unit(signup)] = sizes.get(unit(signup), 0) + 1
+    seen = set()
+    for user, day, kind in zip(cohorts._event_user, cohorts._event_day, cohorts._event_kind):
+        signup = cohorts._signup[user]
+        offset = unit(day) - unit(signup)
+        if kind in kinds and start <= signup <= end and 0 <= offset < periods and (user, offset) not in seen:
+            seen.add((user, offset))
+            expected[unit(signup), offset] = expected.get((unit(signup), offset), 0) + 1
+
+    for c, row in enumerate(result["cohorts"]):
+        cohort = unit(start) + c
+        assert row["users"] == sizes.get(cohort, 0)
+        assert row["active"] == [
+            expected.get((cohort, offset), 0) if cohort + offset <= unit(today) else None
+            for offset in range(periods)
+        ]
+
+
+async def test_rebuild_restores_referrals_and_stored_activity(storage):
+    users = [
+        # The referral is stored before its referrer
+        {"id": "b", "referrer_id": "z", "created_at": _day(3)},
+        {"id": "z", "referrer_id": None, "created_at": _day(0)},
+    ]
+    await storage.insert_users([
+        {"first_name": "F", "last_name": "L", "email": f"{user['id']}@x.com", "password_hash": "x",
+         "referral_code": user["id"].upper(), "total_referrals": 0, "total_earnings": 0.0, **user}
+        for user in users
+    ], {})
+    await storage.record_activity([("b", _day(8).toordinal())])
+
+    cohorts = CohortAnalyzer()
+    cohorts.record_activity("b", _day(1))
+    await cohorts.rebuild_from(storage)
+
+    referrals = await _weekly(cohorts, metric="referrals")
+    activity = await _weekly(cohorts)
+    assert referrals["cohorts"][0]["active"] == [1, 0, 0]
+    assert activity["cohorts"][0]["active"] == [1, 1, 0]
+    assert cohorts.stats()["unsaved_activity"] == 0
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+from fastapi import Request
+
+from etag_cache import ETagCache, etag_matches
+
+from .test_storage import make_referral, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+def _request(if_none_match=None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+class Builder:
+    """A body builder that counts how often it runs"""
+
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.body
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ('"stats-3"', True),
+    ('W/"stats-3"', True),
+    ('"stats-2", "stats-3"', True),
+    ('"stats-4"', False),
+    ("*", True),
+])
+def test_if_none_match_uses_weak_comparison(header, expected):
+    assert etag_matches(header, '"stats-3"') is expected
+
+
+def test_tags_carry_the_epoch_and_every_version_part():
+    assert ETagCache().tag("stats", 3) == '"stats-3"'
+    assert ETagCache(version_epoch="a1b2").tag("profile", "u1", 7) == '"profile-a1b2-u1-7"'
+
+
+async def test_body_is_built_once_per_version():
+    cache = ETagCache()
+    build = Builder({"total_users": 1})
+
+    first = await cache.respond(_request(), "stats", cache.tag("stats", 1), build)
+    again = await cache.respond(_request(), "stats", cache.tag("stats", 1), build)
+    assert first.body == again.body == json.dumps({"total_users": 1}, separators=(",", ":")).encode()
+    assert again.headers["etag"] == '"stats-1"'
+    assert build.calls == 1
+
+    build.body = {"total_users": 2}
+    changed = await cache.respond(_request(), "stats", cache.tag("stats", 2), build)
+    assert json.loads(changed.body) == {"total_users": 2}
+    assert build.calls == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+async def test_matching_if_none_match_gets_a_304_without_building():
+    cache = ETagCache()
+    build = Builder({})
+
+    response = await cache.respond(_request('"stats-1"'), "stats", cache.tag("stats", 1), build, private=True)
+
+    assert response.status_code == 304
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert build.calls == 0
+    assert cache.not_modified == 1
+
+
+async def test_least_recently_used_bodies_are_evicted():
+    cache = ETagCache(max_entries=2)
+    for key in ("a", "b", "a", "c"):
+        await cache.respond(_request(), key, cache.tag(key, 1), Builder({"key": key}))
+
+    assert cache.stats()["entries"] == 2
+    assert cache.evicted == 1
+    assert cache.stats()["bytes"] == 2 * len(b'{"key":"a"}')
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
+
+
+async def test_stats_tag_moves_with_every_stored_click(storage):
+    cache = ETagCache.from_env(storage)
+    user = make_user("etag@example.com")
+    await storage.insert_user(user)
+    await storage.insert_referral(make_referral(user["id"], "etag-link"))
+    referral = await storage.get_referral_by_link_code("etag-link")
+
+    before = cache.tag("stats", (await storage.resource_versions())["stats"])
+    assert before == cache.tag("stats", (await storage.resource_versions())["stats"])
+    await storage.increment_referral(referral["id"], click_count=1)
+    after = cache.tag("stats", (await storage.resource_versions())["stats"])
+
+    # Every worker reads the same version, so a 304 from one is valid on another
+    assert after != before
+    assert not etag_matches(before, after)
@@ -0,0 +1,185 @@
+import re
+from collections import defaultdict
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from achievement_engine import AchievementEngine
+from cohorts import CohortAnalyzer
+from etag_cache import ETagCache
+from metrics import Metrics, MetricsMiddleware
+from referral_graph import ReferralGraph
+from storage import MemoryStorage
+from token_cache import TokenCache
+from worker_sync import WorkerSync
+
+pytestmark = pytest.mark.anyio
+
+# Prometheus text exposition format 0.0.4, one regex per kind of line
+METRIC_NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+VALUE = r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?|[+-]?Inf|NaN"
+HELP_LINE = re.compile(rf"# HELP ({METRIC_NAME}) .*")
+TYPE_LINE = re.compile(rf"# TYPE ({METRIC_NAME}) (counter|gauge|histogram|summary|untyped)")
+SAMPLE_LINE = re.compile(rf"({METRIC_NAME})(?:\{{((?:{LABEL})(?:,{LABEL})*)?\}})? ({VALUE})(?: -?\d+)?")
+
+
+def _app(metrics: Metrics) -> FastAPI:
+    """The /metrics route main.py serves, behind the same middleware"""
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get("/api/links/{link_code}")
+    async def get_link(link_code: str):
+        with metrics.timer("store_lookup"):
+            return {"link_code": link_code}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+async def _get(app, path: str):
+    """(status, headers, body) of a GET sent straight to the ASGI app"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"test")], "client": ("127.0.0.1", 50000), "server": ("test", 80),
+    }
+    response = {"body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {name.decode(): value.decode() for name, value in message["headers"]}
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"].decode()
+
+
+def _parse(text: str):
+    """{family: type} and [(name, labels, value)], asserting every line is valid exposition"""
+    assert text.endswith("\n")
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            assert HELP_LINE.fullmatch(line), line
+        elif line.startswith("# TYPE "):
+            match = TYPE_LINE.fullmatch(line)
+            assert match, line
+            # One TYPE per family, before its samples
+            assert match[1] not in types, line
+            types[match[1]] = match[2]
+        else:
+            match = SAMPLE_LINE.fullmatch(line)
+            assert match, line
+            labels = dict(re.findall(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"', match[2] or ""))
+            samples.append((match[1], labels, float(match[3])))
+    return types, samples
+
+
+def _family(name: str, types: dict) -> str:
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and types.get(name[:-len(suffix)]) == "histogram":
+            return name[:-len(suffix)]
+    return name
+
+
+async def test_every_line_of_a_scrape_is_valid_exposition():
+    metrics = Metrics(prefix="referral")
+    storage, token_cache = MemoryStorage(), TokenCache()
+    # The components main.py registers, so their key names go through the grammar too
+    for component, stats in (
+        ("token_cache", token_cache.stats),
+        ("worker_sync", WorkerSync(storage, token_cache).stats),
+        ("referral_graph", ReferralGraph().stats),
+        ("achievements", AchievementEngine([]).stats),
+        ("cohorts", CohortAnalyzer().stats),
+        ("etag_cache", ETagCache().stats),
+    ):
+        metrics.add_stats(component, stats)
+    # Strings are skipped, bools become 0/1, nested dicts are joined with _
+    metrics.add_stats("storage", lambda: {"backend": "memory", "persistence": {"fsync": False, "journal_bytes": 10},
+                                          "avg_commit_ms": 0.25})
+    app = _app(metrics)
+    for path in ("/api/links/abc", "/api/links/def", "/nope"):
+        await _get(app, path)
+
+    status, headers, text = await _get(app, "/metrics")
+    assert status == 200
+    assert headers["content-type"].startswith("text/plain; version=0.0.4")
+    types, samples = _parse(text)
+
+    # Every sample belongs to a family declared with TYPE
+    for name, _, _ in samples:
+        assert _family(name, types) in types, name
+
+    requests = {(labels["route"], labels["status"]): value
+                for name, labels, value in samples if name == "referral_http_requests_total"}
+    assert requests == {("/api/links/{link_code}", "200"): 2, ("unmatched", "404"): 1}
+    gauges = {name: value for name, labels, value in samples if not labels}
+    assert gauges["referral_storage_persistence_fsync"] == 0
+    assert gauges["referral_storage_persistence_journal_bytes"] == 10
+    assert gauges["referral_storage_avg_commit_ms"] == 0.25
+    assert "referral_storage_backend" not in types
+
+    # Histograms: cumulative buckets ending in +Inf, which equals _count
+    buckets = defaultdict(list)
+    counts = {}
+    for name, labels, value in samples:
+        family = _family(name, types)
+        if types[family] != "histogram":
+            continue
+        series = (family, tuple(sorted((k, v) for k, v in labels.items() if k != "le")))
+        if name.endswith("_bucket"):
+            buckets[series].append((labels["le"], value))
+        elif name.endswith("_count"):
+            counts[series] = value
+    assert buckets and buckets.keys() == counts.keys()
+    for series, series_buckets in buckets.items():
+        values = [value for _, value in series_buckets]
+        assert values == sorted(values), series
+        assert series_buckets[-1] == ("+Inf", counts[series]), series
+    store_lookup = ("referral_hot_path_duration_seconds", (("operation", "store_lookup"),))
+    assert counts[store_lookup] == 2
+
+
+async def test_counters_and_gauges_have_the_right_type():
+    metrics = Metrics(prefix="referral")
+    metrics.add_stats("token_cache", TokenCache().stats)
+    app = _app(metrics)
+    await _get(app, "/api/links/abc")
+
+    types, first = _parse((await _get(app, "/metrics"))[2])
+    assert types["referral_http_requests_total"] == "counter"
+    assert types["referral_http_requests_in_flight"] == "gauge"
+    assert types["referral_event_loop_lag_max_seconds"] == "gauge"
+    for family in ("referral_http_request_duration_seconds", "referral_hot_path_duration_seconds",
+                   "referral_event_loop_lag_seconds"):
+        assert types[family] == "histogram"
+    # Component stats go up and down (sizes, rates), so they are gauges
+    assert types["referral_token_cache_size"] == "gauge"
+    assert types["referral_token_cache_hit_rate"] == "gauge"
+    # Only counters are named _total, and every counter is
+    for family, kind in types.items():
+        assert (kind == "counter") == family.endswith("_total"), family
+
+    # Counters never go down between scrapes
+    for path in ("/api/links/abc", "/api/links/def"):
+        await _get(app, path)
+    _, second = _parse((await _get(app, "/metrics"))[2])
+    before = {(name, tuple(sorted(labels.items()))): value for name, labels, value in first
+              if types[_family(name, types)] == "counter"}
+    after = {(name, tuple(sorted(labels.items()))): value for name, labels, value in second
+             if types[_family(name, types)] == "counter"}
+    assert before and all(after[key] >= value for key, value in before.items())
+    assert after[("referral_http_requests_total",
+                  (("method", "GET"), ("route", "/api/links/{link_code}"), ("status", "200")))] == 3
@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+import pytest
+
+from password_hasher import HasherBusyError, PasswordHasher
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def hasher():
+    # Lowest bcrypt cost, these tests are about the pool and not the hash
+    hasher = PasswordHasher(bcrypt_rounds=4, max_workers=2, max_concurrency=2, queue_timeout=1.0)
+    yield hasher
+    hasher.close()
+
+
+async def test_hashes_verify_and_the_context_loads_lazily(hasher):
+    assert not hasher.stats()["loaded"]
+    hashed = await hasher.hash("secret")
+
+    assert hashed.startswith("$2b$04$")
+    assert await hasher.verify("secret", hashed)
+    assert not await hasher.verify("wrong", hashed)
+    stats = hasher.stats()
+    assert (stats["loaded"], stats["completed"], stats["rejected"]) == (True, 3, 0)
+
+
+async def test_no_more_than_max_concurrency_hashes_run_at_once(hasher):
+    running = peak = 0
+    lock = threading.Lock()
+
+    def work():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return True
+
+    assert all(await asyncio.gather(*(hasher._run("password_hash", work) for _ in range(8))))
+    assert peak == 2
+    assert hasher.completed == 8
+    assert hasher.stats()["max_wait_ms"] > 0
+
+
+async def test_callers_waiting_too_long_get_busy_errors():
+    hasher = PasswordHasher(bcrypt_rounds=4, max_workers=1, max_concurrency=1, queue_timeout=0.05)
+    release = threading.Event()
+    holding = asyncio.create_task(hasher._run("password_hash", release.wait))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(HasherBusyError):
+        await hasher.hash("secret")
+    assert (hasher.rejected, hasher.waiting) == (1, 0)
+
+    # Once the slot frees up the next caller goes through
+    release.set()
+    await holding
+    assert await hasher.hash("secret")
+    assert hasher.completed == 2
+    hasher.close()
+
+
+async def test_legacy_sha256_hashes_are_upgraded_on_login(hasher):
+    legacy = hashlib.sha256(b"secret").hexdigest()
+
+    assert await hasher.verify_and_update("wrong", legacy) == (False, None)
+    valid, new_hash = await hasher.verify_and_update("secret", legacy)
+    assert valid and new_hash.startswith("$2b$")
+    assert hasher.rehashed == 1
+
+    # The upgraded hash verifies and is not upgraded again
+    assert await hasher.verify_and_update("secret", new_hash) == (True, None)
+    assert hasher.rehashed == 1
+
+
+async def test_hashes_made_with_an_older_cost_are_upgraded(hasher):
+    stronger = PasswordHasher(bcrypt_rounds=5)
+    valid, new_hash = await stronger.verify_and_update("secret", await hasher.hash("secret"))
+    assert valid and new_hash.startswith("$2b$05$")
+    stronger.close()
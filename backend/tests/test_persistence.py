@@ -0,0 +1,167 @@
+import os
+import pickle
+import zlib
+
+import pytest
+
+from persistence import FRAME_HEADER, Persistence, read_segment, read_snapshot, segment_name
+from storage import MemoryStorage
+
+pytestmark = pytest.mark.anyio
+
+
+async def open_storage(directory):
+    storage = MemoryStorage(persistence=Persistence(str(directory), fsync=False, snapshot_interval=3600))
+    await storage.connect()
+    return storage
+
+
+async def crash(storage):
+    """Stop without the shutdown snapshot, so the restart replays the journal"""
+    persistence = storage.persistence
+    persistence._snapshotter.cancel()
+    await persistence.journal.sync()
+    await persistence.journal.close()
+
+
+def state(storage: MemoryStorage) -> tuple:
+    """Everything recovery has to bring back, in comparable form"""
+    return (
+        sorted(user.astuple() for user in storage.users.values()),
+        list(storage.ranking.ids()),
+        sorted(referral.astuple() for referral in storage.referrals.values()),
+        storage.code_counter,
+        dict(storage.totals),
+    )
+
+
+def _user(n: int, **fields) -> dict:
+    return {"id": f"u{n}", "first_name": f"F{n}", "last_name": "L", "email": f"u{n}@x.com",
+            "password_hash": "x", "referral_code": f"C{n}", "created_at": "2024-01-01T00:00:00", **fields}
+
+
+async def populate(storage: MemoryStorage, first: int = 1):
+    """One of each journaled mutation"""
+    await storage.insert_user(_user(first))
+    await storage.insert_users(
+        [_user(first + 1, referrer_id=f"u{first}"), _user(first + 2, referrer_id=f"u{first}")],
+        {f"u{first}": {"total_referrals": 2}},
+    )
+    await storage.insert_referral({"id": f"r{first}", "user_id": f"u{first}", "user_name": "F L",
+                                   "link_code": f"link{first}", "full_url": "http://x", "created_at": "2024-01-01"})
+    await storage.increment_referral(f"r{first}", click_count=3, registration_count=1)
+    await storage.increment_user(f"u{first}", total_earnings=20.0)
+    await storage.update_user(f"u{first + 1}", first_name="Renamed")
+    await storage.add_achievement(f"u{first}", "first_referral")
+    await storage.reserve_code_counters(100)
+
+
+async def test_journal_replay_restores_every_mutation(tmp_path):
+    storage = await open_storage(tmp_path)
+    await populate(storage)
+    expected = state(storage)
+    await crash(storage)
+
+    storage = await open_storage(tmp_path)
+    assert state(storage) == expected
+    assert storage.persistence.replayed_entries == 8
+    assert storage.persistence.replay_errors == 0
+    await storage.close()
+
+
+async def test_snapshot_plus_later_journal_entries(tmp_path):
+    storage = await open_storage(tmp_path)
+    await populate(storage, first=1)
+    snapshot = await storage.snapshot()
+    await populate(storage, first=10)
+    expected = state(storage)
+    await crash(storage)
+
+    # Segments before the snapshot are gone; only the later entries are replayed
+    assert snapshot["segments_removed"] == 1
+    assert read_snapshot(storage.persistence.snapshot_path)[0] == snapshot["generation"]
+    storage = await open_storage(tmp_path)
+    assert state(storage) == expected
+    assert storage.persistence.recovered_users == 3
+    assert storage.persistence.replayed_entries == 8
+    await storage.close()
+
+
+async def test_clean_shutdown_leaves_nothing_to_replay(tmp_path):
+    storage = await open_storage(tmp_path)
+    await populate(storage)
+    expected = state(storage)
+    await storage.close()
+
+    storage = await open_storage(tmp_path)
+    assert state(storage) == expected
+    assert storage.persistence.replayed_entries == 0
+    await storage.close()
+
+
+async def test_torn_last_frame_is_dropped_and_never_appended_to(tmp_path):
+    storage = await open_storage(tmp_path)
+    await populate(storage)
+    expected = state(storage)
+    await crash(storage)
+
+    # A crash mid-write: a header promising more payload than made it to disk
+    segment = tmp_path / segment_name(0)
+    with open(segment, "ab") as f:
+        f.write(FRAME_HEADER.pack(1000, 0) + b"partial")
+
+    storage = await open_storage(tmp_path)
+    assert state(storage) == expected
+    assert storage.persistence.journal.generation == 1
+    await storage.insert_user(_user(50))
+    expected = state(storage)
+    await crash(storage)
+
+    # The entry written after recovery went to a new segment, so it is not hidden behind the torn frame
+    storage = await open_storage(tmp_path)
+    assert state(storage) == expected
+    await storage.close()
+
+
+def test_segment_stops_at_a_corrupt_frame(tmp_path):
+    path = str(tmp_path / segment_name(0))
+    frames = []
+    for n in range(3):
+        payload = pickle.dumps(("clear", (n,)))
+        frames.append(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+    middle = bytearray(frames[1])
+    middle[-1] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(frames[0] + bytes(middle) + frames[2])
+
+    assert list(read_segment(path)) == [("clear", (0,))]
+
+
+async def test_replay_errors_are_counted_not_fatal(tmp_path):
+    storage = await open_storage(tmp_path)
+    await storage.insert_user(_user(1))
+    # Journaled but refers to a user that is not there on replay
+    storage.persistence.log("increment_user", ("missing", {"total_referrals": 1}))
+    await storage.insert_user(_user(2))
+    await crash(storage)
+
+    storage = await open_storage(tmp_path)
+    assert await storage.count_users() == 2
+    assert storage.persistence.replay_errors == 1
+    await storage.close()
+
+
+async def test_corrupt_snapshot_is_refused(tmp_path):
+    storage = await open_storage(tmp_path)
+    await populate(storage)
+    await storage.close()
+
+    path = storage.persistence.snapshot_path
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) - 1)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError, match="checksum"):
+        read_snapshot(path)
@@ -0,0 +1,85 @@
+import asyncio
+import sys
+import threading
+
+import pytest
+
+from profiler import ProfilerBusyError, SamplingProfiler
+
+pytestmark = pytest.mark.anyio
+
+
+def _spin(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(100))
+
+
+@pytest.fixture
+def busy_thread():
+    """A thread that stays in ``_spin`` until the test ends"""
+    stop = threading.Event()
+    thread = threading.Thread(target=_spin, args=(stop,), daemon=True)
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def _sampling_threads():
+    """Threads whose current stack is inside the sampler loop"""
+    found = []
+    for ident, frame in sys._current_frames().items():
+        while frame is not None:
+            if frame.f_code is SamplingProfiler._sample.__code__:
+                found.append(ident)
+                break
+            frame = frame.f_back
+    return found
+
+
+async def test_samples_are_aggregated_into_collapsed_stacks(busy_thread):
+    profiler = SamplingProfiler(interval=0.002)
+    report = await profiler.profile(0.2, all_threads=True)
+
+    assert report["samples"] > 10
+    lines = [line.rsplit(" ", 1) for line in report["collapsed"].splitlines()]
+    counts = [int(count) for _, count in lines]
+    # Identical stacks are one line with their count, most sampled first
+    assert len({stack for stack, _ in lines}) == len(lines)
+    assert counts == sorted(counts, reverse=True)
+    assert sum(counts) == report["stack_samples"]
+    spinning = [(stack, int(count)) for stack, count in lines if "_spin (tests/test_profiler.py" in stack]
+    assert spinning and max(count for _, count in spinning) > 1
+    # Outermost frame first: the thread's bootstrap in threading.py
+    assert all("_bootstrap (" in stack.split(";")[0] for stack, _ in spinning)
+
+    total = {row["function"].split(" ")[0]: row["samples"] for row in report["top_total"]}
+    # The busy thread is in _spin (or a callee) on every sample
+    assert total["_spin"] >= report["samples"] - 1
+    assert sum(row["percent"] for row in report["top_self"]) <= 100.01
+
+
+async def test_only_the_loop_thread_is_sampled_by_default(busy_thread):
+    report = await SamplingProfiler(interval=0.002).profile(0.05)
+    assert report["stack_samples"] == report["samples"]
+    assert "_spin" not in report["collapsed"]
+
+
+async def test_the_sampler_stops_and_one_profile_runs_at_a_time():
+    profiler = SamplingProfiler(interval=0.002, max_seconds=1.0)
+    running = asyncio.create_task(profiler.profile(0.1))
+    await asyncio.sleep(0.02)
+    assert profiler.running
+    assert len(_sampling_threads()) == 1
+    with pytest.raises(ProfilerBusyError):
+        await profiler.profile(0.1)
+
+    await running
+    # The sampling loop returned: no thread is left walking stacks
+    assert _sampling_threads() == []
+    assert profiler.stats()["running"] is False
+    assert profiler.stats()["profiles_taken"] == 1
+
+    with pytest.raises(ValueError):
+        await profiler.profile(2.0)
+    assert not profiler.running
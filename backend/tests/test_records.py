@@ -0,0 +1,76 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from records import Achievement, AchievementStatus, ReferralLink, User, dump_json
+
+
+def _user(**fields) -> User:
+    values = {
+        "id": "u1", "first_name": "Ana", "last_name": "Souza", "email": "ana@x.com",
+        "password_hash": "$2b$12$secret", "referral_code": "ABC123", "created_at": "2024-01-01T00:00:00",
+        "referrer_id": "u0",
+    }
+    values.update(fields)
+    return User(**values)
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def test_from_tuple_is_the_inverse_of_astuple():
+    user = _user(total_referrals=3, achievements=["first"])
+
+    assert User.from_tuple(user.astuple()) == user
+    with pytest.raises(ValueError):
+        User.from_tuple(user.astuple()[:-1])
+
+
+def test_private_fields_never_leave_the_record():
+    user = _user()
+
+    assert "password_hash" not in dict(user)
+    assert "referrer_id" not in dict(user)
+    assert b"secret" not in dump_json(user)
+    assert b"u0" not in dump_json(user)
+    # Still reachable by the code that needs them
+    assert user["referrer_id"] == "u0"
+    assert user.to_dict(private=True)["password_hash"] == "$2b$12$secret"
+
+
+@pytest.mark.parametrize("value", [
+    None, True, False, 0, -7, 2 ** 70, 1.5, -0.0, 1e-300, "", "plain", "aspas \" e \\ barra",
+    "acentuação ✓ \n\t  \x00", [], {}, [1, [2, [3]]], {"a": {"b": [None, 1.25]}}, {1: "int key"},
+])
+def test_dump_json_matches_json_dumps(value):
+    assert dump_json(value) == _dumps(value)
+
+
+def test_dump_json_of_records_matches_their_public_dicts():
+    user = _user(achievements=["first_referral"], total_earnings=12.5)
+    link = ReferralLink(id="r1", user_id="u1", user_name="Ana Souza", link_code="abc",
+                        full_url="http://x/?ref=abc", created_at="2024-01-01T00:00:00")
+    achievement = Achievement(id="a1", title="Primeira", description="Uma indicação", icon="🎉",
+                              target_value=1, reward_amount=10.0, category="referrals")
+    status = AchievementStatus(achievement=achievement, is_unlocked=True, progress=100.0)
+
+    assert dump_json(user) == _dumps(user.to_dict())
+    assert dump_json([link, link]) == _dumps([link.to_dict()] * 2)
+    assert dump_json({"items": [status]}) == _dumps(
+        {"items": [{**achievement.to_dict(), "is_unlocked": True, "progress": 100.0}]}
+    )
+
+
+def test_dump_json_converts_what_json_dumps_cannot():
+    moment = datetime(2024, 5, 1, 12, 30)
+
+    assert dump_json({"at": moment, "amount": Decimal("10.50")}) == _dumps(
+        {"at": moment.isoformat(), "amount": 10.5}
+    )
+    with pytest.raises(ValueError):
+        dump_json(float("nan"))
+    with pytest.raises(TypeError):
+        dump_json(object())
@@ -0,0 +1,71 @@
+import pytest
+
+from referral_codes import CodeSpaceExhaustedError, ReferralCodeAllocator
+from storage import MemoryStorage
+
+
+def test_permutation_is_a_bijection_of_the_code_space():
+    allocator = ReferralCodeAllocator(MemoryStorage(), length=3, alphabet="ABCDE")
+
+    values = [allocator.permute(counter) for counter in range(allocator.capacity)]
+
+    assert sorted(values) == list(range(allocator.capacity))
+    codes = {allocator.encode(value) for value in values}
+    assert len(codes) == allocator.capacity
+    assert all(len(code) == 3 and set(code) <= set("ABCDE") for code in codes)
+
+
+def test_permutation_depends_on_the_key():
+    first = ReferralCodeAllocator(MemoryStorage(), key="one")
+    second = ReferralCodeAllocator(MemoryStorage(), key="two")
+
+    assert [first.permute(i) for i in range(20)] != [second.permute(i) for i in range(20)]
+
+
+def test_invalid_configuration_is_rejected():
+    with pytest.raises(ValueError):
+        ReferralCodeAllocator(MemoryStorage(), length=0)
+    with pytest.raises(ValueError):
+        ReferralCodeAllocator(MemoryStorage(), alphabet="AA")
+
+
+@pytest.mark.anyio
+async def test_allocation_stops_when_the_space_is_used_up():
+    allocator = ReferralCodeAllocator(MemoryStorage(), length=2, alphabet="AB", block_size=1)
+
+    codes = await allocator.allocate_many(4)
+
+    assert sorted(codes) == ["AA", "AB", "BA", "BB"]
+    with pytest.raises(CodeSpaceExhaustedError):
+        await allocator.allocate()
+
+
+@pytest.mark.anyio
+async def test_codes_already_in_use_are_skipped():
+    storage = MemoryStorage()
+    probe = ReferralCodeAllocator(storage)
+    clash = probe.encode(probe.permute(0))
+    await storage.insert_users([{
+        "id": "legacy", "first_name": "Old", "last_name": "User", "email": "old@x.com",
+        "password_hash": "x", "referral_code": clash,
+    }])
+
+    allocator = ReferralCodeAllocator(storage)
+    codes = await allocator.allocate_many(5)
+
+    assert clash not in codes
+    assert len(set(codes)) == 5
+    assert allocator.stats()["skipped_taken"] == 1
+
+
+@pytest.mark.anyio
+async def test_allocators_sharing_a_storage_never_hand_out_the_same_code(storage):
+    first = ReferralCodeAllocator(storage, block_size=10)
+    second = ReferralCodeAllocator(storage, block_size=10)
+
+    codes = []
+    for _ in range(5):
+        codes += await first.allocate_many(7)
+        codes += await second.allocate_many(7)
+
+    assert len(set(codes)) == len(codes) == 70
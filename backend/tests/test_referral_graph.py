@@ -0,0 +1,175 @@
+import random
+
+import pytest
+
+from referral_graph import ReferralGraph
+from storage import MemoryStorage
+
+from .test_storage import make_user
+
+pytestmark = pytest.mark.anyio
+
+
+def _tree(size: int, seed: int = 0):
+    """(user_id, referrer_id, earnings) rows, every referrer listed before its referrals"""
+    rng = random.Random(seed)
+    rows = []
+    for n in range(size):
+        referrer = f"u{rng.randrange(n)}" if n and rng.random() < 0.9 else None
+        rows.append((f"u{n}", referrer, float(rng.randrange(100))))
+    return rows
+
+
+def _expected(rows, user_id, tiers):
+    """Network of ``user_id`` counted the slow way, from the rows alone"""
+    children = {}
+    for child, referrer, _ in rows:
+        children.setdefault(referrer, []).append(child)
+    earnings = {child: amount for child, _, amount in rows}
+    size, total, height, counts = 0, 0.0, 0, [0] * tiers
+    level, frontier = 1, children.get(user_id, [])
+    while frontier:
+        size += len(frontier)
+        total += sum(earnings[child] for child in frontier)
+        height = level
+        if level <= tiers:
+            counts[level - 1] = len(frontier)
+        frontier = [grandchild for child in frontier for grandchild in children.get(child, [])]
+        level += 1
+    return size, round(total, 2), height, counts
+
+
+def _summary(graph: ReferralGraph, user_id: str):
+    network = graph.network(user_id)
+    return (network["network_size"], network["network_earnings"], network["network_depth"],
+            [tier["users"] for tier in network["tiers"]])
+
+
+def test_adding_users_updates_every_ancestor():
+    graph = ReferralGraph(tiers=3)
+    graph.add("root")
+    graph.add("a", "root", 10.0)
+    graph.add("b", "a", 5.0)
+    graph.add("c", "b", 2.5)
+    graph.add("d", "c", 1.0)
+    graph.add("e", "root", 7.0)
+
+    assert _summary(graph, "root") == (5, 25.5, 4, [2, 1, 1])
+    assert _summary(graph, "a") == (3, 8.5, 3, [1, 1, 1])
+    assert _summary(graph, "d") == (0, 0.0, 0, [0, 0, 0])
+    assert graph.network("d")["level"] == 4
+    assert graph.upline("d") == ["c", "b", "a", "root"]
+    assert graph.upline("d", levels=2) == ["c", "b"]
+    assert graph.direct_referrals("root") == [("a", 3), ("e", 0)]
+    assert graph.stats()["max_depth"] == 4
+
+    # Adding the same user again changes nothing
+    graph.add("b", "e", 100.0)
+    assert _summary(graph, "root") == (5, 25.5, 4, [2, 1, 1])
+
+
+def test_earnings_changes_reach_every_ancestor():
+    graph = ReferralGraph()
+    for user_id, referrer_id in (("root", None), ("a", "root"), ("b", "a")):
+        graph.add(user_id, referrer_id)
+
+    graph.add_earnings("b", 15.0)
+    graph.add_earnings("a", 5.0)
+    assert (graph.network("root")["network_earnings"], graph.network("a")["network_earnings"]) == (20.0, 15.0)
+
+    # Absolute values read back from storage can be applied more than once
+    graph.set_earnings("b", 40.0)
+    graph.set_earnings("b", 40.0)
+    assert (graph.network("root")["network_earnings"], graph.network("a")["network_earnings"]) == (45.0, 40.0)
+    # A user's own earnings are not part of their network
+    assert graph.network("b")["network_earnings"] == 0.0
+    graph.add_earnings("missing", 1.0)
+    graph.set_earnings("missing", 1.0)
+    assert "missing" not in graph
+
+
+def test_incremental_updates_match_the_slow_count():
+    rows = _tree(300, seed=1)
+    graph = ReferralGraph(tiers=4)
+    for user_id, referrer_id, earnings in rows:
+        graph.add(user_id, referrer_id, earnings)
+
+    for user_id, _, _ in rows:
+        assert _summary(graph, user_id) == _expected(rows, user_id, 4), user_id
+
+
+def test_rebuild_agrees_with_incremental_updates():
+    rows = _tree(500, seed=2)
+    incremental = ReferralGraph(tiers=4)
+    for user_id, referrer_id, earnings in rows:
+        incremental.add(user_id, referrer_id, earnings)
+    rng = random.Random(3)
+    raises = [(f"u{rng.randrange(len(rows))}", float(rng.randrange(1, 50))) for _ in range(200)]
+    for user_id, delta in raises:
+        incremental.add_earnings(user_id, delta)
+
+    # The same users with their final earnings, in an order where referrals come before referrers
+    final = {user_id: earnings for user_id, _, earnings in rows}
+    for user_id, delta in raises:
+        final[user_id] += delta
+    rebuilt = ReferralGraph(tiers=4)
+    rebuilt.rebuild([(user_id, referrer_id, final[user_id]) for user_id, referrer_id, _ in reversed(rows)])
+
+    for user_id, _, _ in rows:
+        assert rebuilt.network(user_id) == incremental.network(user_id), user_id
+        assert rebuilt.upline(user_id) == incremental.upline(user_id)
+    for key in ("users", "roots", "max_depth", "orphans"):
+        assert rebuilt.stats()[key] == incremental.stats()[key], key
+    assert rebuilt.stats()["rebuilds"] == 1
+
+
+def test_unknown_referrers_make_orphan_roots():
+    graph = ReferralGraph()
+    graph.rebuild([("b", "gone", 0.0), ("c", "b", 1.0), ("d", "d", 0.0)])
+
+    # A missing referrer or someone referring themselves: the user is a root
+    assert graph.network("b")["referrer_id"] is None
+    assert graph.network("d")["referrer_id"] is None
+    assert _summary(graph, "b") == (1, 1.0, 1, [1, 0, 0, 0, 0])
+    assert (graph.stats()["roots"], graph.stats()["orphans"]) == (2, 2)
+
+
+def test_rebuild_breaks_cycles():
+    graph = ReferralGraph(tiers=3)
+    # a -> b -> c -> a, with d hanging off c, and a separate healthy tree
+    graph.rebuild([
+        ("a", "c", 1.0), ("b", "a", 2.0), ("c", "b", 4.0), ("d", "c", 8.0),
+        ("root", None, 0.0), ("x", "root", 16.0),
+    ])
+
+    stats = graph.stats()
+    assert stats["cycles_broken"] == 1
+    assert stats["users"] == 6 and stats["roots"] == 2
+    # The cycle is cut at one user, which becomes a root and keeps everyone else below it
+    cut = [user_id for user_id in "abc" if graph.network(user_id)["referrer_id"] is None]
+    assert len(cut) == 1
+    own = {"a": 1.0, "b": 2.0, "c": 4.0}[cut[0]]
+    assert (graph.network(cut[0])["network_size"], graph.network(cut[0])["network_earnings"]) == (3, 15.0 - own)
+    # Every user is reachable and no upline loops
+    for user_id in "abcd":
+        upline = graph.upline(user_id)
+        assert len(upline) == len(set(upline)) and user_id not in upline
+        assert graph.network(user_id)["level"] == len(upline)
+    assert _summary(graph, "root") == (1, 16.0, 1, [1, 0, 0])
+
+    # A rebuild without the cycle starts the counter over
+    graph.rebuild([("a", None, 0.0)])
+    assert graph.stats()["cycles_broken"] == 0
+
+
+async def test_rebuild_from_storage_reads_referrers_and_earnings():
+    storage = MemoryStorage()
+    parent = make_user("parent@example.com", total_earnings=5.0)
+    child = make_user("child@example.com", referrer_id=parent["id"], total_earnings=12.5)
+    for user in (parent, child):
+        await storage.insert_user(user)
+
+    graph = ReferralGraph()
+    await graph.rebuild_from(storage, batch_size=1)
+    assert graph.upline(child["id"]) == [parent["id"]]
+    assert graph.network(parent["id"])["network_earnings"] == 12.5
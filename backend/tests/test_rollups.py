@@ -0,0 +1,216 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from click_dedup import ClickDeduplicator
+from click_pipeline import SQLiteClickSink
+from records import Click
+from rollups import RollupEngine, RollupSync
+from storage import MemoryStorage
+
+NOW = datetime(2026, 3, 10, 15, 30)
+
+
+def test_range_sums_mix_hourly_and_daily_buckets():
+    engine = RollupEngine()
+    engine.record_click("link", "owner", datetime(2026, 3, 8, 23, 10))
+    engine.record_click("link", "owner", datetime(2026, 3, 9, 12, 0), count=3)
+    engine.record_conversion("link", "owner", datetime(2026, 3, 10, 1, 0))
+    engine.record_click("link", "owner", datetime(2026, 3, 10, 2, 0))
+
+    assert engine.link_totals("link", datetime(2026, 3, 8, 23), datetime(2026, 3, 10, 2)) == (4, 1)
+    assert engine.user_totals("owner", datetime(2026, 3, 9), datetime(2026, 3, 10)) == (3, 0)
+    assert engine.user_totals("owner", datetime(2026, 3, 10, 2), datetime(2026, 3, 10, 1)) == (0, 0)
+    assert [row["clicks"] for row in engine.daily_series("owner", date(2026, 3, 8), date(2026, 3, 10))] == [1, 3, 1]
+
+
+def test_top_links_ranking():
+    engine = RollupEngine()
+    for _ in range(3):
+        engine.record_click("a", "owner", NOW)
+    engine.record_click("b", "owner", NOW)
+    engine.record_conversion("b", "owner", NOW)
+
+    start, end = NOW - timedelta(days=1), NOW + timedelta(days=1)
+    assert engine.top_links(["a", "b", "c"], start, end, limit=2) == [("a", 3, 0), ("b", 1, 1)]
+    assert engine.top_links(["a", "b"], start, end, rank_by="conversions")[0] == ("b", 1, 1)
+
+
+def test_prune_keeps_daily_buckets():
+    engine = RollupEngine(hourly_retention_hours=24)
+    engine.record_click("link", "owner", NOW - timedelta(days=3))
+    engine.prune(now=NOW)
+
+    clicked = NOW - timedelta(days=3)
+    assert engine.daily_series("owner", clicked.date(), clicked.date())[0]["clicks"] == 1
+    assert engine.hourly_series("owner", clicked, clicked + timedelta(hours=1))[0]["clicks"] == 0
+
+
+@pytest.fixture
+async def links():
+    storage = MemoryStorage()
+    owner = {"id": "owner", "first_name": "A", "last_name": "B", "email": "a@b.com",
+             "password_hash": "x", "referral_code": "AAAA", "created_at": NOW}
+    await storage.insert_user(owner)
+    for code in ("L1", "L2"):
+        await storage.insert_referral({"id": "id-" + code, "user_id": "owner", "user_name": "F",
+                                       "link_code": code, "full_url": "", "created_at": NOW})
+    return storage
+
+
+def click(code, at, completed=False):
+    return Click(link_code=code, ip_address=None, user_agent=None, clicked_at=at, completed_registration=completed)
+
+
+def day_range():
+    return NOW - timedelta(days=1), NOW + timedelta(days=1)
+
+
+@pytest.mark.anyio
+async def test_rollups_survive_a_restart(links, tmp_path):
+    path = str(tmp_path / "clicks.db")
+    sink = SQLiteClickSink(path)
+    await sink.write_batch([click("L1", NOW)] * 3 + [click("L2", NOW), click("L1", NOW, completed=True)])
+    await sink.close()
+
+    # A fresh process: nothing in memory, everything comes from the click table
+    for settle_ids in (0, 2, 1000):
+        sink = SQLiteClickSink(path)
+        engine = RollupEngine()
+        sync = RollupSync(engine, sink, links, settle_ids=settle_ids)
+        await sync.load()
+        assert engine.link_totals("id-L1", *day_range()) == (3, 1)
+        assert engine.user_totals("owner", *day_range()) == (4, 1)
+        await sink.close()
+
+
+@pytest.mark.anyio
+async def test_refresh_tails_clicks_from_other_writers(links, tmp_path):
+    path = str(tmp_path / "clicks.db")
+    sink = SQLiteClickSink(path)
+    engine = RollupEngine()
+    sync = RollupSync(engine, sink, links, batch_size=2)
+    await sync.load()
+
+    # Another worker writing to the same file
+    other = SQLiteClickSink(path)
+    await other.write_batch([click("L2", NOW)] * 5 + [click("unknown", NOW)])
+    await sync.refresh()
+    await sync.refresh()
+
+    assert engine.link_totals("id-L2", *day_range()) == (5, 0)
+    assert sync.stats()["tailed_rows"] == 6
+    assert sync.unknown_links == 1
+    await other.close()
+    await sink.close()
+
+
+@pytest.mark.anyio
+async def test_late_rows_below_the_cursor_are_filled_in(links, tmp_path):
+    path = str(tmp_path / "clicks.db")
+    sink = SQLiteClickSink(path)
+    engine = RollupEngine()
+    sync = RollupSync(engine, sink, links)
+    await sync.load()
+
+    # Id 2 becomes visible after id 3 (a slower concurrent insert)
+    conn = sqlite3.connect(path)
+    insert = "INSERT INTO referral_clicks (id, link_code, clicked_at) VALUES (?, ?, ?)"
+    with conn:
+        conn.execute(insert, (1, "L1", NOW.isoformat()))
+        conn.execute(insert, (3, "L1", NOW.isoformat()))
+    await sync.refresh()
+    assert engine.link_totals("id-L1", *day_range()) == (2, 0)
+    assert sync.stats()["pending_gaps"] == 1
+
+    with conn:
+        conn.execute(insert, (2, "L1", NOW.isoformat()))
+    await sync.refresh()
+    assert engine.link_totals("id-L1", *day_range()) == (3, 0)
+    assert sync.stats()["pending_gaps"] == 0
+    assert sync.gaps_filled == 1
+    conn.close()
+    await sink.close()
+
+
+@pytest.mark.anyio
+async def test_gaps_are_given_up_after_the_grace_period(links, tmp_path):
+    sink = SQLiteClickSink(str(tmp_path / "clicks.db"))
+    sync = RollupSync(RollupEngine(), sink, links, gap_grace=0.0)
+    sync._gaps[7] = 0.0
+    await sync.refresh()
+    assert sync.gaps_dropped == 1
+    assert sync.stats()["pending_gaps"] == 0
+    await sink.close()
+
+
+def visit(ip, at, duplicate=False):
+    return Click(link_code="L1", ip_address=ip, user_agent="ua", clicked_at=at, duplicate=duplicate)
+
+
+@pytest.mark.anyio
+async def test_click_counts_come_from_the_stored_verdicts(links, tmp_path):
+    path = str(tmp_path / "clicks.db")
+    sink = SQLiteClickSink(path)
+    recent = datetime.utcnow()
+    await sink.write_batch([visit("1.1.1.1", NOW)] + [visit("1.1.1.1", NOW, duplicate=True)] * 2
+                           + [visit("2.2.2.2", recent), visit("2.2.2.2", recent, duplicate=True)])
+
+    dedup = ClickDeduplicator(window=1800)
+    sync = RollupSync(RollupEngine(), sink, links, settle_ids=2, batch_size=2, dedup=dedup)
+    await sync.load()
+    assert dedup.link_stats("id-L1", registrations=1) == {
+        "raw_clicks": 5, "unique_clicks": 2, "duplicate_clicks": 3, "conversion_rate": 50.0,
+    }
+    # The recent visitor is in the filter again, the old one fell out of the window
+    assert dedup.check("id-L1", "2.2.2.2", "ua")
+    assert not dedup.check("id-L1", "1.1.1.1", "ua")
+
+    # Clicks taken by another worker are tailed in as well, verdict included
+    other = SQLiteClickSink(path)
+    await other.write_batch([visit("3.3.3.3", recent), visit("3.3.3.3", recent, duplicate=True)])
+    await sync.refresh()
+    stats = dedup.link_stats("id-L1")
+    assert (stats["raw_clicks"], stats["unique_clicks"], stats["duplicate_clicks"]) == (7, 3, 4)
+
+    # A reload starts over from the table instead of counting twice
+    await sync.load()
+    assert (dedup.raw_clicks, dedup.duplicate_clicks) == (7, 4)
+    await other.close()
+    await sink.close()
+
+
+@pytest.mark.anyio
+async def test_a_restart_reads_saved_sketches_instead_of_every_click(links, tmp_path):
+    path = str(tmp_path / "clicks.db")
+    sink = SQLiteClickSink(path)
+    # Old traffic, outside the duplicate window
+    await sink.write_batch([visit(f"10.0.{n // 250}.{n % 250}", NOW) for n in range(1000)])
+
+    dedup = ClickDeduplicator(window=1800)
+    sync = RollupSync(RollupEngine(), sink, links, interval=60, settle_ids=0, dedup=dedup)
+    await sync.load()
+    sync.start()
+    # No checkpoint yet: the first start reads every click once, then saves the sketch
+    assert sync.replayed_rows == 1000
+    assert sync.sketches_saved == 1
+    assert abs(dedup.unique_clicks("id-L1") - 1000) <= 100
+
+    await sink.write_batch([visit("1.1.1.1", NOW), visit("2.2.2.2", datetime.utcnow())])
+    await sync.refresh()
+    # Stopping saves what changed since
+    await sync.stop()
+    assert sync.sketches_saved == 2
+    await sink.close()
+
+    sink = SQLiteClickSink(path)
+    restarted = ClickDeduplicator(window=1800)
+    sync = RollupSync(RollupEngine(), sink, links, settle_ids=0, dedup=restarted)
+    await sync.load()
+    # Only the click in the window is read again (for the filter), the rest comes from the sketch and the counts
+    assert sync.replayed_rows == 1
+    assert restarted.raw_clicks == 1002
+    assert restarted.unique_clicks("id-L1") == dedup.unique_clicks("id-L1")
+    assert restarted.check("id-L1", "2.2.2.2", "ua")
+    await sink.close()
@@ -0,0 +1,315 @@
+"""Behaviour every storage backend has to share (memory, sqlite, postgres)"""
+import uuid
+from datetime import datetime
+
+import pytest
+
+from leaderboard import Leaderboard
+from referral_store import ReferralStore
+from user_store import DuplicateKeyError, UserStore
+
+pytestmark = pytest.mark.anyio
+
+
+def make_user(email, code=None, **fields):
+    user = {
+        "id": str(uuid.uuid4()),
+        "first_name": "Test",
+        "last_name": "User",
+        "email": email,
+        "password_hash": "hash",
+        "referral_code": code or uuid.uuid4().hex[:8].upper(),
+        "total_referrals": 0,
+        "total_earnings": 0.0,
+        "achievements": [],
+        "created_at": datetime(2026, 1, 1, 12, 0),
+        "referrer_id": None,
+    }
+    user.update(fields)
+    return user
+
+
+def make_referral(user_id, link_code):
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "user_name": "Friend",
+        "link_code": link_code,
+        "full_url": f"http://localhost:8080/register?ref={link_code}",
+        "click_count": 0,
+        "registration_count": 0,
+        "created_at": datetime(2026, 1, 1, 12, 0),
+    }
+
+
+async def test_user_lookups(storage):
+    user = make_user("Ana@Example.com", code="ANA00001")
+    await storage.insert_user(user)
+
+    assert (await storage.get_user(user["id"]))["email"] == "Ana@Example.com"
+    assert (await storage.get_user_by_email("ana@example.com"))["id"] == user["id"]
+    assert (await storage.get_user_by_referral_code("ANA00001"))["id"] == user["id"]
+    assert await storage.email_exists("ANA@EXAMPLE.COM")
+    assert not await storage.email_exists("other@example.com")
+    assert await storage.get_user("missing") is None
+
+
+async def test_duplicate_email_is_rejected(storage):
+    await storage.insert_user(make_user("dup@example.com"))
+    with pytest.raises(DuplicateKeyError):
+        await storage.insert_user(make_user("DUP@example.com"))
+    assert await storage.count_users() == 1
+
+
+async def test_counters_feed_totals_and_leaderboard(storage):
+    first = make_user("first@example.com")
+    second = make_user("second@example.com")
+    await storage.insert_user(first)
+    await storage.insert_user(second)
+
+    await storage.increment_user(second["id"], total_referrals=2, total_earnings=100.0)
+    await storage.increment_user(first["id"], total_referrals=1, total_earnings=50.0)
+
+    assert [user["id"] for user in await storage.leaderboard(limit=10)] == [second["id"], first["id"]]
+    assert await storage.user_rank(first["id"]) == 2
+    totals = await storage.system_totals()
+    assert totals["total_users"] == 2
+    assert totals["total_referrals"] == 3
+    assert totals["total_earnings"] == 150.0
+
+
+async def test_referral_counters(storage):
+    owner = make_user("owner@example.com")
+    await storage.insert_user(owner)
+    link = make_referral(owner["id"], "OWNER-1")
+    await storage.insert_referral(link)
+
+    await storage.increment_referral(link["id"], click_count=3)
+    await storage.increment_referral(link["id"], registration_count=1)
+
+    stored = await storage.get_referral_by_link_code("OWNER-1")
+    assert (stored["click_count"], stored["registration_count"]) == (3, 1)
+    assert [ref["link_code"] for ref in await storage.list_referrals(owner["id"])] == ["OWNER-1"]
+    totals = await storage.system_totals()
+    assert (totals["total_links"], totals["total_clicks"], totals["total_registrations"]) == (1, 3, 1)
+
+
+async def test_reconcile_finds_no_drift(storage):
+    user = make_user("drift@example.com")
+    await storage.insert_user(user)
+    await storage.increment_user(user["id"], total_referrals=1, total_earnings=50.0)
+
+    result = await storage.reconcile_totals()
+    assert not any(result["drift"].values())
+
+
+async def test_versions_go_up_on_mutations(storage):
+    before = await storage.resource_versions()
+    user = make_user("versions@example.com")
+    await storage.insert_user(user)
+    after_insert = await storage.resource_versions()
+    assert after_insert["leaderboard"] > before["leaderboard"]
+    assert after_insert["stats"] > before["stats"]
+
+    await storage.update_user(user["id"], first_name="Renamed")
+    after_rename = await storage.resource_versions()
+    assert after_rename["leaderboard"] > after_insert["leaderboard"]
+    assert (await storage.get_user(user["id"]))["version"] > 0
+
+
+async def test_achievements_are_added_once(storage):
+    user = make_user("badges@example.com")
+    await storage.insert_user(user)
+
+    assert await storage.add_achievement(user["id"], "first_referral")
+    assert not await storage.add_achievement(user["id"], "first_referral")
+    assert (await storage.get_user(user["id"]))["achievements"] == ["first_referral"]
+
+
+async def test_clear_empties_everything(storage):
+    user = make_user("clear@example.com")
+    await storage.insert_user(user)
+    await storage.insert_referral(make_referral(user["id"], "CLEAR-1"))
+
+    await storage.clear()
+
+    assert await storage.count_users() == 0
+    assert await storage.count_referrals() == 0
+    assert not any((await storage.system_totals()).values())
+
+
+def test_user_store_email_index_is_case_normalized():
+    users = UserStore()
+    user = users.insert(make_user("  Ana@Example.COM ", code="ANA00001"))
+
+    assert users.get_by_email("ana@example.com") is user
+    assert users.get_by_email("ANA@EXAMPLE.COM ") is user
+    assert users.email_exists("Ana@example.com")
+    assert users.get_by_referral_code("ANA00001") is user
+    # Referral codes are matched as given
+    assert users.get_by_referral_code("ana00001") is None
+    with pytest.raises(DuplicateKeyError) as excinfo:
+        users.insert(make_user("ana@EXAMPLE.com"))
+    assert excinfo.value.field == "email"
+    assert len(users) == 1
+
+
+def test_user_store_reindexes_changed_keys():
+    users = UserStore()
+    user = users.insert(make_user("old@example.com", code="OLD00001"))
+    other = users.insert(make_user("other@example.com", code="OTHER001"))
+
+    users.update(user["id"], email="New@Example.com", referral_code="NEW00001")
+    assert users.get_by_email("new@example.com") is user
+    assert users.get_by_referral_code("NEW00001") is user
+    assert not users.email_exists("old@example.com")
+    assert not users.referral_code_exists("OLD00001")
+
+    # A taken key fails without touching the indexes or the record
+    with pytest.raises(DuplicateKeyError):
+        users.update(user["id"], email="new@example.com", referral_code="OTHER001")
+    assert users.get_by_referral_code("OTHER001") is other
+    assert users.get_by_referral_code("NEW00001") is user
+    assert user["email"] == "New@Example.com"
+
+    # Clearing the code drops it from the index, the old code is free again
+    users.update(user["id"], referral_code=None)
+    assert not users.referral_code_exists("NEW00001")
+    users.update(other["id"], referral_code="NEW00001")
+    assert users.get_by_referral_code("NEW00001") is other
+
+
+def test_user_store_delete_frees_its_keys():
+    users = UserStore()
+    user = users.insert(make_user("gone@example.com", code="GONE0001"))
+
+    assert users.delete(user["id"]) is user
+    assert users.delete(user["id"]) is None
+    assert users.get_by_email("gone@example.com") is None
+    assert users.get_by_referral_code("GONE0001") is None
+    assert len(users) == 0
+    # Both keys can be taken by a new user
+    assert users.insert(make_user("GONE@example.com", code="GONE0001"))["email"] == "GONE@example.com"
+
+
+async def test_storage_email_lookup_follows_updates(storage):
+    user = make_user("before@example.com", code="BEFORE01")
+    await storage.insert_user(user)
+
+    await storage.update_user(user["id"], email="After@Example.com")
+    assert (await storage.get_user_by_email("after@example.com"))["id"] == user["id"]
+    assert await storage.get_user_by_email("before@example.com") is None
+    assert not await storage.email_exists("BEFORE@example.com")
+
+
+def test_referral_store_link_code_and_owner_indexes():
+    referrals = ReferralStore()
+    first = referrals.insert(make_referral("owner", "LINK-1"))
+    second = referrals.insert(make_referral("owner", "LINK-2"))
+    other = referrals.insert(make_referral("other", "LINK-3"))
+
+    assert referrals.get_by_link_code("LINK-2") is second
+    assert referrals.get_by_link_code("missing") is None
+    # Owner listings come back in creation order and honour the limit
+    assert referrals.list_by_owner("owner") == [first, second]
+    assert referrals.list_by_owner("owner", limit=1) == [first]
+    assert referrals.list_by_owner("nobody") == []
+    assert (referrals.count_by_owner("owner"), referrals.count_by_owner("other")) == (2, 1)
+
+    with pytest.raises(DuplicateKeyError) as excinfo:
+        referrals.insert(make_referral("other", "LINK-1"))
+    assert excinfo.value.field == "link_code"
+    assert referrals.list_by_owner("other") == [other]
+
+
+def test_referral_store_deletes_update_both_indexes():
+    referrals = ReferralStore()
+    first = referrals.insert(make_referral("owner", "LINK-1"))
+    second = referrals.insert(make_referral("owner", "LINK-2"))
+    referrals.insert(make_referral("other", "LINK-3"))
+
+    assert referrals.delete(first["id"]) is first
+    assert referrals.get_by_link_code("LINK-1") is None
+    assert referrals.list_by_owner("owner") == [second]
+
+    assert referrals.delete_by_owner("owner") == 1
+    assert referrals.list_by_owner("owner") == []
+    assert referrals.count_by_owner("owner") == 0
+    assert len(referrals) == 1
+    # The freed code can be used again
+    assert referrals.insert(make_referral("other", "LINK-1"))["link_code"] == "LINK-1"
+
+
+async def test_storage_lists_links_by_owner(storage):
+    owner = make_user("links@example.com")
+    other = make_user("other-links@example.com")
+    await storage.insert_user(owner)
+    await storage.insert_user(other)
+    for minute, link_code in enumerate(("OWN-1", "OWN-2", "OWN-3")):
+        link = make_referral(owner["id"], link_code)
+        link["created_at"] = datetime(2026, 1, 1, 12, minute)
+        await storage.insert_referral(link)
+    await storage.insert_referral(make_referral(other["id"], "OTHER-1"))
+
+    assert [ref["link_code"] for ref in await storage.list_referrals(owner["id"])] == ["OWN-1", "OWN-2", "OWN-3"]
+    assert len(await storage.list_referrals(owner["id"], limit=2)) == 2
+    assert [ref["link_code"] for ref in await storage.list_referrals(other["id"])] == ["OTHER-1"]
+    assert (await storage.get_referral_by_link_code("OWN-2"))["user_id"] == owner["id"]
+    assert await storage.get_referral_by_link_code("NOPE") is None
+
+
+def test_leaderboard_breaks_ties_on_earnings_then_id():
+    board = Leaderboard()
+    board.upsert({"id": "b", "total_referrals": 2, "total_earnings": 10.0})
+    board.upsert({"id": "a", "total_referrals": 2, "total_earnings": 10.0})
+    board.upsert({"id": "c", "total_referrals": 2, "total_earnings": 30.0})
+    board.upsert({"id": "d", "total_referrals": 5, "total_earnings": 0.0})
+
+    assert list(board.ids()) == ["d", "c", "a", "b"]
+    assert [board.rank(user_id) for user_id in "abcd"] == [3, 4, 2, 1]
+    assert board.rank("missing") is None
+
+    # Re-ranking moves the user, it is never listed twice
+    board.upsert({"id": "b", "total_referrals": 6, "total_earnings": 10.0})
+    assert list(board.ids()) == ["b", "d", "c", "a"]
+    assert len(board) == 4
+    board.remove("d")
+    assert (board.page(0, 10), board.rank("c")) == (["b", "c", "a"], 2)
+
+
+def test_leaderboard_pages():
+    board = Leaderboard()
+    for n in range(7):
+        board.upsert({"id": f"u{n}", "total_referrals": n, "total_earnings": 0.0})
+
+    assert board.page(0, 3) == ["u6", "u5", "u4"]
+    assert board.page(3, 3) == ["u3", "u2", "u1"]
+    assert board.page(6, 3) == ["u0"]
+    assert board.page(10, 3) == []
+
+
+async def test_storage_leaderboard_ranks_pages_and_follows_increments(storage):
+    users = [make_user(f"rank{n}@example.com") for n in range(5)]
+    for user in users:
+        await storage.insert_user(user)
+    # Equal referrals: more earnings ranks first; then tie on both
+    await storage.increment_user(users[0]["id"], total_referrals=2, total_earnings=20.0)
+    await storage.increment_user(users[1]["id"], total_referrals=2, total_earnings=40.0)
+    await storage.increment_user(users[2]["id"], total_referrals=1, total_earnings=5.0)
+    await storage.increment_user(users[3]["id"], total_referrals=1, total_earnings=5.0)
+    tied = sorted([users[2]["id"], users[3]["id"]])
+
+    ranked = [user["id"] for user in await storage.leaderboard(limit=10)]
+    assert ranked == [users[1]["id"], users[0]["id"], *tied, users[4]["id"]]
+    assert await storage.count_users() == 5
+
+    # Paging walks the same order without gaps or repeats
+    pages = [user["id"] for offset in (0, 2, 4) for user in await storage.leaderboard(limit=2, offset=offset)]
+    assert pages == ranked
+    assert await storage.leaderboard(limit=2, offset=5) == []
+
+    # The last user overtakes everyone after an increment
+    await storage.increment_user(users[4]["id"], total_referrals=3)
+    assert (await storage.leaderboard(limit=1))[0]["id"] == users[4]["id"]
+    assert await storage.user_rank(users[4]["id"]) == 1
+    assert await storage.user_rank(users[1]["id"]) == 2
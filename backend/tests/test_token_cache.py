@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from token_cache import TokenCache
+
+from .test_persistence import crash, open_storage
+
+
+def test_cached_tokens_expire_with_the_jwt():
+    cache = TokenCache(max_size=10)
+    cache.put("live", "user-1", time.time() + 60)
+    cache.put("stale", "user-2", time.time() - 1)
+
+    assert cache.get("live") == "user-1"
+    assert cache.get("stale") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_lru_evicts_verifications_beyond_max_size():
+    cache = TokenCache(max_size=2)
+    for token in ("a", "b", "c"):
+        cache.put(token, token, time.time() + 60)
+
+    assert cache.get("a") is None
+    assert cache.get("c") == "c"
+    assert cache.evicted == 1
+
+
+def test_revocations_are_not_evicted_for_space():
+    cache = TokenCache(max_size=2)
+    exp = time.time() + 60
+    for i in range(10):
+        cache.invalidate(f"token-{i}", exp)
+
+    # Far more logouts than max_size: the first one must still be refused
+    assert cache.is_revoked("token-0")
+    cache.put("token-0", "user", exp)
+    assert cache.get("token-0") is None
+    assert cache.stats()["revoked"] == 10
+
+
+def test_revocations_are_forgotten_once_the_token_expires():
+    cache = TokenCache()
+    cache.invalidate("expired", time.time() - 1)
+    cache.invalidate("live", time.time() + 60)
+
+    assert not cache.is_revoked("expired")
+    assert cache.is_revoked("live")
+    assert cache.stats()["revoked"] == 1
+
+
+def test_later_expiry_wins_for_the_same_token():
+    cache = TokenCache()
+    cache.invalidate("token", time.time() + 60)
+    cache.invalidate("token", time.time() - 1)
+
+    assert cache.is_revoked("token")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("restart", ["journal", "snapshot"])
+async def test_memory_storage_remembers_logouts_across_restarts(tmp_path, restart):
+    storage = await open_storage(tmp_path)
+    await storage.revoke_token("logged-out", time.time() + 60)
+    await storage.revoke_token("already-expired", time.time() - 1)
+    if restart == "journal":
+        await crash(storage)
+    else:
+        await storage.close()
+
+    storage = await open_storage(tmp_path)
+    assert await storage.is_token_revoked("logged-out")
+    assert not await storage.is_token_revoked("already-expired")
+    assert not await storage.is_token_revoked("never-seen")
+    await storage.close()
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from password_hasher import PasswordHasher
+from warmup import WarmUp
+
+pytestmark = pytest.mark.anyio
+
+
+def _counted(cls, delay: float = 0.05):
+    """Subclass of a heavy class whose construction is slow enough for callers to overlap and is counted"""
+    lock = threading.Lock()
+
+    class Counted(cls):
+        calls = 0
+
+        def __init__(self, *args, **kwargs):
+            with lock:
+                Counted.calls += 1
+            time.sleep(delay)
+            super().__init__(*args, **kwargs)
+
+    return Counted
+
+
+@pytest.fixture
+def crypt_context(monkeypatch):
+    import passlib.context
+
+    counted = _counted(passlib.context.CryptContext)
+    # PasswordHasher imports it on first use, so the patched name is the one it gets
+    monkeypatch.setattr(passlib.context, "CryptContext", counted)
+    return counted
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(bcrypt_rounds=4, max_workers=4, max_concurrency=4)
+    yield hasher
+    hasher.close()
+
+
+async def test_steps_run_once_in_order_and_failures_do_not_stop_the_rest():
+    calls = []
+
+    def failing():
+        calls.append("broken")
+        raise RuntimeError("no backend")
+
+    warmup = WarmUp(mode="blocking", skip=["chat"])
+    warmup.add("first", lambda: calls.append("first"))
+    warmup.add("broken", failing)
+    warmup.add("chat", lambda: calls.append("chat"))
+    warmup.add("on_loop", lambda: calls.append(threading.current_thread() is threading.main_thread()),
+               in_thread=False)
+    await warmup.start()
+
+    # Skipped steps stay lazy; loop steps run on the loop's thread
+    assert calls == ["first", "broken", True]
+    stats = warmup.stats()
+    assert stats["state"] == "failed"
+    assert stats["errors"] == {"broken": "RuntimeError: no backend"}
+    assert list(stats["steps"]) == ["first", "broken", "on_loop"]
+    assert stats["skipped"] == ["chat"]
+
+
+async def test_background_mode_returns_before_the_steps_finish():
+    release = threading.Event()
+    warmup = WarmUp(mode="background")
+    warmup.add("slow", release.wait)
+    await warmup.start()
+    await asyncio.sleep(0)
+    assert warmup.state == "running"
+
+    release.set()
+    await warmup._task
+    assert warmup.state == "done"
+    await warmup.stop()
+
+
+async def test_off_mode_leaves_everything_to_first_use(hasher, crypt_context):
+    warmup = WarmUp(mode="off")
+    warmup.add("password_hasher", hasher.warm_up)
+    await warmup.start()
+    assert (warmup.state, crypt_context.calls) == ("skipped", 0)
+
+    # Built by the first request instead, and only then
+    assert await hasher.verify("secret", await hasher.hash("secret"))
+    assert crypt_context.calls == 1
+
+
+async def test_a_subsystem_loaded_by_the_warm_up_is_not_built_again(hasher, crypt_context):
+    warmup = WarmUp(mode="blocking")
+    warmup.add("password_hasher", hasher.warm_up)
+    await warmup.start()
+    assert crypt_context.calls == 1
+    context = hasher.context
+
+    assert await hasher.verify("secret", await hasher.hash("secret"))
+    assert hasher.context is context
+    assert crypt_context.calls == 1
+
+
+async def test_concurrent_first_use_builds_once(hasher, crypt_context):
+    # Warm-up still loading in its thread while requests arrive on the loop and in the hash pool
+    warmup = WarmUp(mode="background")
+    warmup.add("password_hasher", hasher.warm_up)
+    await warmup.start()
+    hashes = await asyncio.gather(*(hasher.hash(f"secret{n}") for n in range(4)))
+    await warmup._task
+
+    assert warmup.state == "done"
+    assert all(hashed.startswith("$2b$04$") for hashed in hashes)
+    assert crypt_context.calls == 1
+
+
+def test_threads_racing_on_the_lazy_property_get_the_same_object(hasher, crypt_context):
+    start = threading.Barrier(8)
+
+    def first_use():
+        start.wait()
+        return hasher.context
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        contexts = list(pool.map(lambda _: first_use(), range(8)))
+    assert crypt_context.calls == 1
+    assert all(context is contexts[0] for context in contexts)
+
+
+def test_the_chat_client_is_built_once(monkeypatch):
+    openai = pytest.importorskip("openai")
+    from chat_service import ChatService
+
+    counted = _counted(openai.AsyncOpenAI)
+    monkeypatch.setattr(openai, "AsyncOpenAI", counted)
+    chat = ChatService(api_key="test-key", base_url="http://127.0.0.1:9/v1")
+    start = threading.Barrier(4)
+
+    def first_use():
+        start.wait()
+        return chat.warm_up()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        clients = list(pool.map(lambda _: first_use(), range(4)))
+    assert counted.calls == 1
+    assert all(client is clients[0] for client in clients)
+    # Without a key there is nothing to build
+    assert ChatService(api_key=None).warm_up() is None
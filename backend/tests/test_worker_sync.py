@@ -0,0 +1,182 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from cohorts import CohortAnalyzer
+from referral_graph import ReferralGraph
+from storage import MemoryStorage
+from token_cache import TokenCache
+from worker_sync import WorkerSync
+
+from .test_persistence import crash, open_storage
+
+pytestmark = pytest.mark.anyio
+
+TODAY = datetime(2026, 3, 10)
+
+
+def _user(n: int, **fields) -> dict:
+    return {"id": f"u{n}", "first_name": f"F{n}", "last_name": "L", "email": f"u{n}@x.com",
+            "password_hash": "x", "referral_code": f"C{n}", "created_at": datetime(2026, 3, 1),
+            "total_referrals": 0, "total_earnings": 0.0, **fields}
+
+
+def _worker(storage) -> WorkerSync:
+    """One process's views, syncing as if storage were shared by several"""
+    return WorkerSync(storage, TokenCache(), ReferralGraph(), CohortAnalyzer(), shared=True)
+
+
+async def test_logouts_reach_the_other_workers_on_the_next_sync(storage):
+    first, second = _worker(storage), _worker(storage)
+    await first.load()
+    await second.load()
+    exp = time.time() + 3600
+    second.token_cache.put("token", "u1", exp)
+
+    # Logout on the first worker: its own cache at once, storage for the rest
+    first.token_cache.invalidate("token", exp)
+    await storage.revoke_token("token", exp)
+    assert first.token_cache.is_revoked("token")
+    assert not second.token_cache.is_revoked("token")
+
+    await second.sync()
+    assert second.token_cache.is_revoked("token")
+    assert second.revocations_applied == 1
+
+
+async def test_a_restarted_worker_loads_every_live_revocation(storage):
+    await storage.revoke_token("live", time.time() + 3600)
+    await storage.revoke_token("expired", time.time() - 1)
+
+    worker = _worker(storage)
+    await worker.load()
+    assert worker.token_cache.is_revoked("live")
+    assert not worker.token_cache.is_revoked("expired")
+
+
+async def test_activity_is_shared_between_workers(storage):
+    await storage.insert_users([_user(1), _user(2)], {})
+    first, second = _worker(storage), _worker(storage)
+    await first.load()
+    await second.load()
+
+    first.cohorts.record_activity("u1", TODAY)
+    first.cohorts.record_activity("u1", TODAY)
+    second.cohorts.record_activity("u2", TODAY)
+    await first.sync()
+    await second.sync()
+    await first.sync()
+
+    for worker in (first, second):
+        assert worker.cohorts.stats()["events"] == 2
+        assert worker.cohorts.stats()["unsaved_activity"] == 0
+    assert first.activity_saved == second.activity_saved == 1
+    # The same user and day is stored once, however many workers saw it
+    second.cohorts.record_activity("u1", TODAY)
+    await second.sync()
+    assert second.activity_saved == 1
+    assert len(await storage.activity_after(0, 10)) == 2
+
+
+async def test_signups_and_earnings_of_other_workers_are_applied_without_a_rebuild(storage):
+    await storage.insert_users([_user(1)], {})
+    worker = _worker(storage)
+    await worker.load()
+    rebuilds = worker.rebuilds
+
+    # A signup and a bonus through another worker
+    await storage.insert_users([_user(2, referrer_id="u1", total_earnings=25.0)], {"u1": {"total_referrals": 1}})
+    await storage.increment_user("u1", total_earnings=50.0)
+    await worker.sync()
+    assert worker.rebuilds == rebuilds
+    assert worker.referral_graph.network("u1")["network_size"] == 1
+    assert worker.referral_graph.network("u1")["network_earnings"] == 25.0
+    assert worker.cohorts.stats()["users"] == 2
+
+    await storage.increment_user("u2", total_earnings=10.0)
+    await worker.sync()
+    assert worker.referral_graph.network("u1")["network_earnings"] == 35.0
+    assert (worker.users_added, worker.rebuilds) == (1, rebuilds)
+
+    # Nothing new: nothing applied
+    updated = worker.users_updated
+    await worker.sync()
+    assert worker.users_updated == updated
+
+
+async def test_a_referrer_tailed_after_its_referral_is_attached_first(storage):
+    worker = _worker(storage)
+    await worker.load()
+
+    await storage.insert_users([_user(1), _user(2, referrer_id="u1"), _user(3, referrer_id="u2")], {})
+    # u1 changes last, so the tail reads u2, u3, u1
+    await storage.increment_user("u1", total_referrals=1)
+    await worker.sync()
+    assert worker.referral_graph.upline("u3") == ["u2", "u1"]
+    assert worker.referral_graph.network("u1")["network_size"] == 2
+    assert worker.referral_graph.stats()["orphans"] == 0
+
+
+async def test_tailed_views_match_a_full_rebuild(storage):
+    await storage.insert_users([_user(1), _user(2, referrer_id="u1")], {})
+    worker = _worker(storage)
+    await worker.load()
+
+    await storage.insert_users([_user(n, referrer_id=f"u{n // 2}", total_earnings=float(n)) for n in range(3, 12)], {})
+    for n in (1, 4, 7):
+        await storage.increment_user(f"u{n}", total_earnings=5.0)
+    await storage.insert_user(_user(12, referrer_id="u11"))
+    await worker.sync()
+
+    fresh = _worker(storage)
+    await fresh.load()
+    for n in range(1, 13):
+        assert worker.referral_graph.network(f"u{n}") == fresh.referral_graph.network(f"u{n}")
+    assert worker.cohorts.stats()["users"] == fresh.cohorts.stats()["users"] == 12
+    assert worker.cohorts.stats()["events"] == fresh.cohorts.stats()["events"]
+    assert worker.rebuilds == 1
+
+
+async def test_a_reset_through_another_worker_triggers_a_rebuild(storage):
+    await storage.insert_users([_user(1), _user(2, referrer_id="u1")], {})
+    worker = _worker(storage)
+    await worker.load()
+    rebuilds = worker.rebuilds
+
+    await storage.clear()
+    await storage.insert_user(_user(3))
+    await worker.sync()
+    assert worker.rebuilds == rebuilds + 1
+    assert len(worker.referral_graph) == 1 and "u3" in worker.referral_graph
+    assert worker.cohorts.stats()["users"] == 1
+
+
+async def test_a_memory_store_only_saves_its_own_activity():
+    storage = MemoryStorage()
+    await storage.insert_users([_user(1)], {})
+    worker = WorkerSync(storage, TokenCache(), None, CohortAnalyzer())
+    await worker.load()
+
+    worker.cohorts.record_activity("u1", TODAY)
+    await storage.revoke_token("token", time.time() + 3600)
+    await worker.sync()
+    assert not worker.shared
+    assert worker.activity_saved == 1
+    # Nothing polled back: a single process already has its own logouts
+    assert worker.revocations_applied == 0
+
+
+async def test_activity_survives_a_memory_store_restart(tmp_path):
+    storage = await open_storage(tmp_path)
+    await storage.insert_users([_user(1)], {})
+    await storage.record_activity([("u1", 700000), ("u1", 700001)])
+    await storage.snapshot()
+    await storage.record_activity([("u1", 700002), ("u1", 700000)])
+    expected = await storage.activity_after(0, 10)
+    await crash(storage)
+
+    storage = await open_storage(tmp_path)
+    assert await storage.activity_after(0, 10) == expected
+    assert [day for _, _, day in expected] == [700000, 700001, 700002]
+    await storage.close()
@@ -0,0 +1,114 @@
+import hashlib
+import heapq
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def token_hash(token: str) -> str:
+    """Revocations are kept by hash, never as usable tokens"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU of already verified JWTs -> (user_id, exp)
+
+    Entries are never served past the token's own ``exp``, and ``max_ttl``
+    caps how long a verification result is trusted. ``invalidate`` drops a
+    single token (logout) and ``clear`` drops everything, which is what a
+    secret rotation needs.
+
+    Logged-out tokens are remembered by ``token_hash`` until their own
+    ``exp`` (a heap keyed on expiry finds the ones that can go), never
+    evicted for space: a token forgotten early would be accepted again.
+    Logouts taken by other workers arrive through ``revoke`` (see
+    worker_sync.py), so checking a token never needs the database.
+    """
+
+    def __init__(self, max_size: int = 10000, max_ttl: float = 300.0):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, Tuple[str, float, float]]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}
+        self._revoked_expiry: List[Tuple[float, str]] = []
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[str]:
+        """User id for a cached token, None on miss or expiry"""
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user_id, exp, cached_until = entry
+        now = time.time()
+        if now >= exp or now >= cached_until:
+            del self._entries[token]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user_id
+
+    def put(self, token: str, user_id: str, exp: float):
+        if self.is_revoked(token):
+            return
+        self._entries[token] = (user_id, exp, time.time() + self.max_ttl)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def is_revoked(self, token: str) -> bool:
+        if not self._revoked:
+            return False
+        exp = self._revoked.get(token_hash(token))
+        return exp is not None and time.time() < exp
+
+    def invalidate(self, token: str, exp: Optional[float] = None):
+        """Forget a token and refuse to re-cache it until it expires (logout)"""
+        self._entries.pop(token, None)
+        if exp is None:
+            exp = time.time() + self.max_ttl
+        self.revoke(token_hash(token), exp)
+
+    def revoke(self, hashed: str, exp: float):
+        """Refuse the token with this ``token_hash`` until ``exp`` (a logout seen in storage)"""
+        if self._revoked.get(hashed, 0) < exp:
+            self._revoked[hashed] = exp
+            heapq.heappush(self._revoked_expiry, (exp, hashed))
+        self._forget_expired_revocations()
+
+    def _forget_expired_revocations(self):
+        # Expired tokens fail verification on their own, no need to remember them
+        now = time.time()
+        heap = self._revoked_expiry
+        while heap and heap[0][0] <= now:
+            exp, hashed = heapq.heappop(heap)
+            if self._revoked.get(hashed) == exp:
+                del self._revoked[hashed]
+
+    def clear(self):
+        """Drop every cached verification (e.g. after rotating SECRET_KEY)"""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "revoked": len(self._revoked),
+        }
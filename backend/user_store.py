@@ -0,0 +1,135 @@
+from typing import Dict, Iterable, Iterator, Optional
+
+
+def normalize_email(email: str) -> str:
+    """Canonical form used as the email index key"""
+    return email.strip().lower()
+
+
+class DuplicateKeyError(ValueError):
+    """Raised when an insert/update would break a unique index"""
+
+    def __init__(self, field: str, value: str):
+        super().__init__(f"Duplicate {field}: {value}")
+        self.field = field
+        self.value = value
+
+
+class UserStore:
+    """In-memory user table with unique hash indexes on email and referral_code
+
+    Records (``records.User`` or plain dicts) are keyed by ``id``. The store
+    owns the indexes, so any change to ``email`` or ``referral_code`` has to go
+    through ``update`` to keep them in sync. Other fields can be mutated in place.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, dict] = {}
+        self._by_email: Dict[str, str] = {}
+        self._by_referral_code: Dict[str, str] = {}
+
+    # Dict-like read access (len, iteration, get)
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._users)
+
+    def get(self, user_id: str) -> Optional[dict]:
+        return self._users.get(user_id)
+
+    def values(self):
+        return self._users.values()
+
+    # Indexed lookups
+    def get_by_email(self, email: str) -> Optional[dict]:
+        user_id = self._by_email.get(normalize_email(email))
+        return self._users.get(user_id) if user_id else None
+
+    def get_by_referral_code(self, referral_code: str) -> Optional[dict]:
+        user_id = self._by_referral_code.get(referral_code)
+        return self._users.get(user_id) if user_id else None
+
+    def email_exists(self, email: str) -> bool:
+        return normalize_email(email) in self._by_email
+
+    def referral_code_exists(self, referral_code: str) -> bool:
+        return referral_code in self._by_referral_code
+
+    # Mutations
+    def insert(self, user: dict) -> dict:
+        """Add a user, failing without side effects if a unique key is taken"""
+        user_id = user["id"]
+        email_key = normalize_email(user["email"])
+        referral_code = user.get("referral_code")
+
+        if user_id in self._users:
+            raise DuplicateKeyError("id", user_id)
+        if email_key in self._by_email:
+            raise DuplicateKeyError("email", user["email"])
+        if referral_code and referral_code in self._by_referral_code:
+            raise DuplicateKeyError("referral_code", referral_code)
+
+        self._users[user_id] = user
+        self._by_email[email_key] = user_id
+        if referral_code:
+            self._by_referral_code[referral_code] = user_id
+        return user
+
+    def update(self, user_id: str, **fields) -> dict:
+        """Update fields on a user, re-indexing email/referral_code if they change"""
+        user = self._users[user_id]
+
+        new_email_key = None
+        if "email" in fields:
+            new_email_key = normalize_email(fields["email"])
+            owner = self._by_email.get(new_email_key)
+            if owner is not None and owner != user_id:
+                raise DuplicateKeyError("email", fields["email"])
+
+        new_code = None
+        if "referral_code" in fields:
+            new_code = fields["referral_code"]
+            owner = self._by_referral_code.get(new_code)
+            if owner is not None and owner != user_id:
+                raise DuplicateKeyError("referral_code", new_code)
+
+        # All checks passed, now touch the indexes
+        if new_email_key is not None:
+            del self._by_email[normalize_email(user["email"])]
+            self._by_email[new_email_key] = user_id
+        if "referral_code" in fields:
+            old_code = user.get("referral_code")
+            if old_code:
+                del self._by_referral_code[old_code]
+            if new_code:
+                self._by_referral_code[new_code] = user_id
+
+        user.update(fields)
+        return user
+
+    def delete(self, user_id: str) -> Optional[dict]:
+        user = self._users.pop(user_id, None)
+        if user is None:
+            return None
+        self._by_email.pop(normalize_email(user["email"]), None)
+        referral_code = user.get("referral_code")
+        if referral_code:
+            self._by_referral_code.pop(referral_code, None)
+        return user
+
+    def load(self, users: Iterable[dict]):
+        """Replace the contents in bulk (snapshot restore); keys are trusted to be unique"""
+        self._users = {user.id: user for user in users}
+        self._by_email = {normalize_email(user.email): user_id for user_id, user in self._users.items()}
+        self._by_referral_code = {
+            user.referral_code: user_id for user_id, user in self._users.items() if user.referral_code
+        }
+
+    def clear(self):
+        self._users.clear()
+        self._by_email.clear()
+        self._by_referral_code.clear()
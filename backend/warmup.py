@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+WARMUP_MODES = ("background", "blocking", "off")
+
+
+class WarmUp:
+    """Startup hook that loads lazily initialized subsystems ahead of traffic
+
+    Heavy subsystems (bcrypt backend, OpenAI client, python-jose, the
+    achievement catalog, NumPy for cohorts) are built on first use so that
+    importing the app stays cheap. Steps registered with ``add`` run once,
+    in order, in a worker thread: in ``background`` mode startup returns at
+    once and the process serves while they load, in ``blocking`` mode
+    startup waits for them, and ``off`` leaves everything to first use.
+    Steps that touch state shared with request handlers can ask to run on
+    the event loop instead (``in_thread=False``); keep those short. Steps in
+    ``skip`` stay lazy: worth it for big imports behind rarely hit routes,
+    which would otherwise compete for the GIL with the first requests. Each
+    step is timed; a failing step is recorded and the rest still run.
+    """
+
+    def __init__(self, mode: str = "background", skip: Iterable[str] = ()):
+        if mode not in WARMUP_MODES:
+            raise ValueError(f"warm-up mode must be one of {', '.join(WARMUP_MODES)}")
+        self.mode = mode
+        self.skip = set(skip)
+        self._steps: List[Tuple[str, Callable[[], object], bool]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.state = "pending"
+        self.step_ms: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.total_ms = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=os.getenv("WARMUP_MODE", "background").lower(),
+            # The OpenAI SDK alone takes longer to import than the rest of the app
+            skip=[name.strip() for name in os.getenv("WARMUP_SKIP", "chat").split(",") if name.strip()],
+        )
+
+    def add(self, name: str, step: Callable[[], object], in_thread: bool = True):
+        self._steps.append((name, step, in_thread))
+
+    async def start(self):
+        """Call from the startup event"""
+        if self.mode == "off":
+            self.state = "skipped"
+        elif self.mode == "blocking":
+            await self.run()
+        else:
+            self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        self.state = "running"
+        started = time.perf_counter()
+        for name, step, in_thread in self._steps:
+            if name in self.skip:
+                continue
+            step_started = time.perf_counter()
+            try:
+                if in_thread:
+                    await asyncio.to_thread(step)
+                else:
+                    step()
+            except Exception as e:
+                self.errors[name] = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Warm-up step {name} failed: {e}")
+            self.step_ms[name] = round((time.perf_counter() - step_started) * 1000, 3)
+        self.total_ms = round((time.perf_counter() - started) * 1000, 3)
+        self.state = "failed" if self.errors else "done"
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "state": self.state,
+            "total_ms": self.total_ms,
+            "skipped": sorted(self.skip),
+            "steps": self.step_ms,
+            "errors": self.errors,
+        }
@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+
+class WorkerSync:
+    """Keeps the in-process views of a worker in step with storage
+
+    Logouts, the referral graph and cohorts are served from memory, so a
+    request never waits on storage for them. Every ``interval`` seconds this
+    flushes the cohort activity seen here to storage and, when storage is
+    shared by several processes (sqlite, postgres), pulls what the other
+    workers stored: logouts revoked since the last poll go into the token
+    cache, new activity rows are tailed by id and users inserted or updated
+    since the last sync are tailed by ``change_seq`` and applied to the
+    referral graph (signups, earnings) and cohorts (signups). Changes made by
+    this worker show up here at once, those of other workers within
+    ``interval``. Applying a change twice is harmless, so rows this worker
+    already applied come back without effect.
+
+    The full rebuild is kept for recovery: at ``load``, and when storage holds
+    fewer users than the views (a reset through another worker) or more than
+    the tail explains with no gaps pending. Where change numbers can commit
+    out of order (postgres), skipped ones are looked up again until they show
+    up or ``gap_grace`` seconds pass, like click ids in ``RollupSync``.
+
+    Revocation times are taken before commit, so a poll also looks back
+    ``overlap`` seconds; applying a revocation twice is harmless.
+    """
+
+    def __init__(
+        self,
+        storage,
+        token_cache,
+        referral_graph=None,
+        cohorts=None,
+        interval: float = 1.0,
+        overlap: float = 5.0,
+        shared: Optional[bool] = None,
+        batch_size: int = 5000,
+        gap_grace: float = 30.0,
+        settle_changes: int = 1000,
+    ):
+        self.storage = storage
+        self.token_cache = token_cache
+        self.referral_graph = referral_graph
+        self.cohorts = cohorts
+        self.interval = interval
+        self.overlap = overlap
+        # A memory store has a single process, whose own changes are already here
+        self.shared = storage.name != "memory" if shared is None else shared
+        self.batch_size = batch_size
+        self.gap_grace = gap_grace
+        self.settle_changes = settle_changes
+        self._revoked_since = 0.0
+        self._change_seq = 0
+        self._gaps: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.syncs = 0
+        self.revocations_applied = 0
+        self.activity_saved = 0
+        self.users_added = 0
+        self.users_updated = 0
+        self.gaps_filled = 0
+        self.gaps_dropped = 0
+        self.rebuilds = 0
+        self.errors = 0
+        self.last_sync_ms = 0.0
+
+    @classmethod
+    def from_env(cls, storage, token_cache, referral_graph=None, cohorts=None):
+        return cls(
+            storage,
+            token_cache,
+            referral_graph,
+            cohorts,
+            interval=float(os.getenv("WORKER_SYNC_INTERVAL", "1.0")),
+            gap_grace=float(os.getenv("WORKER_GAP_GRACE", "30")),
+        )
+
+    async def load(self):
+        """Build every view from storage (startup and resets)"""
+        await self.rebuild()
+        self._revoked_since = 0.0
+        await self._poll_revocations()
+
+    async def rebuild(self):
+        # Tail position first: changes landing during the rebuild are applied
+        # again by the next sync. Out of order stores also replay the last
+        # ``settle_changes`` before it, in case some were not committed yet.
+        last_seq = await self.storage.last_user_change_seq()
+        if not self.storage.changes_in_order:
+            last_seq = max(0, last_seq - self.settle_changes)
+        self._change_seq = last_seq
+        self._gaps.clear()
+        if self.referral_graph is not None:
+            await self.referral_graph.rebuild_from(self.storage)
+        if self.cohorts is not None:
+            await self.save_activity()
+            await self.cohorts.rebuild_from(self.storage)
+        self.rebuilds += 1
+
+    async def save_activity(self):
+        if self.cohorts is not None:
+            unsaved = self.cohorts.take_unsaved()
+            if unsaved:
+                await self.storage.record_activity(unsaved)
+                self.activity_saved += len(unsaved)
+
+    async def _poll_revocations(self):
+        newest = self._revoked_since
+        for hashed, exp, revoked_at in await self.storage.revoked_tokens_since(self._revoked_since - self.overlap):
+            self.token_cache.revoke(hashed, exp)
+            self.revocations_applied += 1
+            newest = max(newest, revoked_at)
+        self._revoked_since = newest
+
+    def _known_users(self) -> Optional[int]:
+        if self.referral_graph is not None:
+            return len(self.referral_graph)
+        if self.cohorts is not None:
+            return self.cohorts.stats()["users"]
+        return None
+
+    def _apply_change(self, user_id: str, referrer_id: Optional[str], earnings: float, created_at):
+        graph = self.referral_graph
+        if graph is not None:
+            if user_id in graph:
+                graph.set_earnings(user_id, earnings or 0.0)
+                self.users_updated += 1
+            else:
+                graph.add(user_id, referrer_id, earnings or 0.0)
+                self.users_added += 1
+        if self.cohorts is not None:
+            self.cohorts.add_user(user_id, created_at, referrer_id)
+
+    async def _sync_users(self):
+        """Apply users changed since the last sync; rebuild if the counts say something was missed"""
+        known = self._known_users()
+        if known is None:
+            return
+        # Read before the tail: every user it counts is in the tail or a gap
+        count = await self.storage.count_users()
+        if count < known:
+            # Users went away (a reset through another worker)
+            await self.rebuild()
+            return
+
+        now = time.monotonic()
+        changes = {}
+        if self._gaps:
+            for change in await self.storage.user_changes_by_seq(list(self._gaps)):
+                del self._gaps[change[0]]
+                changes[change[1]] = change
+                self.gaps_filled += 1
+            for seq in [seq for seq, seen in self._gaps.items() if now - seen > self.gap_grace]:
+                del self._gaps[seq]
+                self.gaps_dropped += 1
+        while True:
+            rows = await self.storage.user_changes_after(self._change_seq, self.batch_size)
+            for change in rows:
+                seq = change[0]
+                if not self.storage.changes_in_order:
+                    for missing in range(self._change_seq + 1, seq):
+                        self._gaps[missing] = now
+                self._change_seq = seq
+                # A user changed twice in the window is applied once, with its latest fields
+                changes[change[1]] = change
+            if len(rows) < self.batch_size:
+                break
+
+        # Referrers first: walk up each chain of users tailed together and attach it top down
+        for user_id in list(changes):
+            chain = []
+            while user_id in changes:
+                change = changes.pop(user_id)
+                chain.append(change)
+                user_id = change[2]
+            for _, user_id, referrer_id, earnings, created_at in reversed(chain):
+                self._apply_change(user_id, referrer_id, earnings, created_at)
+
+        if self._known_users() < count and not self._gaps:
+            # Users storage counts but the tail never showed (should not happen)
+            await self.rebuild()
+
+    async def sync(self):
+        started = time.perf_counter()
+        await self.save_activity()
+        if self.shared:
+            await self._poll_revocations()
+            if self.cohorts is not None:
+                await self.cohorts.sync_activity(self.storage)
+            await self._sync_users()
+        self.syncs += 1
+        self.last_sync_ms = (time.perf_counter() - started) * 1000
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Worker sync failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Activity seen since the last sync would be lost otherwise
+        await self.save_activity()
+
+    def stats(self) -> dict:
+        return {
+            "shared": self.shared,
+            "interval": self.interval,
+            "syncs": self.syncs,
+            "revocations_applied": self.revocations_applied,
+            "activity_saved": self.activity_saved,
+            "last_change_seq": self._change_seq,
+            "pending_gaps": len(self._gaps),
+            "users_added": self.users_added,
+            "users_updated": self.users_updated,
+            "gaps_filled": self.gaps_filled,
+            "gaps_dropped": self.gaps_dropped,
+            "rebuilds": self.rebuilds,
+            "errors": self.errors,
+            "last_sync_ms": round(self.last_sync_ms, 3),
+        }
@@ -1,13 +1,43 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from typing import Optional, List, Literal
+from datetime import datetime, timedelta, date
 import uuid
-import uvicorn
+import asyncio
+import hmac
+import os
+import random
+import sys
+
+# Shared store modules live next to the main backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from user_store import DuplicateKeyError
+from storage import create_storage
+from click_pipeline import ClickIngestor
+from rollups import RollupEngine, RollupSync
+from click_dedup import ClickDeduplicator
+from password_hasher import PasswordHasher, HasherBusyError
+from token_cache import TokenCache
+from bulk_import import BulkImporter, IMPORT_FORMATS
+from referral_codes import ReferralCodeAllocator
+from records import Click, dump_json
+from metrics import Metrics, MetricsMiddleware
+from admission import AdmissionController, AdmissionMiddleware
+from profiler import SamplingProfiler, ProfilerBusyError
+from referral_graph import ReferralGraph
+from cohorts import CohortAnalyzer
+from warmup import WarmUp
+from worker_sync import WorkerSync
+from etag_cache import ETagCache
+
+# Request, hot-path and event-loop latency histograms behind /metrics
+metrics = Metrics.from_env()
+
+# On-demand stack sampling of this worker (/api/admin/profile)
+profiler = SamplingProfiler.from_env()
 
 # FastAPI app initialization
 app = FastAPI(
@@ -18,6 +48,11 @@ app = FastAPI(
     redoc_url="/redoc"  # Alternative docs at /redoc
 )
 
+# Per-IP/per-link rate limits and concurrency caps on the public routes;
+# added first so it runs innermost and rejections still get CORS headers
+admission = AdmissionController.from_env()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -27,18 +62,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps CORS too; unhandled errors are counted as 500
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 # Security configuration
 SECRET_KEY = "cloudwalk-super-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# /api/admin/* needs X-Admin-Token equal to ADMIN_TOKEN; unset, the admin API is closed
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+# bcrypt on a bounded worker pool instead of the event loop
+password_hasher = PasswordHasher.from_env(metrics)
 security = HTTPBearer()
 
-# In-memory database (mock data)
-users_db = {}
-referrals_db = {}
-clicks_db = []
+# Verified JWTs, so repeat requests skip signature checks
+token_cache = TokenCache(
+    max_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    max_ttl=float(os.getenv("TOKEN_CACHE_TTL", "300"))
+)
+
+# Persistence backend (in-memory by default, STORAGE_BACKEND=postgres for init.sql)
+storage = create_storage()
+
+# Referral codes: keyed permutation of a storage-backed counter
+referral_codes = ReferralCodeAllocator.from_env(storage)
+
+# Clicks are queued and flushed to referral_clicks in batches (set up on startup)
+click_ingestor: Optional[ClickIngestor] = None
+
+# Hourly/daily click and conversion buckets behind /api/analytics, rebuilt
+# from referral_clicks at startup and then kept in step with it
+rollups = RollupEngine()
+rollup_sync: Optional[RollupSync] = None
+
+# Per-link duplicate-click verdicts (rotating Bloom filter) and unique visitors (HyperLogLog);
+# rollup_sync feeds it the stored clicks of every worker and saves the sketches
+click_dedup = ClickDeduplicator.from_env()
+
+# Who referred whom, with downline size/earnings per user (rebuilt at startup)
+referral_graph = ReferralGraph.from_env()
+
+# Signup cohorts, retention and churn over columnar arrays (/api/admin/cohorts)
+cohorts = CohortAnalyzer.from_env()
+
+# Logouts, referral graph and cohort activity of the other workers (polled from storage)
+worker_sync = WorkerSync.from_env(storage, token_cache, referral_graph, cohorts)
+
+# ETags from storage-kept versions: polls get a 304 or a body serialized once per version
+etags = ETagCache.from_env(storage)
+
+async def index_imported_users(users: List[dict], referrer_ids: set):
+    # Batches keep file order, so a referrer in the batch is attached before its referrals
+    for user in users:
+        referral_graph.add(user["id"], user.get("referrer_id"), user["total_earnings"])
+        cohorts.add_user(user["id"], user["created_at"], user.get("referrer_id"))
+
+# Bulk user import (JSONL/CSV), committed in batches by a background task
+bulk_importer = BulkImporter.from_env(
+    storage, password_hasher, code_allocator=referral_codes, on_batch=index_imported_users
+)
+
+class RecordJSONResponse(JSONResponse):
+    """Serializes slotted records straight to JSON bytes (public fields only)"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
 
 # Pydantic models
 class UserRegister(BaseModel):
@@ -46,6 +140,7 @@ class UserRegister(BaseModel):
     lastName: str
     email: EmailStr
     password: str
+    ref: Optional[str] = None  # Referral link code from /register?ref=
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -84,20 +179,29 @@ class Token(BaseModel):
     token_type: str
 
 # Utility functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def generate_referral_code(length=6):
-    """Generate a unique referral code"""
-    import random
-    import string
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-        if not any(user['referral_code'] == code for user in users_db.values()):
-            return code
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
+
+async def verify_password(user: dict, plain_password: str) -> bool:
+    """Check a password and transparently upgrade outdated stored hashes"""
+    valid, new_hash = await password_hasher.verify_and_update(plain_password, user['password_hash'])
+    if valid and new_hash:
+        await storage.update_user(user['id'], password_hash=new_hash)
+    return valid
+
+async def generate_referral_code():
+    """Next referral code from the allocator (unique without a lookup loop)"""
+    return await referral_codes.allocate()
+
+# python-jose is imported on the first token operation (or by the warm-up), not at import
+_jwt = None
+
+def jose_jwt():
+    global _jwt
+    if _jwt is None:
+        from jose import jwt
+        _jwt = jwt
+    return _jwt
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -106,29 +210,86 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jose_jwt().encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+def decode_token(token: str):
+    """Verify a JWT and return (user_id, exp)"""
+    jwt = jose_jwt()
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.timer("jwt_verify"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.JWTError:
+        raise credentials_exception
+    return user_id, payload["exp"]
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    if token_cache.is_revoked(token):
         raise credentials_exception
     
-    user = users_db.get(user_id)
+    user_id = token_cache.get(token)
+    if user_id is None:
+        user_id, exp = decode_token(token)
+        token_cache.put(token, user_id, exp)
+    
+    with metrics.timer("store_lookup"):
+        user = await storage.get_user(user_id)
     if user is None:
         raise credentials_exception
+    cohorts.record_activity(user_id)
     return user
 
+# Loads the lazily initialized subsystems after startup (WARMUP_MODE=background|blocking|off)
+warmup = WarmUp.from_env()
+warmup.add("jwt", jose_jwt)
+warmup.add("password_hasher", password_hasher.warm_up)
+warmup.add("cohorts", cohorts.warm_up)
+
+# Lifecycle
+@app.on_event("startup")
+async def startup():
+    global click_ingestor, rollup_sync
+    await storage.connect()
+    await worker_sync.load()
+    worker_sync.start()
+    click_ingestor = ClickIngestor.from_env(storage.click_sink())
+    click_ingestor.start()
+    metrics.add_stats("click_ingestor", click_ingestor.stats)
+    rollup_sync = RollupSync.from_env(rollups, click_ingestor.sink, storage, click_dedup)
+    await rollup_sync.load()
+    rollup_sync.start()
+    metrics.add_stats("rollups", rollup_sync.stats)
+    metrics.start()
+    await warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await warmup.stop()
+    await metrics.stop()
+    if rollup_sync is not None:
+        await rollup_sync.stop()
+    # Flush pending clicks before the pool goes away
+    if click_ingestor is not None:
+        await click_ingestor.stop()
+    await worker_sync.stop()
+    await bulk_importer.close()
+    await storage.close()
+    password_hasher.close()
+
+@app.exception_handler(HasherBusyError)
+async def hasher_busy_handler(request, exc: HasherBusyError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # API Routes
 
 @app.get("/")
@@ -152,14 +313,31 @@ async def health_check():
         "status": "OK", 
         "message": "CloudWalk Referral API is running (FastAPI)",
         "timestamp": datetime.utcnow().isoformat(),
-        "users_count": len(users_db),
-        "referrals_count": len(referrals_db)
+        "users_count": await storage.count_users(),
+        "referrals_count": await storage.count_referrals()
     }
 
+# Prometheus scrape target
+metrics.add_stats("storage", storage.health)
+metrics.add_stats("password_hasher", password_hasher.stats)
+metrics.add_stats("token_cache", token_cache.stats)
+metrics.add_stats("admission", admission.stats)
+metrics.add_stats("click_dedup", click_dedup.stats)
+metrics.add_stats("profiler", profiler.stats)
+metrics.add_stats("referral_graph", referral_graph.stats)
+metrics.add_stats("cohorts", cohorts.stats)
+metrics.add_stats("worker_sync", worker_sync.stats)
+metrics.add_stats("warmup", warmup.stats)
+metrics.add_stats("etag_cache", etags.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/register", response_model=dict)
-async def register_user(user_data: UserRegister):
+async def register_user(request: Request, user_data: UserRegister):
     # Check if user exists
-    if any(user['email'] == user_data.email for user in users_db.values()):
+    if await storage.email_exists(user_data.email):
         raise HTTPException(
             status_code=400,
             detail="User already exists"
@@ -167,8 +345,11 @@ async def register_user(user_data: UserRegister):
     
     # Create new user
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
-    referral_code = generate_referral_code()
+    hashed_password = await get_password_hash(user_data.password)
+    referral_code = await generate_referral_code()
+    
+    # The referral link the user came from, if any
+    referral = await storage.get_referral_by_link_code(user_data.ref) if user_data.ref else None
     
     new_user = {
         "id": user_id,
@@ -179,10 +360,25 @@ async def register_user(user_data: UserRegister):
         "referral_code": referral_code,
         "total_referrals": 0,
         "total_earnings": 0.0,
-        "created_at": datetime.utcnow()
+        "created_at": datetime.utcnow(),
+        "referrer_id": referral['user_id'] if referral else None
     }
     
-    users_db[user_id] = new_user
+    new_user = await storage.insert_user(new_user)
+    referral_graph.add(user_id, new_user['referrer_id'], new_user['total_earnings'])
+    cohorts.add_user(user_id, new_user['created_at'], new_user['referrer_id'])
+    
+    # Count the conversion on the referral link (stored with the clicks, where the rollups pick it up)
+    if referral:
+        await storage.increment_referral(referral['id'], registration_count=1)
+        await click_ingestor.put(Click(
+            link_code=referral['link_code'],
+            ip_address=request.client.host if request.client else None,
+            user_agent=request.headers.get("user-agent"),
+            clicked_at=new_user['created_at'],
+            completed_registration=True,
+            completed_email=new_user['email']
+        ))
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -191,29 +387,24 @@ async def register_user(user_data: UserRegister):
         expires_delta=access_token_expires
     )
     
-    # Remove password from response
-    user_response = {k: v for k, v in new_user.items() if k != 'password_hash'}
-    
-    return {
+    # Records only serialize public fields, so password_hash never leaves
+    return RecordJSONResponse({
         "message": "User created successfully",
-        "user": user_response,
+        "user": new_user,
         "token": access_token
-    }
+    })
 
 @app.post("/api/login", response_model=dict)
 async def login_user(user_data: UserLogin):
     # Find user
-    user = None
-    for u in users_db.values():
-        if u['email'] == user_data.email:
-            user = u
-            break
-    
-    if not user or not verify_password(user_data.password, user['password_hash']):
+    with metrics.timer("store_lookup"):
+        user = await storage.get_user_by_email(user_data.email)
+    if not user or not await verify_password(user, user_data.password):
         raise HTTPException(
             status_code=401,
             detail="Invalid credentials"
         )
+    cohorts.record_activity(user["id"])
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -222,24 +413,41 @@ async def login_user(user_data: UserLogin):
         expires_delta=access_token_expires
     )
     
-    # Remove password from response
-    user_response = {k: v for k, v in user.items() if k != 'password_hash'}
-    
-    return {
+    return RecordJSONResponse({
         "message": "Login successful",
-        "user": user_response,
+        "user": user,
         "token": access_token
-    }
+    })
+
+@app.post("/api/logout")
+async def logout_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    _, exp = decode_token(credentials.credentials)
+    token_cache.invalidate(credentials.credentials, exp)
+    # Other workers/instances only learn about the logout through storage
+    await storage.revoke_token(credentials.credentials, exp)
+    return {"message": "Logged out"}
 
 @app.get("/api/profile", response_model=dict)
-async def get_profile(current_user: dict = Depends(get_current_user)):
-    user_response = {k: v for k, v in current_user.items() if k != 'password_hash'}
-    return {"user": user_response}
+async def get_profile(request: Request, current_user: dict = Depends(get_current_user)):
+    # The user id is in the tag so a client switching accounts never gets a 304 for the other one
+    return await etags.respond(
+        request, ("profile", current_user['id']),
+        etags.tag("profile", current_user['id'], current_user['version']),
+        lambda: profile_body(current_user), response_class=RecordJSONResponse, private=True
+    )
+
+async def profile_body(current_user: dict) -> dict:
+    return {"user": current_user}
 
 @app.get("/api/referrals", response_model=dict)
 async def get_referrals(current_user: dict = Depends(get_current_user)):
-    user_referrals = [ref for ref in referrals_db.values() if ref['user_id'] == current_user['id']]
-    return {"referrals": user_referrals}
+    user_referrals = await storage.list_referrals(current_user['id'])
+    return RecordJSONResponse({
+        "referrals": [
+            {**referral, **click_dedup.link_stats(referral['id'], referral['registration_count'])}
+            for referral in user_referrals
+        ]
+    })
 
 @app.post("/api/referrals", response_model=dict)
 async def create_referral(referral_data: CreateReferral, current_user: dict = Depends(get_current_user)):
@@ -258,75 +466,117 @@ async def create_referral(referral_data: CreateReferral, current_user: dict = De
         "created_at": datetime.utcnow()
     }
     
-    referrals_db[referral_id] = new_referral
+    try:
+        new_referral = await storage.insert_referral(new_referral)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=409,
+            detail="Referral link already exists, please try again"
+        )
     
-    return {
+    return RecordJSONResponse({
         "message": "Referral link created successfully",
         "referral": new_referral
-    }
+    })
+
+@app.get("/api/network", response_model=dict)
+async def get_my_network(limit: int = Query(20, ge=1, le=100), current_user: dict = Depends(get_current_user)):
+    """Downline of the current user: size, depth, earnings, head count per level and direct referrals"""
+    network = referral_graph.network(current_user['id'])
+    if network is None:
+        raise HTTPException(status_code=404, detail="User not in referral graph")
+    direct = []
+    for user_id, network_size in referral_graph.direct_referrals(current_user['id'], limit):
+        user = await storage.get_user(user_id)
+        if user:
+            direct.append({
+                "id": user_id,
+                "first_name": user['first_name'],
+                "last_name": user['last_name'],
+                "total_referrals": user['total_referrals'],
+                "network_size": network_size
+            })
+    network["referrals"] = direct
+    return network
 
 @app.get("/api/analytics", response_model=dict)
-async def get_analytics(current_user: dict = Depends(get_current_user)):
-    # Generate mock analytics data
-    user_referrals = [ref for ref in referrals_db.values() if ref['user_id'] == current_user['id']]
+async def get_analytics(
+    days: int = Query(7, ge=1, le=366),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    rank_by: Literal["clicks", "conversions"] = "clicks",
+    current_user: dict = Depends(get_current_user)
+):
+    # Default window is the last `days` days, including today
+    end_day = end or datetime.utcnow().date()
+    start_day = start or end_day - timedelta(days=days - 1)
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    range_start = datetime.combine(start_day, datetime.min.time())
+    range_end = datetime.combine(end_day + timedelta(days=1), datetime.min.time())
     
-    # Mock click stats for the last 7 days
-    import random
-    click_stats = []
-    for i in range(7):
-        date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-        click_stats.append({
-            "date": date,
-            "clicks": random.randint(0, 25),
-            "conversions": random.randint(0, 5)
-        })
+    # Daily click stats, oldest first
+    click_stats = rollups.daily_series(current_user['id'], start_day, end_day)
+    period_clicks, period_conversions = rollups.user_totals(current_user['id'], range_start, range_end)
+    
+    # Top 5 links by real counts in the period
+    user_links = {ref['id']: ref for ref in await storage.list_referrals(current_user['id'])}
+    top_links = [
+        {**user_links[link_id], **click_dedup.link_stats(link_id, user_links[link_id]['registration_count']),
+         "period_clicks": clicks, "period_conversions": conversions}
+        for link_id, clicks, conversions in rollups.top_links(
+            user_links, range_start, range_end, limit=5, rank_by=rank_by
+        )
+    ]
     
     return {
         "userStats": {
             "total_referrals": current_user['total_referrals'],
-            "total_earnings": current_user['total_earnings']
+            "total_earnings": current_user['total_earnings'],
+            "period_clicks": period_clicks,
+            "period_conversions": period_conversions
         },
-        "clickStats": click_stats[::-1],  # Reverse to show oldest first
-        "topLinks": user_referrals[:5]  # Top 5 links
+        "clickStats": click_stats,
+        "topLinks": top_links
     }
 
 @app.post("/api/track-click/{link_code}")
-async def track_click(link_code: str, ip_address: str = None, user_agent: str = None):
+async def track_click(request: Request, link_code: str, ip_address: str = None, user_agent: str = None):
     # Find the referral link
-    referral = None
-    for ref in referrals_db.values():
-        if ref['link_code'] == link_code:
-            referral = ref
-            break
-    
+    referral = await storage.get_referral_by_link_code(link_code)
     if not referral:
         raise HTTPException(status_code=404, detail="Referral link not found")
     
-    # Record the click
-    click_record = {
-        "id": str(uuid.uuid4()),
-        "link_code": link_code,
-        "ip_address": ip_address,
-        "user_agent": user_agent,
-        "clicked_at": datetime.utcnow(),
-        "completed_registration": False
-    }
-    clicks_db.append(click_record)
+    # The visitor is whoever made the request unless the caller forwards it
+    ip_address = ip_address or (request.client.host if request.client else None)
+    user_agent = user_agent or request.headers.get("user-agent")
     
-    # Update click count
-    referral['click_count'] += 1
+    # A repeat of the same visitor within the window is still stored (click_count and
+    # the rollups stay raw counts) but flagged, so it only counts as a raw click
+    duplicate = click_dedup.check(referral['id'], ip_address, user_agent)
+    await click_ingestor.put(Click(
+        link_code=link_code,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        clicked_at=datetime.utcnow(),
+        duplicate=duplicate
+    ))
+    await storage.increment_referral(referral['id'], click_count=1)
     
-    return {"message": "Click tracked successfully"}
+    if duplicate:
+        return {"message": "Repeat click tracked", "duplicate": True}
+    return {"message": "Click tracked successfully", "duplicate": False}
 
 @app.post("/api/demo/seed")
 async def create_demo_data():
     """Create demo data for testing"""
-    global users_db, referrals_db, clicks_db
     
     # Clear existing data
-    users_db.clear()
-    referrals_db.clear()
-    clicks_db.clear()
+    await storage.clear()
+    await click_ingestor.clear()
+    await rollup_sync.load()
+    referral_graph.clear()
+    cohorts.clear()
     
     # Create demo user
     demo_user_id = str(uuid.uuid4())
@@ -335,18 +585,21 @@ async def create_demo_data():
         "first_name": "John",
         "last_name": "Doe", 
         "email": "demo@cloudwalk.com",
-        "password_hash": get_password_hash("demo123"),
+        "password_hash": await get_password_hash("demo123"),
         "referral_code": "DEMO123",
         "total_referrals": 5,
         "total_earnings": 125.50,
         "created_at": datetime.utcnow()
     }
-    users_db[demo_user_id] = demo_user
+    await storage.insert_user(demo_user)
+    referral_graph.add(demo_user_id, None, demo_user["total_earnings"])
+    cohorts.add_user(demo_user_id, demo_user["created_at"])
     
     # Create demo referral links
+    now = datetime.utcnow()
     for i in range(1, 4):
         ref_id = str(uuid.uuid4())
-        referrals_db[ref_id] = {
+        referral = await storage.insert_referral({
             "id": ref_id,
             "user_id": demo_user_id,
             "user_name": f"Friend {i}",
@@ -354,8 +607,18 @@ async def create_demo_data():
             "full_url": f"http://localhost:8080/register?ref=DEMO123-{i}",
             "click_count": random.randint(5, 50),
             "registration_count": random.randint(1, 10),
-            "created_at": datetime.utcnow()
-        }
+            "created_at": now
+        })
+        
+        # Spread the demo counts over the last week so analytics has history
+        for i in range(referral["click_count"] + referral["registration_count"]):
+            await click_ingestor.put(Click(
+                link_code=referral["link_code"],
+                ip_address=None,
+                user_agent=None,
+                clicked_at=now - timedelta(minutes=random.randint(0, 7 * 24 * 60 - 1)),
+                completed_registration=i >= referral["click_count"]
+            ))
     
     return {
         "message": "Demo data created successfully",
@@ -369,48 +632,234 @@ async def create_demo_data():
 
 # Advanced Features
 
-@app.get("/api/admin/stats")
-async def get_admin_stats():
+@app.get("/api/admin/stats", dependencies=[Depends(require_admin)])
+async def get_admin_stats(request: Request):
     """Admin endpoint for system statistics"""
-    total_clicks = sum(ref['click_count'] for ref in referrals_db.values())
-    total_registrations = sum(ref['registration_count'] for ref in referrals_db.values())
+    versions = await storage.resource_versions()
+    # The unique-click estimate moves when rollup_sync tails the stored clicks, after the counters
+    etag = etags.tag("stats", versions['stats'], click_dedup.raw_clicks)
+    return await etags.respond(request, ("stats",), etag, admin_stats)
+
+async def admin_stats() -> dict:
+    totals = await storage.system_totals()
+    total_clicks = totals['total_clicks']
+    total_registrations = totals['total_registrations']
+    unique_clicks = click_dedup.unique_clicks_total()
     
     return {
-        "total_users": len(users_db),
-        "total_referrals": len(referrals_db),
+        "total_users": totals['total_users'],
+        "total_referrals": totals['total_links'],
         "total_clicks": total_clicks,
+        "unique_clicks": unique_clicks,
+        "duplicate_clicks": click_dedup.duplicate_clicks,
         "total_registrations": total_registrations,
-        "conversion_rate": (total_registrations / total_clicks * 100) if total_clicks > 0 else 0
+        # Over unique clicks: a visitor clicking ten times is still one chance to convert
+        "conversion_rate": (total_registrations / unique_clicks * 100) if unique_clicks > 0 else 0
+    }
+
+@app.post("/api/admin/stats/reconcile", dependencies=[Depends(require_admin)])
+async def reconcile_admin_stats():
+    """Recount system totals from stored data and fix any drift"""
+    return await storage.reconcile_totals()
+
+@app.get("/api/admin/click-pipeline", dependencies=[Depends(require_admin)])
+async def get_click_pipeline_stats():
+    """Queue depth, drop and flush latency counters for click ingestion"""
+    return click_ingestor.stats()
+
+@app.get("/api/admin/click-dedup", dependencies=[Depends(require_admin)])
+async def get_click_dedup_stats():
+    """Duplicate-click filter fill and suppression counters"""
+    return click_dedup.stats()
+
+@app.get("/api/admin/referral-graph", dependencies=[Depends(require_admin)])
+async def get_referral_graph_stats():
+    """Size and shape of the in-process referral graph"""
+    return referral_graph.stats()
+
+@app.post("/api/admin/referral-graph/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_referral_graph():
+    """Recompute the referral graph and every downline aggregate from storage"""
+    await referral_graph.rebuild_from(storage)
+    return referral_graph.stats()
+
+@app.get("/api/admin/cohorts", dependencies=[Depends(require_admin)])
+async def get_cohort_retention(
+    days: int = Query(84, ge=1, le=3660),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    period: Literal["week", "month"] = "week",
+    metric: Literal["activity", "referrals"] = "activity",
+    periods: int = Query(12, ge=1, le=52),
+    churn_days: int = Query(30, ge=1, le=365)
+):
+    """Signup cohorts with the share active (or referring) each week/month after signup, and churn"""
+    # Default window is the last `days` days of signups, including today
+    end_day = end or datetime.utcnow().date()
+    start_day = start or end_day - timedelta(days=days - 1)
+    try:
+        return await cohorts.retention(start_day, end_day, period, metric, periods, churn_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/etag-cache", dependencies=[Depends(require_admin)])
+async def get_etag_cache_stats():
+    """304s and cached bodies served for the versioned GETs"""
+    return etags.stats()
+
+@app.get("/api/admin/warmup", dependencies=[Depends(require_admin)])
+async def get_warmup_stats():
+    """Which lazy subsystems the warm-up has loaded and how long each took"""
+    return warmup.stats()
+
+@app.get("/api/admin/admission", dependencies=[Depends(require_admin)])
+async def get_admission_stats():
+    """Admitted and shed requests per route class (rate limits and concurrency caps)"""
+    return admission.stats()
+
+@app.get("/api/admin/password-hasher", dependencies=[Depends(require_admin)])
+async def get_password_hasher_stats():
+    """Password hashing pool usage and queue wait times"""
+    return password_hasher.stats()
+
+@app.get("/api/admin/token-cache", dependencies=[Depends(require_admin)])
+async def get_token_cache_stats():
+    """Verified-token cache hit/miss counters"""
+    return token_cache.stats()
+
+@app.post("/api/admin/token-cache/clear", dependencies=[Depends(require_admin)])
+async def clear_token_cache():
+    """Drop cached verifications, e.g. after rotating SECRET_KEY"""
+    token_cache.clear()
+    return token_cache.stats()
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_worker(
+    seconds: float = Query(10.0, gt=0),
+    interval: Optional[float] = Query(None, ge=0.001, le=1.0),
+    threads: Literal["loop", "all"] = Query("loop"),
+    top: int = Query(30, ge=1, le=500),
+    format: Literal["json", "collapsed"] = Query("json")
+):
+    """Sample this worker's stacks for a few seconds (format=collapsed feeds flamegraph.pl/speedscope)"""
+    try:
+        profile = await profiler.profile(seconds, interval, all_threads=threads == "all", top=top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return PlainTextResponse(profile["collapsed"] + "\n")
+    return profile
+
+@app.get("/api/admin/traces", dependencies=[Depends(require_admin)])
+async def get_request_traces():
+    """Hot-path spans of recent requests sent with the trace header (X-Trace: 1)"""
+    return {"traces": metrics.recent_traces()}
+
+@app.get("/api/admin/referral-codes", dependencies=[Depends(require_admin)])
+async def get_referral_code_stats():
+    """Referral code allocator usage and per-code allocation cost"""
+    return referral_codes.stats()
+
+@app.get("/api/admin/storage", dependencies=[Depends(require_admin)])
+async def get_storage_health():
+    """Storage backend and connection pool health"""
+    return storage.health()
+
+@app.post("/api/admin/storage/snapshot", dependencies=[Depends(require_admin)])
+async def take_storage_snapshot():
+    """Write a snapshot of the in-memory store now and trim the journal"""
+    if getattr(storage, "persistence", None) is None:
+        raise HTTPException(status_code=400, detail="Persistence is not enabled (set MEMORY_DATA_DIR)")
+    return await storage.snapshot()
+
+@app.post("/api/admin/import", status_code=202, dependencies=[Depends(require_admin)])
+async def start_bulk_import(request: Request, format: str = Query("jsonl")):
+    """Stream a JSONL/CSV body of users into storage; poll the returned job for progress"""
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    job = await bulk_importer.submit(request.stream(), format)
+    return job.to_dict()
+
+@app.get("/api/admin/import", dependencies=[Depends(require_admin)])
+async def list_bulk_imports():
+    """Recent import jobs, newest first"""
+    return {"jobs": bulk_importer.list_jobs()}
+
+@app.get("/api/admin/import/{job_id}", dependencies=[Depends(require_admin)])
+async def get_bulk_import(job_id: str):
+    """Progress of an import job"""
+    job = bulk_importer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
+
+@app.get("/api/admin/import/{job_id}/errors", dependencies=[Depends(require_admin)])
+async def get_bulk_import_errors(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """Rejected rows of an import job with the reason for each"""
+    job = bulk_importer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return {
+        "errors": job.errors[offset:offset + limit],
+        "total": job.rejected,
+        "dropped": job.errors_dropped,
+        "offset": offset,
+        "limit": limit
     }
 
 @app.get("/api/leaderboard")
-async def get_leaderboard():
+async def get_leaderboard(request: Request, offset: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100)):
     """Get top performers leaderboard"""
-    users_list = list(users_db.values())
-    users_list.sort(key=lambda x: x['total_referrals'], reverse=True)
-    
+    versions = await storage.resource_versions()
+    return await etags.respond(
+        request, ("leaderboard", offset, limit), etags.tag("leaderboard", versions['leaderboard']),
+        lambda: leaderboard_page(offset, limit)
+    )
+
+async def leaderboard_page(offset: int, limit: int) -> dict:
     leaderboard = []
-    for i, user in enumerate(users_list[:10]):
+    for i, user in enumerate(await storage.leaderboard(limit, offset)):
         leaderboard.append({
-            "rank": i + 1,
+            "rank": offset + i + 1,
             "user_name": f"{user['first_name']} {user['last_name']}",
             "total_referrals": user['total_referrals'],
             "total_earnings": user['total_earnings']
         })
     
-    return {"leaderboard": leaderboard}
+    return {
+        "leaderboard": leaderboard,
+        "offset": offset,
+        "limit": limit,
+        "total": await storage.count_users()
+    }
+
+@app.get("/api/leaderboard/me")
+async def get_my_rank(current_user: dict = Depends(get_current_user)):
+    """Get the current user's leaderboard position"""
+    return {
+        "rank": await storage.user_rank(current_user['id']),
+        "total_users": await storage.count_users(),
+        "total_referrals": current_user['total_referrals'],
+        "total_earnings": current_user['total_earnings']
+    }
 
 if __name__ == "__main__":
-    import random
+    import uvicorn
     print("🚀 Starting CloudWalk Referral API with FastAPI")
     print("📊 Automatic API Documentation: http://localhost:3002/docs")
     print("📖 Alternative Docs: http://localhost:3002/redoc")
     print("🎯 Health Check: http://localhost:3002/health")
     
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and storage.name == "memory":
+        raise SystemExit("❌ WEB_CONCURRENCY > 1 needs shared state: set STORAGE_BACKEND=sqlite or postgres")
     uvicorn.run(
-        app, 
+        "main:app",
         host="0.0.0.0", 
         port=3002,
-        reload=True,  # Auto-reload on code changes
+        reload=workers == 1,  # Auto-reload on code changes (single dev worker only)
+        workers=workers,
         log_level="info"
     )
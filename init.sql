@@ -11,15 +11,25 @@ CREATE TABLE IF NOT EXISTS users (
     referral_code VARCHAR(20) UNIQUE NOT NULL,
     total_referrals INTEGER DEFAULT 0,
     total_earnings DECIMAL(10,2) DEFAULT 0.00,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    referrer_id VARCHAR(255),  -- user whose code or link brought this one in
+    version BIGINT NOT NULL DEFAULT 0,  -- bumped by users_row_version on every change (profile/achievements ETags)
+    change_seq BIGINT NOT NULL DEFAULT 0  -- user_change_seq value of the latest insert or update (tailed by the workers)
 );
 
+-- Databases created before the referral graph
+ALTER TABLE users ADD COLUMN IF NOT EXISTS referrer_id VARCHAR(255);
+-- Databases created before ETags
+ALTER TABLE users ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+-- Databases created before incremental worker sync
+ALTER TABLE users ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0;
+
 -- Referral links table
 CREATE TABLE IF NOT EXISTS referral_links (
     id VARCHAR(255) PRIMARY KEY,
     user_id VARCHAR(255) NOT NULL,
     user_name VARCHAR(255) NOT NULL,
-    link_code VARCHAR(20) UNIQUE NOT NULL,
+    link_code VARCHAR(64) UNIQUE NOT NULL,
     full_url TEXT NOT NULL,
     click_count INTEGER DEFAULT 0,
     registration_count INTEGER DEFAULT 0,
@@ -30,12 +40,22 @@ CREATE TABLE IF NOT EXISTS referral_links (
 -- Referral clicks table
 CREATE TABLE IF NOT EXISTS referral_clicks (
     id SERIAL PRIMARY KEY,
-    link_code VARCHAR(20) NOT NULL,
+    link_code VARCHAR(64) NOT NULL,
     ip_address VARCHAR(45),
     user_agent TEXT,
     clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_registration BOOLEAN DEFAULT FALSE,
-    completed_email VARCHAR(255)
+    completed_email VARCHAR(255),
+    -- the duplicate filter's verdict when the click was taken
+    duplicate BOOLEAN DEFAULT FALSE
+);
+ALTER TABLE referral_clicks ADD COLUMN IF NOT EXISTS duplicate BOOLEAN DEFAULT FALSE;
+
+-- Unique-visitor sketches (HyperLogLog registers) per link, complete up to a click id
+CREATE TABLE IF NOT EXISTS click_sketches (
+    link_id VARCHAR(255) PRIMARY KEY,
+    registers BYTEA NOT NULL,
+    up_to_id INTEGER NOT NULL
 );
 
 -- User achievements table
@@ -57,6 +77,191 @@ CREATE TABLE IF NOT EXISTS admin_users (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Counter behind referral codes; each value maps to a unique code (see backend/referral_codes.py)
+CREATE SEQUENCE IF NOT EXISTS referral_code_seq MINVALUE 1 START 1;
+
+-- Numbers every insert or update of a user; workers tail users by it to keep
+-- their referral graph and cohorts current (see backend/worker_sync.py)
+CREATE SEQUENCE IF NOT EXISTS user_change_seq;
+
+-- Logged-out tokens (sha256), shared by every app instance until they expire.
+-- Each instance polls the ones revoked since its last look (revoked_at)
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_hash VARCHAR(64) PRIMARY KEY,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+ALTER TABLE revoked_tokens ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens(revoked_at);
+
+-- Days each user was active (logins and authenticated requests), behind the
+-- cohort activity metric; instances tail it by id
+CREATE TABLE IF NOT EXISTS user_activity (
+    id BIGSERIAL PRIMARY KEY,
+    user_id VARCHAR(255) NOT NULL,
+    day INTEGER NOT NULL,
+    UNIQUE (user_id, day)
+);
+
+-- System-wide running totals for /api/admin/stats, kept by triggers. Every
+-- write in the app bumps them, so they are spread over 16 rows: each backend
+-- connection adds its deltas to its own shard (pg_backend_pid() % 16), and
+-- the system_stats view sums the shards. A transaction always touches the
+-- same shard, so two writers never wait on each other in opposite orders.
+CREATE TABLE IF NOT EXISTS system_stats_shards (
+    shard SMALLINT PRIMARY KEY CHECK (shard >= 0 AND shard < 16),
+    total_users BIGINT NOT NULL DEFAULT 0,
+    total_links BIGINT NOT NULL DEFAULT 0,
+    total_referrals BIGINT NOT NULL DEFAULT 0,
+    total_earnings DECIMAL(14,2) NOT NULL DEFAULT 0,
+    total_clicks BIGINT NOT NULL DEFAULT 0,
+    total_registrations BIGINT NOT NULL DEFAULT 0,
+    -- Bumped with every change to the leaderboard / the totals (ETags); only
+    -- ever incremented, so their sum never goes back
+    leaderboard_version BIGINT NOT NULL DEFAULT 0,
+    stats_version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Databases created before the shards kept everything in a single-row table
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('system_stats')) = 'r' THEN
+        ALTER TABLE system_stats ADD COLUMN IF NOT EXISTS leaderboard_version BIGINT NOT NULL DEFAULT 0;
+        ALTER TABLE system_stats ADD COLUMN IF NOT EXISTS stats_version BIGINT NOT NULL DEFAULT 0;
+        INSERT INTO system_stats_shards (shard, total_users, total_links, total_referrals, total_earnings,
+                                         total_clicks, total_registrations, leaderboard_version, stats_version)
+        SELECT 0, total_users, total_links, total_referrals, total_earnings,
+               total_clicks, total_registrations, leaderboard_version, stats_version
+        FROM system_stats
+        ON CONFLICT (shard) DO NOTHING;
+        DROP TABLE system_stats;
+    END IF;
+END;
+$$;
+
+INSERT INTO system_stats_shards (shard) SELECT generate_series(0, 15) ON CONFLICT (shard) DO NOTHING;
+
+CREATE OR REPLACE VIEW system_stats AS
+SELECT sum(total_users)::BIGINT AS total_users,
+       sum(total_links)::BIGINT AS total_links,
+       sum(total_referrals)::BIGINT AS total_referrals,
+       sum(total_earnings)::DECIMAL(14,2) AS total_earnings,
+       sum(total_clicks)::BIGINT AS total_clicks,
+       sum(total_registrations)::BIGINT AS total_registrations,
+       sum(leaderboard_version)::BIGINT AS leaderboard_version,
+       sum(stats_version)::BIGINT AS stats_version
+FROM system_stats_shards;
+
+CREATE OR REPLACE FUNCTION stats_shard() RETURNS SMALLINT AS $$
+    SELECT (pg_backend_pid() % 16)::SMALLINT;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION track_user_totals() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE system_stats_shards SET
+            total_users = total_users + 1,
+            total_referrals = total_referrals + COALESCE(NEW.total_referrals, 0),
+            total_earnings = total_earnings + COALESCE(NEW.total_earnings, 0),
+            leaderboard_version = leaderboard_version + 1,
+            stats_version = stats_version + 1
+        WHERE shard = stats_shard();
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE system_stats_shards SET
+            total_referrals = total_referrals + COALESCE(NEW.total_referrals, 0) - COALESCE(OLD.total_referrals, 0),
+            total_earnings = total_earnings + COALESCE(NEW.total_earnings, 0) - COALESCE(OLD.total_earnings, 0),
+            leaderboard_version = leaderboard_version + 1,
+            stats_version = stats_version + 1
+        WHERE shard = stats_shard();
+    ELSE
+        UPDATE system_stats_shards SET
+            total_users = total_users - 1,
+            total_referrals = total_referrals - COALESCE(OLD.total_referrals, 0),
+            total_earnings = total_earnings - COALESCE(OLD.total_earnings, 0),
+            leaderboard_version = leaderboard_version + 1,
+            stats_version = stats_version + 1
+        WHERE shard = stats_shard();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_link_totals() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE system_stats_shards SET
+            total_links = total_links + 1,
+            total_clicks = total_clicks + COALESCE(NEW.click_count, 0),
+            total_registrations = total_registrations + COALESCE(NEW.registration_count, 0),
+            stats_version = stats_version + 1
+        WHERE shard = stats_shard();
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE system_stats_shards SET
+            total_clicks = total_clicks + COALESCE(NEW.click_count, 0) - COALESCE(OLD.click_count, 0),
+            total_registrations = total_registrations + COALESCE(NEW.registration_count, 0) - COALESCE(OLD.registration_count, 0),
+            stats_version = stats_version + 1
+        WHERE shard = stats_shard();
+    ELSE
+        UPDATE system_stats_shards SET
+            total_links = total_links - 1,
+            total_clicks = total_clicks - COALESCE(OLD.click_count, 0),
+            total_registrations = total_registrations - COALESCE(OLD.registration_count, 0),
+            stats_version = stats_version + 1
+        WHERE shard = stats_shard();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Per-user version behind the profile/achievements ETags, and the change number
+CREATE OR REPLACE FUNCTION bump_user_version() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        NEW.version := OLD.version + 1;
+    END IF;
+    NEW.change_seq := nextval('user_change_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION touch_achievement_owner() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE users SET version = version + 1 WHERE id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_leaderboard_names() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE system_stats_shards SET leaderboard_version = leaderboard_version + 1 WHERE shard = stats_shard();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_system_totals ON users;
+CREATE TRIGGER users_system_totals
+    AFTER INSERT OR DELETE OR UPDATE OF total_referrals, total_earnings ON users
+    FOR EACH ROW EXECUTE FUNCTION track_user_totals();
+
+DROP TRIGGER IF EXISTS referral_links_system_totals ON referral_links;
+CREATE TRIGGER referral_links_system_totals
+    AFTER INSERT OR DELETE OR UPDATE OF click_count, registration_count ON referral_links
+    FOR EACH ROW EXECUTE FUNCTION track_link_totals();
+
+DROP TRIGGER IF EXISTS users_row_version ON users;
+CREATE TRIGGER users_row_version
+    BEFORE INSERT OR UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION bump_user_version();
+
+DROP TRIGGER IF EXISTS user_achievements_row_version ON user_achievements;
+CREATE TRIGGER user_achievements_row_version
+    AFTER INSERT ON user_achievements
+    FOR EACH ROW EXECUTE FUNCTION touch_achievement_owner();
+
+DROP TRIGGER IF EXISTS users_leaderboard_names ON users;
+CREATE TRIGGER users_leaderboard_names
+    AFTER UPDATE OF first_name, last_name ON users
+    FOR EACH ROW EXECUTE FUNCTION track_leaderboard_names();
+
 -- Insert default admin user
 INSERT INTO admin_users (name, email, password_hash) 
 VALUES ('CloudWalk Admin', 'admin@cloudwalk.com', 'e10adc3949ba59abbe56e057f20f883e')
@@ -64,10 +269,14 @@ ON CONFLICT (email) DO NOTHING;
 
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower ON users(lower(email));
 CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code);
+CREATE INDEX IF NOT EXISTS idx_users_leaderboard ON users(total_referrals DESC, total_earnings DESC, id);
+CREATE INDEX IF NOT EXISTS idx_users_change_seq ON users(change_seq);
 CREATE INDEX IF NOT EXISTS idx_referral_links_user_id ON referral_links(user_id);
 CREATE INDEX IF NOT EXISTS idx_referral_links_link_code ON referral_links(link_code);
 CREATE INDEX IF NOT EXISTS idx_referral_clicks_link_code ON referral_clicks(link_code);
+CREATE INDEX IF NOT EXISTS idx_referral_clicks_clicked_at ON referral_clicks(clicked_at);
 CREATE INDEX IF NOT EXISTS idx_user_achievements_user_id ON user_achievements(user_id);
 
 